@@ -1,11 +1,30 @@
 from collections import namedtuple
 from position import Position2D
-import threading
+import itertools
 import logging
+from scheduler import call_later
 
 from views import View
 
-class LevelableStats:
+# Shared by all stats objects, next() on it is atomic so stamina restored on the
+# scheduler thread can't lose a change made at the same time by the network thread
+versions = itertools.count(1)
+
+class TrackedStats:
+    """Stats that take a new version whenever one of them is set, so views can skip redrawing them."""
+    __slots__ = ('version',)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, 'version', next(versions))
+
+    def items(self):
+        """(name, value) of every stat, in the order they are declared."""
+        return [(name, getattr(self, name)) for name in type(self).__slots__]
+
+class LevelableStats(TrackedStats):
+    __slots__ = ('max_health', 'max_stamina', 'max_mana', 'strength', 'defence', 'speed')
+
     def __init__(self):
         self.max_health = 5
         self.max_stamina = 5
@@ -14,7 +33,9 @@ class LevelableStats:
         self.defence = 5
         self.speed = 5
 
-class Stats:
+class Stats(TrackedStats):
+    __slots__ = ('level', 'xp', 'level_cost', 'levels', 'health', 'stamina', 'mana')
+
     def __init__(self):
         self.level = 1
         self.xp = 0
@@ -56,7 +77,7 @@ class Character:
         if kwargs.get('player_id') == self.connection.player_id:
             # self.add_xp(1)
             self.stats.stamina -= 1
-            threading.Timer(5, self.restore_stamina).start()
+            call_later(5, self.restore_stamina)
         return
     
     def character_worked_tile(self, *args, **kwargs):
@@ -66,7 +87,7 @@ class Character:
         if kwargs.get('player_id') == self.connection.player_id:
             # self.add_xp(1)
             self.stats.stamina -= 1
-            threading.Timer(5, self.restore_stamina).start()
+            call_later(5, self.restore_stamina)
         return
     
     def character_add_xp(self, *args, **kwargs):
@@ -1,23 +1,24 @@
 
 import json
+import re
 import socket
 import sys
 import threading
 import traceback
+import time
+from collections import Counter, deque
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
 from position import Position2D
-from map import GameMapEncoderDecoder
-import gzip 
-from struct import unpack
+from map import GameMap
 import os 
 import logging
 from event_manager import EventManager
+from scheduler import call_later
+from framing import FrameDecoder, FrameTooLarge
+from codec import CODECS, DEFAULT_CODEC, decode_packet
 
-# Global variable to hold player positions
-player_positions = {}
-positions_lock = threading.Lock()  # Lock for thread-safe access to player_positions
-
-map = {}
-map_lock = threading.Lock()  # Lock for thread-safe access to player_positions
+packet_log = logging.getLogger('packets')  # High frequency, sampled and off unless at DEBUG
 
 global_exit_flag = False
 
@@ -25,84 +26,408 @@ global_exit_flag = False
 class ExitThread(Exception):
     pass
 
+MESSAGE_HISTORY_SIZE = 200  # Messages kept for the bottom panel
+# Sent many times a second, only counted unless MessageHistory is told otherwise
+COLLAPSED_CATEGORIES = ('tick', 'position', 'move_ack')
+MOVE_SEND_INTERVAL = 1 / 20  # Seconds between move updates, unless the server says how often it ticks
+
+def message_category(command):
+    """What kind of packet command is, for MessageHistory."""
+    if command.get('request'):
+        return command['request']
+    if 'tick' in command:
+        return 'tick'
+    if 'move_ack' in command:
+        return 'move_ack'
+    if command.get('new_position'):
+        return 'position'
+    if command.get('origin'):
+        return command['origin']
+    if command.get('gift'):
+        return 'gift'
+    if command.get('message'):
+        return 'message'
+    return None
+
 class MessageHistory:
-    def __init__(self):
-        self.messages = []
+    """The last capacity messages, kept as received and only turned into text when shown.
 
-    def add_message(self, message: str):
+    Messages in the collapsed categories aren't kept, just counted.
+    """
+    def __init__(self, capacity=MESSAGE_HISTORY_SIZE, collapsed=COLLAPSED_CATEGORIES):
+        self.messages = deque(maxlen=capacity)
+        self.collapsed = set(collapsed)
+        self.counts = Counter()  # category -> messages received
+        self.lock = threading.Lock()  # Added to by the receive thread, read by the main loop
+
+    def add_message(self, message, category=None):
         """Add a new message to the history."""
-        self.messages.append(message)
+        with self.lock:
+            self.counts[category] += 1
+            if category not in self.collapsed:
+                self.messages.append(message)
 
     def get_last_messages(self, count: int) -> list:
         """Retrieve the last X messages from the history."""
         if count <= 0:
             return []
-        return self.messages[-count:]
+        with self.lock:
+            start = max(0, len(self.messages) - count)
+            last = [self.messages[index] for index in range(start, len(self.messages))]
+        return [str(message) for message in last]
+
+    def collapsed_counts(self):
+        """'12 tick, 3 position' for the collapsed categories received so far."""
+        with self.lock:
+            counts = [(category, self.counts[category]) for category in sorted(self.collapsed) if self.counts[category]]
+        return ', '.join(f"{count} {category}" for category, count in counts)
 
     def __str__(self):
         """Return a string representation of the message history."""
-        return "\n".join(self.messages)
+        with self.lock:
+            messages = list(self.messages)
+        return "\n".join(str(message) for message in messages)
+
+class PredictedMoves:
+    """Moves the character straight away and tells the server about it at most once an interval.
+
+    Each move gets a sequence number and is kept until the server acknowledges
+    it. Arrow keys held down only send the latest position once an interval,
+    with the sequence number of the last move it includes. When the server
+    puts the character somewhere else than predicted, it is moved there and
+    the moves the server hadn't seen yet are made again from there.
+    """
+    def __init__(self, interval=MOVE_SEND_INTERVAL):
+        self.interval = interval
+        self.seq = 0  # Sequence number of the latest move
+        self.sent_seq = 0  # Sequence number of the latest move sent
+        self.next_send = 0.0  # time.monotonic() the next update may be sent at
+        self.pending = deque()  # (seq, dx, dy, position predicted) of moves not acknowledged yet
+        self.ack = None  # Latest (seq, position) from the server, set by the receive thread
+        self.reconciled_seq = 0  # Sequence number of the last ack reconcile handled
+
+    def move(self, character, game_map, x, y):
+        """Move character to x, y if it can stand there, returns whether it moved."""
+        dx, dy = x - character.position.x, y - character.position.y
+        if not character.moveTo(x, y, game_map):
+            return False
+        self.seq += 1
+        self.pending.append((self.seq, dx, dy, character.position))
+        return True
+
+    def acknowledge(self, seq, position):
+        """The server has handled the moves up to seq and has the character at position."""
+        self.ack = (seq, Position2D(position[0], position[1]))
+
+    def reconcile(self, character, game_map):
+        """Apply the latest acknowledgement, returns True if the character had to be moved."""
+        ack = self.ack
+        if ack is None or ack[0] <= self.reconciled_seq:
+            return False
+        seq, position = ack
+        self.reconciled_seq = seq
+        predicted = None
+        while self.pending and self.pending[0][0] <= seq:
+            predicted = self.pending.popleft()[3]
+        if predicted == position:
+            return False
+        logging.info(f"Server has us at {position} rather than {predicted}, replaying {len(self.pending)} moves")
+        character.position = position
+        replay, self.pending = self.pending, deque()
+        for move_seq, dx, dy, _ in replay:
+            if character.moveTo(character.position.x + dx, character.position.y + dy, game_map):
+                self.pending.append((move_seq, dx, dy, character.position))
+        if self.pending:
+            self.sent_seq = 0  # Where the server has us is out of date, send the corrected position
+        return True
+
+    def time_to_send(self, now):
+        """Seconds until the next update may be sent, None if there is nothing to send."""
+        if self.sent_seq == self.seq:
+            return None
+        return max(0.0, self.next_send - now)
+
+    def flush(self, connection, character, now):
+        """Send the latest position if there is one to send and the interval has passed."""
+        if self.time_to_send(now) != 0:
+            return False
+        connection.send_position_update(character, self.seq)
+        self.sent_seq = self.seq
+        self.next_send = now + self.interval
+        return True
+
+class WorldSnapshot(NamedTuple):
+    """The world as the renderer sees it, published whole by the receive thread and never changed."""
+    version: int  # Counts the snapshots a connection has published
+    game_map: GameMap
+    player_positions: Mapping  # player id -> Position2D of the other players we know about
+
+class MapBuffers:
+    """Copies of the receive thread's map for the main thread, brought up to date tile by tile.
+
+    Copying the whole map for every batch takes time in proportion to its size.
+    Instead a copy the main thread has finished with is reused, and only the
+    tiles changed since it was last published are copied into it. The main
+    thread is done with a copy once it has picked up a newer snapshot, see
+    Connection.read_snapshot. Until then a new copy is made.
+    """
+    def __init__(self, count=2):
+        self.count = count  # Copies kept for reuse
+        self.buffers = []  # [map, snapshot version it was last published in, indexes changed since or None for all]
+        self.reader_version = 0  # Version of the snapshot the main thread picked up last
+
+    def changed(self, indexes=None):
+        """Note the tiles of the receive thread's map that changed, None if any may have."""
+        for buffer in self.buffers:
+            if indexes is None:
+                buffer[2] = None
+            elif buffer[2] is not None:
+                buffer[2].update(indexes)
+
+    def publish(self, game_map, version):
+        """A copy of game_map, up to date, for snapshot version."""
+        for buffer in self.buffers:
+            copy, published, stale = buffer
+            if published < self.reader_version and stale is not None:
+                copy.copy_tiles_from(game_map, stale)
+                buffer[1], buffer[2] = version, set()
+                return copy
+        copy = game_map.copy()
+        if len(self.buffers) >= self.count:
+            self.buffers.remove(min(self.buffers, key=lambda buffer: buffer[1]))
+        self.buffers.append([copy, version, set()])
+        return copy
+
+    def republish(self, copy, version):
+        """copy is published again, unchanged, in snapshot version."""
+        for buffer in self.buffers:
+            if buffer[0] is copy:
+                buffer[1] = version
+
+class Wakeup:
+    """Self pipe that another thread sets to wake a thread waiting in select on it."""
+    def __init__(self):
+        # A socket pair rather than os.pipe so it can be selected on Windows too
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def set(self):
+        try:
+            self.writer.send(b'\0')
+        except OSError:
+            pass  # Already full of wakeups, or closed
+
+    def clear(self):
+        """Read every pending wakeup, returns True if there were any."""
+        woken = False
+        try:
+            while self.reader.recv(4096):
+                woken = True
+        except OSError:
+            pass
+        return woken
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+TERRAIN_HASH = re.compile(r'[0-9a-f]{64}')  # GameMap.get_terrain_hash is a SHA-256 hex digest
+
+def is_terrain_hash(value):
+    return isinstance(value, str) and TERRAIN_HASH.fullmatch(value) is not None
+
+class TerrainCache:
+    """On disk cache of map terrain, keyed by the terrain hash the server advertises.
+
+    Terrain never changes between sessions, so with a cache hit only the tile
+    state has to be downloaded.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'py-curses-client', 'maps')
+
+    def path(self, terrain_hash):
+        # The hash comes from the server, anything else could name a file outside cache_dir
+        if not is_terrain_hash(terrain_hash):
+            raise ValueError(f"Not a terrain hash: {terrain_hash!r}")
+        return os.path.join(self.cache_dir, f"{terrain_hash}.json")
+
+    def load(self, terrain_hash, event_manager):
+        """Return a map with the cached terrain, or None if there is no valid entry."""
+        if not terrain_hash:
+            return None
+        if not is_terrain_hash(terrain_hash):
+            logging.warning(f"Ignoring terrain hash {terrain_hash!r} from the server, it isn't a SHA-256 hex digest")
+            return None
+        try:
+            with open(self.path(terrain_hash)) as f:
+                data = json.load(f)
+            game_map = GameMap(event_manager, data['width'], data['height'], data['terrain'])
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            logging.warning(f"Ignoring broken terrain cache entry {terrain_hash}: {ex}")
+            return None
+        if game_map.get_terrain_hash() != terrain_hash:
+            logging.warning(f"Terrain cache entry {terrain_hash} doesn't match its hash")
+            return None
+        return game_map
+
+    def save(self, game_map):
+        terrain_hash = game_map.get_terrain_hash()
+        data = {'width': game_map.width, 'height': game_map.height, 'terrain': game_map.terrain_string()}
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so a crash can't leave a half written entry
+            temporary_path = f"{self.path(terrain_hash)}.{os.getpid()}.tmp"
+            with open(temporary_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(temporary_path, self.path(terrain_hash))
+        except OSError as ex:
+            logging.warning(f"Unable to cache terrain {terrain_hash}: {ex}")
 
 class Connection:
-    def __init__(self, host='127.0.0.1', port=43210, username='Player1'):
+    def __init__(self, host='127.0.0.1', port=43210, username='Player1', codecs=('struct', 'json'), cache_dir=None):
         self.host = host
         self.port = port
         self.username = username
+        self.codecs = codecs
+        self.codec = DEFAULT_CODEC
+        self.decoder = FrameDecoder()
+        self.backlog = []  # Packets that arrived while waiting for a response
+        self.map_buffers = MapBuffers()  # The copies of self.map snapshots share, see publish_snapshot
+        self.terrain_cache = TerrainCache(cache_dir)
+        self.startup_timings = {}  # step -> seconds, to see where joining spends its time
+        started = time.perf_counter()
         self.client_socket = self.create_connection(host, port, username)
+        self.time_startup_step('connect', started)
+        self.codec = self.negotiate_codec()
+        self.time_startup_step('handshake', started)
+        self.map = self.terrain_cache.load(self.server_terrain_hash, EventManager())
+        if self.map:
+            self.map.track_deadlines = False
+        self.time_startup_step('terrain_cache', started)
         self.map = self.download_map()
+        self.time_startup_step('map', started)
         self.player_id = self.get_id()
+        self.time_startup_step('id', started)
+        logging.info(f"Startup timings: {self.startup_timings}")
         self.message_history = MessageHistory()
+        self.exit_flag = False
+        # Back buffer the receive thread applies packets to, see publish_snapshot
+        self.player_positions = {}
+        self.map_changed = self.positions_changed = True
+        self.snapshot = None
+        self.publish_snapshot()
+        self.wakeup = Wakeup()  # Set whenever received packets changed something worth redrawing
+        # Moves are sent once a server tick
+        self.moves = PredictedMoves(1 / self.server_tick_rate if self.server_tick_rate else MOVE_SEND_INTERVAL)
         # Start a thread to receive messages from the server
         self.network_thread = threading.Thread(target=self.receive_messages, args=(), daemon=True)
         self.network_thread.start()
-        self.exit_flag = False
-        threading.Timer(1, self.get_players).start()
+        call_later(1, self.get_players)
         self.get_players()
 
+    def time_startup_step(self, step, started):
+        """Record how long step took, given when startup began."""
+        elapsed = time.perf_counter() - started
+        self.startup_timings[step] = elapsed - sum(self.startup_timings.values())
+
     def get_id(self):
         data_packet = {
             'request': 'id',
         }
-        self.client_socket.sendall(json.dumps(data_packet).encode('utf-8'))
-        data = self.client_socket.recv(1024).decode('utf-8')
-        data = json.loads(data)
-        # send our 0 ack
-        assert len(b'\00') == 1
-        self.client_socket.sendall(b'\00')
+        self.client_socket.sendall(self.codec.encode(data_packet))
+        data = self.wait_for_response('id')
         return data['id']
     
     def get_players(self):
         data_packet = {
             'request': 'players',
         }
-        self.client_socket.sendall(json.dumps(data_packet).encode('utf-8'))
+        self.client_socket.sendall(self.codec.encode(data_packet))
+
+    def read_packets(self):
+        """Block until at least one complete packet has been received and return them."""
+        packets = []
+        while not packets:
+            if not self.decoder.recv_into(self.client_socket):
+                raise ConnectionError("Connection closed by server")
+            packets = [decode_packet(flags, payload) for flags, payload in self.decoder.frames()]
+        return packets
+
+    def wait_for_response(self, request):
+        """Read packets until the response to request arrives, keeping the others for later."""
+        while True:
+            for packet in self.read_packets():
+                if packet.get('request') == request:
+                    return packet
+                self.backlog.append(packet)
 
     def download_map(self):
+        """Fetch the map before the receive thread is running."""
+        self.request_map()
+        return self.apply_map_snapshot(self.wait_for_response('map')['snapshot'])
+
+    def request_map(self):
+        """Ask for the map, or if we already have one just the changes since we last synced it."""
         data_packet = {
             'request': 'map',
         }
-        self.client_socket.sendall(json.dumps(data_packet).encode('utf-8'))
-        while True:
-            bs = self.client_socket.recv(8)
-            logging.info(f"Raw bytes received for length: {bs}")
-            (length,) = unpack('>Q', bs)  # Unpack the length
-            logging.info(f"Unpacked length: {length}")  # Print the unpacked length
-            data = b''
-            while len(data) < length:
-                # doing it in batches is generally better than trying
-                # to do it all in one go, so I believe.
-                to_read = length - len(data)
-                data += self.client_socket.recv(
-                    4096 if to_read > 4096 else to_read)
-
-            # send our 0 ack
-            assert len(b'\00') == 1
-            self.client_socket.sendall(b'\00')
-
-            map_data = gzip.decompress(data)
-            # logging.info(f"map_data {map_data}")
-            # Step 2: Write the output to a file
-            return GameMapEncoderDecoder.from_dict(json.loads(map_data.decode())['map'])
+        if self.map:
+            data_packet['since'] = self.map.synced_version
+            data_packet['epoch'] = self.map.epoch
+            data_packet['terrain_hash'] = self.map.get_terrain_hash()
+        self.client_socket.sendall(self.codec.encode(data_packet))
+
+    def apply_map_snapshot(self, snapshot):
+        logging.info(f"Map version {snapshot['version']}, {len(snapshot['tiles'])} tiles, delta {snapshot['delta']}")
+        if 'terrain' in snapshot:
+            event_manager = self.map.event_manager if self.map else EventManager()
+            game_map = GameMap.from_snapshot(event_manager, snapshot)
+            game_map.track_deadlines = False  # We never sweep, the server sends tile_worked and tile_ready
+            self.terrain_cache.save(game_map)
+            self.map_buffers.changed()
+            return game_map
+        # Same terrain, keep our map and update the tile state
+        self.map.apply_snapshot(snapshot)
+        self.map_buffers.changed([tile[0] for tile in snapshot['tiles']] if snapshot['delta'] else None)
+        return self.map
+
+    def publish_snapshot(self):
+        """Hand the renderer everything applied since the last snapshot, in one assignment.
+
+        Only the receive thread changes self.map and self.player_positions, so
+        it copies them without a lock and the renderer reads the copies without one.
+        """
+        if not (self.map_changed or self.positions_changed):
+            return False
+        previous = self.snapshot
+        version = previous.version + 1 if previous else 1
+        # Whatever didn't change is shared with the previous snapshot rather than copied again
+        if self.map_changed:
+            game_map = self.map_buffers.publish(self.map, version)
+        else:
+            game_map = previous.game_map
+            self.map_buffers.republish(game_map, version)
+        player_positions = (MappingProxyType(dict(self.player_positions)) if self.positions_changed
+                            else previous.player_positions)
+        self.snapshot = WorldSnapshot(version, game_map, player_positions)
+        self.map_changed = self.positions_changed = False
+        return True
+
+    def read_snapshot(self):
+        """The latest snapshot, for the main thread.
+
+        The maps of older snapshots are reused once this is called, so the main
+        thread mustn't keep using a snapshot after reading a newer one.
+        """
+        snapshot = self.snapshot
+        self.map_buffers.reader_version = snapshot.version
+        return snapshot
 
 
     def create_connection(self, host='127.0.0.1', port=43210, username='Player1'):
@@ -111,11 +436,21 @@ class Connection:
         client_socket.connect((host, port))
         initial_state = {
             'player_id': username,
-            'position': Position2D(0,0)
+            'position': Position2D(0,0),
+            'request': 'hello',
+            'codecs': list(self.codecs),
         }
-        client_socket.sendall(json.dumps(initial_state).encode('utf-8'))
+        client_socket.sendall(self.codec.encode(initial_state))
         
         return client_socket
+
+    def negotiate_codec(self):
+        """Wait for the server to pick one of the codecs offered in create_connection."""
+        data = self.wait_for_response('hello')
+        logging.info(f"Using {data['codec']} codec")
+        self.server_terrain_hash = data.get('terrain_hash')
+        self.server_tick_rate = data.get('tick_rate')
+        return CODECS[data['codec']]
     
     def close_connection(self):
         self.client_socket.shutdown(socket.SHUT_RDWR)
@@ -128,7 +463,7 @@ class Connection:
             'action': 'fight_action',
             'fight_action' : fight_action
         }
-        return self.client_socket.sendall(json.dumps(initial_state).encode('utf-8'))
+        return self.client_socket.sendall(self.codec.encode(initial_state))
 
     def send_action(self, character, action):
         initial_state = {
@@ -136,59 +471,104 @@ class Connection:
             'position': character.position,
             'action': action
         }
-        logging.info(initial_state)
-        return self.client_socket.sendall(json.dumps(initial_state).encode('utf-8'))
+        packet_log.debug("Sending %s", initial_state)
+        return self.client_socket.sendall(self.codec.encode(initial_state))
     
     def send_message(self, message):
         initial_state = {
             'player_id': self.player_id,
             'message': message,
         }
-        return self.client_socket.sendall(json.dumps(initial_state).encode('utf-8'))
+        return self.client_socket.sendall(self.codec.encode(initial_state))
 
     def send_tile_update(self, character):
         self.send_action(character, "farm")
 
-    def send_position_update(self, character):
-        self.send_action(character, "move")
+    def send_position_update(self, character, seq=None):
+        if seq is None:
+            return self.send_action(character, "move")
+        data_packet = {
+            'player_id': self.player_id,
+            'position': character.position,
+            'action': 'move',
+            'seq': seq,
+        }
+        return self.client_socket.sendall(self.codec.encode(data_packet))
 
     def receive_messages(self):
         """Thread to receive messages from the server and update player positions."""
-        global player_positions
+        try:
+            self.receive_packets()
+        finally:
+            self.wakeup.set()  # Let the main loop see that we have stopped
+
+    def receive_packets(self):
         global global_exit_flag
         logging.info("starting receive messages thread")
+        try:
+            # Handle anything that arrived while the map and id were downloading
+            while self.backlog:
+                self.handle_command(self.backlog.pop(0))
+        except ExitThread:
+            logging.info("Worker thread exiting due to ExitThread exception.")
+            return
+        self.publish_snapshot()
+        self.wakeup.set()
         while not (global_exit_flag or self.exit_flag):
             try:
-                data = self.client_socket.recv(1024).decode('utf-8')
-                if not data:
+                if not self.decoder.recv_into(self.client_socket):
                     break  # Connection closed
-                logging.info(data)
-                # Process the received data
-                messages = data.splitlines()  # Assuming each message is on a new line
-                for message in messages:
-                    if message:
-                        try:
-                            command = json.loads(message)
-                            self.handle_command(command)
-                        except json.JSONDecodeError:
-                            logging.error("Received invalid JSON:", message)
-                        except ExitThread:
-                            logging.info("Worker thread exiting due to ExitThread exception.")
-                            return
+                # Process every complete packet received so far
+                for flags, payload in self.decoder.frames():
+                    try:
+                        command = decode_packet(flags, payload)
+                        self.handle_command(command)
+                    except json.JSONDecodeError:
+                        logging.error(f"Received invalid JSON: {bytes(payload)}")
+                    except ExitThread:
+                        logging.info("Worker thread exiting due to ExitThread exception.")
+                        return
+                # The whole batch becomes visible at once
+                self.publish_snapshot()
+                self.wakeup.set()
+            except FrameTooLarge as ex:
+                logging.error(f"Closing the connection to the server: {ex}")
+                break
             except Exception as e:
                 logging.error(f"Error receiving data: {e}")
                 logging.error(repr(traceback.print_exc(e)))
 
     def handle_command(self, command):
         global global_exit_flag
-        logging.info(f"received command : {command}")
-        self.message_history.add_message(str(command))
-        if command.get('new_position'):
+        packet_log.debug("Received %s", command)
+        self.message_history.add_message(command, message_category(command))
+        if command.get('request') == 'map':
+            # Response to request_map while running
+            self.map = self.apply_map_snapshot(command['snapshot'])
+            self.map_changed = True
+        elif 'tick' in command:
+            # One batch per server tick with the latest position of everyone nearby who moved,
+            # or everyone we can see after moving into a new area
+            if command.get('snapshot'):
+                self.player_positions.clear()
+                # Tile changes out here weren't sent to us while we were away
+                self.request_map()
+            for player_id, x, y in command['positions']:
+                if player_id != self.player_id:
+                    self.player_positions[player_id] = Position2D(x, y)
+            for player_id in command.get('left', ()):
+                # Moved out of sight or disconnected
+                self.player_positions.pop(player_id, None)
+            self.positions_changed = True
+            for tile_command in command['tiles']:
+                self.handle_command(tile_command)
+        elif 'move_ack' in command:
+            self.moves.acknowledge(command['move_ack'], command['position'])
+        elif command.get('new_position'):
             player_id = command['player_id']
             position = command['new_position']
-            # Update the player position in a thread-safe manner
-            with positions_lock:
-                player_positions[player_id] = position
+            self.player_positions[player_id] = position
+            self.positions_changed = True
         elif command.get("gift"):
             player_id = command['player_id']
             if player_id == self.player_id and command["amount"]:
@@ -207,21 +587,22 @@ class Connection:
                 self.map.event_manager.publish("fight_concluded")
 
         elif command.get('origin') and command.get('origin') == "tile":
-            logging.info("tile action received")
+            packet_log.debug("Tile action received")
             action = command['action']
             pos_array = command['tile_pos']
             is_success = command['is_success']
             if not is_success:
                 return
             tile_pos = Position2D(pos_array[0], pos_array[1])
-            with map_lock:
-                if command.get("player_id"):
-                    player_id = command['player_id']
-                if action == "working":
-                    self.map.get_tile(tile_pos.x, tile_pos.y).work(player_id)
-                if action == "worked":
-                    self.map.get_tile(tile_pos.x, tile_pos.y).work_complete()
-                if action == "activated":
-                    self.map.get_tile(tile_pos.x, tile_pos.y).cooldown(player_id)
-                if action == "ready":
-                    self.map.get_tile(tile_pos.x, tile_pos.y).cooldown_complete()
\ No newline at end of file
+            if command.get("player_id"):
+                player_id = command['player_id']
+            if action == "working":
+                self.map.get_tile(tile_pos.x, tile_pos.y).work(player_id)
+            if action == "worked":
+                self.map.get_tile(tile_pos.x, tile_pos.y).work_complete()
+            if action == "activated":
+                self.map.get_tile(tile_pos.x, tile_pos.y).cooldown(player_id)
+            if action == "ready":
+                self.map.get_tile(tile_pos.x, tile_pos.y).cooldown_complete()
+            self.map_buffers.changed((tile_pos.y * self.map.width + tile_pos.x,))
+            self.map_changed = True
\ No newline at end of file
@@ -0,0 +1,195 @@
+import json
+import struct
+from enum import IntEnum
+from position import Position2D
+from framing import HEADER, encode_frame, decode_json, FLAG_STRUCT
+
+
+class Opcode(IntEnum):
+    JSON = 0          # Packet without a compact layout, JSON follows the opcode
+    MOVE = 1          # {'player_id', 'position', 'action': 'move'}
+    NEW_POSITION = 2  # {'player_id', 'new_position'}
+    TILE = 3          # {'origin': 'tile', 'action', 'tile_pos', 'is_success'[, 'player_id']}
+    BATCH = 4         # {'tick', 'positions': [[player_id, x, y], ...], 'left': [player_id, ...], 'tiles': [tile packet, ...], 'snapshot'}
+    SEQUENCED_MOVE = 5  # {'player_id', 'position', 'action': 'move', 'seq'}
+    MOVE_ACK = 6        # {'player_id', 'position', 'move_ack'}
+
+
+TILE_ACTIONS = ('working', 'worked', 'activated', 'ready')
+
+# Fixed layouts following the opcode byte
+POSITION_LAYOUT = struct.Struct('!BIhh')    # opcode, player id, x, y
+SEQUENCED_LAYOUT = struct.Struct('!BIhhI')  # opcode, player id, x, y, move sequence number
+TILE_LAYOUT = struct.Struct('!BB?Ihh')      # opcode, action, is_success, player id (0 for none), x, y
+BATCH_LAYOUT = struct.Struct('!BIHHH?')     # opcode, tick, position count, left count, tile count, snapshot
+BATCH_POSITION = struct.Struct('!Ihh')      # player id, x, y; repeated, followed by BATCH_LEFTs
+BATCH_LEFT = struct.Struct('!I')            # player id; repeated, followed by TILE_LAYOUTs
+
+# The same layouts with the frame header in front, so a packet is framed in a single pack call
+POSITION_FRAME = struct.Struct(HEADER.format + POSITION_LAYOUT.format[1:])
+SEQUENCED_FRAME = struct.Struct(HEADER.format + SEQUENCED_LAYOUT.format[1:])
+TILE_FRAME = struct.Struct(HEADER.format + TILE_LAYOUT.format[1:])
+
+MOVE_KEYS = {'player_id', 'position', 'action'}
+SEQUENCED_MOVE_KEYS = MOVE_KEYS | {'seq'}
+MOVE_ACK_KEYS = {'player_id', 'position', 'move_ack'}
+NEW_POSITION_KEYS = {'player_id', 'new_position'}
+TILE_KEYS = {'origin', 'action', 'tile_pos', 'is_success', 'player_id'}
+BATCH_KEYS = {'tick', 'positions', 'left', 'tiles', 'snapshot'}
+
+
+class JsonCodec:
+    """Human readable codec, kept as the fallback and for debugging."""
+    name = 'json'
+
+    def encode(self, packet):
+        return encode_frame(json.dumps(packet).encode('utf-8'))
+
+
+class StructCodec(JsonCodec):
+    """Compact binary codec using fixed struct layouts for the high frequency packets."""
+    name = 'struct'
+
+    def encode(self, packet):
+        try:
+            frame = self.pack(packet)
+        except (struct.error, TypeError, ValueError, IndexError, KeyError):
+            frame = None  # Values don't fit the layout, fall back to JSON
+        if frame is None:
+            payload = bytes((Opcode.JSON,)) + json.dumps(packet).encode('utf-8')
+            frame = encode_frame(payload, FLAG_STRUCT)
+        return frame
+
+    def pack(self, packet):
+        """Return the framed packet if it has a compact layout, otherwise None."""
+        keys = packet.keys()
+        if keys == MOVE_KEYS and packet['action'] == 'move':
+            x, y = packet['position']
+            return POSITION_FRAME.pack(POSITION_LAYOUT.size, FLAG_STRUCT, Opcode.MOVE, packet['player_id'], x, y)
+        if keys == SEQUENCED_MOVE_KEYS and packet['action'] == 'move':
+            x, y = packet['position']
+            return SEQUENCED_FRAME.pack(SEQUENCED_LAYOUT.size, FLAG_STRUCT, Opcode.SEQUENCED_MOVE,
+                                        packet['player_id'], x, y, packet['seq'])
+        if keys == MOVE_ACK_KEYS:
+            x, y = packet['position']
+            return SEQUENCED_FRAME.pack(SEQUENCED_LAYOUT.size, FLAG_STRUCT, Opcode.MOVE_ACK,
+                                        packet['player_id'], x, y, packet['move_ack'])
+        if keys == NEW_POSITION_KEYS:
+            x, y = packet['new_position']
+            return POSITION_FRAME.pack(POSITION_LAYOUT.size, FLAG_STRUCT, Opcode.NEW_POSITION, packet['player_id'], x, y)
+        if self.is_tile(packet):
+            return TILE_FRAME.pack(TILE_LAYOUT.size, FLAG_STRUCT, *self.tile_fields(packet))
+        if keys == BATCH_KEYS and all(self.is_tile(tile) for tile in packet['tiles']):
+            return self.pack_batch(packet)
+        return None
+
+    @staticmethod
+    def is_tile(packet):
+        return packet.get('origin') == 'tile' and packet.keys() <= TILE_KEYS and packet['action'] in TILE_ACTIONS
+
+    @staticmethod
+    def tile_fields(packet):
+        x, y = packet['tile_pos']
+        player_id = packet.get('player_id') or 0
+        return Opcode.TILE, TILE_ACTIONS.index(packet['action']), packet['is_success'], player_id, x, y
+
+    def pack_batch(self, packet):
+        positions = packet['positions']
+        left = packet['left']
+        tiles = packet['tiles']
+        size = (BATCH_LAYOUT.size + len(positions) * BATCH_POSITION.size + len(left) * BATCH_LEFT.size
+                + len(tiles) * TILE_LAYOUT.size)
+        frame = bytearray(HEADER.size + size)
+        HEADER.pack_into(frame, 0, size, FLAG_STRUCT)
+        BATCH_LAYOUT.pack_into(frame, HEADER.size, Opcode.BATCH, packet['tick'], len(positions), len(left), len(tiles),
+                               packet['snapshot'])
+        offset = HEADER.size + BATCH_LAYOUT.size
+        for player_id, x, y in positions:
+            BATCH_POSITION.pack_into(frame, offset, player_id, x, y)
+            offset += BATCH_POSITION.size
+        for player_id in left:
+            BATCH_LEFT.pack_into(frame, offset, player_id)
+            offset += BATCH_LEFT.size
+        for tile in tiles:
+            TILE_LAYOUT.pack_into(frame, offset, *self.tile_fields(tile))
+            offset += TILE_LAYOUT.size
+        return bytes(frame)
+
+    @staticmethod
+    def unpack(payload):
+        opcode = payload[0]
+        if opcode == Opcode.MOVE:
+            _, player_id, x, y = POSITION_LAYOUT.unpack_from(payload)
+            return {'player_id': player_id, 'position': Position2D(x, y), 'action': 'move'}
+        if opcode == Opcode.NEW_POSITION:
+            _, player_id, x, y = POSITION_LAYOUT.unpack_from(payload)
+            return {'player_id': player_id, 'new_position': Position2D(x, y)}
+        if opcode == Opcode.SEQUENCED_MOVE:
+            _, player_id, x, y, seq = SEQUENCED_LAYOUT.unpack_from(payload)
+            return {'player_id': player_id, 'position': Position2D(x, y), 'action': 'move', 'seq': seq}
+        if opcode == Opcode.MOVE_ACK:
+            _, player_id, x, y, seq = SEQUENCED_LAYOUT.unpack_from(payload)
+            return {'player_id': player_id, 'position': Position2D(x, y), 'move_ack': seq}
+        if opcode == Opcode.TILE:
+            return StructCodec.unpack_tile(payload, 0)
+        if opcode == Opcode.BATCH:
+            _, tick, position_count, left_count, tile_count, snapshot = BATCH_LAYOUT.unpack_from(payload)
+            offset = BATCH_LAYOUT.size
+            positions = list(BATCH_POSITION.iter_unpack(payload[offset:offset + position_count * BATCH_POSITION.size]))
+            offset += position_count * BATCH_POSITION.size
+            left = [player_id for player_id, in BATCH_LEFT.iter_unpack(payload[offset:offset + left_count * BATCH_LEFT.size])]
+            offset += left_count * BATCH_LEFT.size
+            tiles = [StructCodec.unpack_tile(payload, offset + i * TILE_LAYOUT.size) for i in range(tile_count)]
+            return {'tick': tick, 'positions': positions, 'left': left, 'tiles': tiles, 'snapshot': snapshot}
+        return json.loads(bytes(payload[1:]))
+
+    @staticmethod
+    def unpack_tile(payload, offset):
+        _, action, is_success, player_id, x, y = TILE_LAYOUT.unpack_from(payload, offset)
+        packet = {
+            'origin': 'tile',
+            'action': TILE_ACTIONS[action],
+            'tile_pos': Position2D(x, y),
+            'is_success': is_success,
+        }
+        if player_id:
+            packet['player_id'] = player_id
+        return packet
+
+
+CODECS = {codec.name: codec for codec in (StructCodec(), JsonCodec())}
+DEFAULT_CODEC = CODECS['json']
+
+
+def negotiate(offered):
+    """Pick the first codec offered by the client that we support."""
+    for name in offered or ():
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
+
+
+def decode_packet(flags, payload):
+    """Decode a frame payload, whichever codec produced it."""
+    if flags & FLAG_STRUCT:
+        return StructCodec.unpack(payload)
+    return decode_json(flags, payload)
+
+
+if __name__ == "__main__":
+    # Compare payload size and encode time of the high frequency packets
+    import timeit
+    packets = {
+        'move': {'player_id': 12, 'position': Position2D(31, 7), 'action': 'move'},
+        'sequenced_move': {'player_id': 12, 'position': Position2D(31, 7), 'action': 'move', 'seq': 1234},
+        'new_position': {'player_id': 12, 'new_position': Position2D(31, 7)},
+        'tile': {'origin': 'tile', 'action': 'working', 'tile_pos': Position2D(31, 7),
+                 'is_success': True, 'player_id': 12},
+        'batch': {'tick': 1, 'positions': [[player_id, 31, 7] for player_id in range(50)], 'left': [], 'tiles': [],
+                  'snapshot': False},
+    }
+    for name, packet in packets.items():
+        for codec in CODECS.values():
+            size = len(codec.encode(packet))
+            seconds = timeit.timeit(lambda: codec.encode(packet), number=100000) / 100000
+            print(f"{name:<15} {codec.name:<7} {size:>4} bytes {seconds * 1e6:6.2f} us")
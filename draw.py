@@ -1,5 +1,10 @@
 import curses
 import logging
+from map import TILE_TYPES, READY, FINISHED, COOLING_DOWN, current_state
+
+# bytes.translate table turning tile type indexes into the character the map shows for them
+TILE_DISPLAY_TABLE = bytes(ord(TILE_TYPES[index][0]) if index < len(TILE_TYPES) else ord('?') for index in range(256))
+
 class ScreenMeasurements:
     def __init__(self, stdscr):
         # Get the height and width of the window and round to even
@@ -20,6 +25,30 @@ class ScreenMeasurements:
         self.top_panel2 = curses.newwin(self.top_panel_height, half_width, 0, half_width)
         self.bottom_panel = curses.newwin(self.half_height, third_width*2, self.top_panel_height, 0)
         self.bottom_right_panel = curses.newwin(self.half_height, third_width, self.top_panel_height, third_width * 2)
+        self.map_renderer = MapRenderer(self.top_panel2)
+        self.drawn = {}  # panel -> key of what it shows, see needs_redraw
+        # getch refreshes stdscr while it is marked changed, which clears the whole terminal
+        # and leaves the panels that only draw what changed blank. Nothing draws in stdscr.
+        stdscr.noutrefresh()
+
+    def repaint(self):
+        """Clear the terminal and draw every panel again next frame, e.g. after a resize."""
+        self.stdscr.clear()
+        self.stdscr.noutrefresh()
+        self.drawn.clear()
+        self.map_renderer.invalidate()
+
+    def needs_redraw(self, panel, key):
+        """False if panel already shows what key stands for, otherwise remember that it is about to."""
+        if self.drawn.get(panel) == key:
+            return False
+        self.drawn[panel] = key
+        return True
+
+    def forget(self, panel):
+        """Something else was drawn in panel, the next needs_redraw for it is True."""
+        self.drawn.pop(panel, None)
+
     def round_to_even(self, n):
         return n if n % 2 == 0 else n - 1
     
@@ -33,49 +62,133 @@ def create_health_bar(current_health, max_health, bar_length=30):
     # Print the health bar
     return (f"|{bar}| {current_health}/{max_health} ({health_ratio:.0%})")
 
+def changed_span(old, new):
+    """(first, end) of the part of new that differs from old, two strings of the same length, None if equal."""
+    if old == new:
+        return None
+    first = 0
+    while old[first] == new[first]:
+        first += 1
+    end = len(new)
+    while old[end - 1] == new[end - 1]:
+        end -= 1
+    return first, end
+
+
+class MapRenderer:
+    """Draws the map into a boxed window, writing only the cells that changed since the last frame.
+
+    The terrain of each map row is turned into a string once, and a frame
+    slices those to the viewport, lays the tiles being worked and the players
+    over them and compares each line with what is already in the window.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.terrain_hash = None
+        self.terrain_rows = []  # Terrain characters of each map row
+        self.lines = []  # What each line inside the box shows, empty until the box is drawn
+        self.title = None
+
+    def invalidate(self):
+        """Draw everything again next frame, for when something else has drawn in the window."""
+        self.lines = []
+
+    def update_terrain(self, game_map):
+        terrain_hash = game_map.get_terrain_hash()
+        if terrain_hash != self.terrain_hash:
+            terrain = game_map.tile_types.tobytes().translate(TILE_DISPLAY_TABLE).decode('ascii')
+            self.terrain_rows = [terrain[start:start + game_map.width] for start in range(0, len(terrain), game_map.width)]
+            self.terrain_hash = terrain_hash
+
+    def terrain_line(self, game_map, map_y, start_x, width, now):
+        """The line of the viewport showing map row map_y from start_x on, with tile states."""
+        if not 0 <= map_y < game_map.height:
+            return ' ' * width
+        left = max(start_x, 0)
+        right = min(start_x + width, game_map.width)
+        if left >= right:
+            return ' ' * width
+        line = ' ' * (left - start_x) + self.terrain_rows[map_y][left:right] + ' ' * (start_x + width - right)
+        base = map_y * game_map.width
+        phases = game_map.tile_phases[base + left:base + right]
+        if phases.count(READY) == len(phases):
+            return line  # The usual case, nothing being worked on in this row
+        cells = list(line)
+        for offset, phase in enumerate(phases):
+            if phase == READY:
+                continue
+            index = base + left + offset
+            state = current_state(phase, game_map.phase_starts[index], game_map.work_times[index],
+                                  game_map.cooldown_times[index], now)
+            column = left - start_x + offset
+            if state == FINISHED:
+                cells[column] = cells[column].upper()
+            elif state == COOLING_DOWN:
+                cells[column] = '_'
+        return ''.join(cells)
+
+    def build_lines(self, game_map, character, player_positions, height, width, now=None):
+        """The text of each line inside the box, the character in the middle of the viewport."""
+        self.update_terrain(game_map)
+        start_x = max(1, character.position.x - (width + 2) // 2) - 1
+        start_y = max(1, character.position.y - (height + 2) // 2) - 1
+        lines = [self.terrain_line(game_map, start_y + y, start_x, width, now) for y in range(height)]
+
+        # Who stands where, the character last so it is drawn over anyone on the same tile
+        occupied = {(position[0], position[1]): player_id for player_id, position in player_positions.items()}
+        occupied[(character.position.x, character.position.y)] = None
+        overlay = {}  # viewport line -> [(column, character)]
+        for (x, y), player_id in occupied.items():
+            if 0 <= x - start_x < width and 0 <= y - start_y < height:
+                overlay.setdefault(y - start_y, []).append((x - start_x, '@' if player_id is None else '%'))
+        for y, marks in overlay.items():
+            cells = list(lines[y])
+            for column, char in marks:
+                cells[column] = char
+            lines[y] = ''.join(cells)
+        return lines
+
+    def draw(self, game_map, character, player_positions):
+        window = self.window
+        window_height, window_width = window.getmaxyx()
+        height, width = window_height - 2, window_width - 2
+        title = f"Map {character.position}"
+        if len(self.lines) != height:
+            window.erase()
+            self.lines = [None] * height
+            self.title = None
+        if title != self.title:
+            window.box()  # Puts back the border a longer title covered
+            window.addstr(0, 1, title, curses.A_BOLD)
+            self.title = title
+
+        for y, line in enumerate(self.build_lines(game_map, character, player_positions, height, width)):
+            old = self.lines[y]
+            if old is None:
+                window.addstr(y + 1, 1, line)
+            else:
+                span = changed_span(old, line)
+                if span is None:
+                    continue
+                first, end = span
+                window.addstr(y + 1, 1 + first, line[first:end])
+            self.lines[y] = line
+        window.noutrefresh()
+
 def draw_map(window, screen, game_map, character, player_positions):
-    screen.top_panel2.clear()
-    screen.top_panel2.box()
-    screen.top_panel2.addstr(0, 1, f"Map {character.position}", curses.A_BOLD)
-    # Calculate the starting position to draw the map
-    window_height, window_width = window.getmaxyx()
-    start_x = max(1, character.position.x - window_width // 2) -2
-    start_y = max(1, character.position.y - window_height // 2) -2
-
-    # Draw the map within the window
-    for y in range(1, window_height-1):
-        for x in range(1, window_width-1):
-            map_x = start_x + x
-            map_y = start_y + y
-            tile = game_map.get_tile(map_x, map_y)
-            if tile:
-                # Get the first character of the tile type for display
-                tile_char = tile.tile_type[0]  # Get the first character of the tile type
-                if tile.is_finished_work:
-                    tile_char = tile_char.upper()
-                elif tile.is_cooling_down:
-                    tile_char = '_'
-                window.addch(y, x, tile_char)
-
-            # Check if the current position matches the character's position
-            if (map_x, map_y) == (character.position.x, character.position.y):
-                window.addch(y, x, '@')  # Draw the character at its position
-            for player_id, position in player_positions.items():
-                if (map_x, map_y) == (position[0], position[1]):
-                    window.addch(y, x, '%')  # Draw the character at its position
-
-    screen.top_panel2.refresh()
-
-def draw(screen, output, input_buffer, connection, character, player_positions):
+    screen.forget(window)
+    screen.map_renderer.draw(game_map, character, player_positions)
+
+def draw(screen, output, input_buffer, connection, character, world):
     # Clear the screen
     draw_top_left(screen, character)
     # draw_top_right(screen)
-    draw_map(screen.top_panel2, screen, connection.map, character, player_positions)
+    draw_map(screen.top_panel2, screen, world.game_map, character, world.player_positions)
     draw_bottom(screen, output, input_buffer, connection)
 
 def draw_stats(stats, current_column, current_row, max_entries_per_column, panel_width, screen):
     # Iterate through the attributes of the given stats object
-    for entry, value in stats.__dict__.items():
+    for entry, value in stats.items():
         if entry == "levels":  # Skip the levels attribute
             continue
         entry = entry.replace('_', ' ')
@@ -102,8 +215,11 @@ def draw_stats(stats, current_column, current_row, max_entries_per_column, panel
     return current_column, current_row
 
 def draw_top_left(screen, character):
+    # Stats change a few times a minute, only draw the sheet when one did
+    if not screen.needs_redraw(screen.top_panel1, ('sheet', character.stats.version, character.stats.levels.version)):
+        return
     # Create the first top panel (window)
-    screen.top_panel1.clear()
+    screen.top_panel1.erase()
     screen.top_panel1.box()
     screen.top_panel1.addstr(0, 1, "Character Sheet", curses.A_BOLD)
     (panel_height, panel_width) = screen.top_panel1.getmaxyx()
@@ -121,7 +237,7 @@ def draw_top_left(screen, character):
     screen.top_panel1.addstr(panel_height -4, 2, f"{'Health':<{7}}: " + create_health_bar(character.stats.health, character.stats.levels.max_health))
     screen.top_panel1.addstr(panel_height -3, 2, f"{'Stamina':<{7}}: " + create_health_bar(character.stats.stamina, character.stats.levels.max_stamina))
     screen.top_panel1.addstr(panel_height -2, 2, f"{'Mana':<{7}}: " + create_health_bar(character.stats.mana, character.stats.levels.max_mana))
-    screen.top_panel1.refresh()
+    screen.top_panel1.noutrefresh()
 
 def draw_top_right(screen):
     # Create the second top panel (window)
@@ -129,14 +245,14 @@ def draw_top_right(screen):
     # screen.top_panel2.addstr(1, 1, "This is the second top panel.")
     # screen.top_panel2.addstr(2, 1, f"height {screen.height} width {screen.width}")
     screen.top_panel2.box()
-    screen.top_panel2.refresh()
+    screen.top_panel2.noutrefresh()
 
 def draw_bottom(screen, output, input_buffer, connection):
 
     (panel_height, panel_width) = screen.bottom_panel.getmaxyx()
 
     # Create the bottom panel (window)
-    screen.bottom_panel.clear()
+    screen.bottom_panel.erase()
     screen.bottom_panel.box()
     screen.bottom_panel.addstr(0, 1, "Bottom Panel", curses.A_BOLD)
     # Display the output in the bottom panel
@@ -149,17 +265,22 @@ def draw_bottom(screen, output, input_buffer, connection):
 
     message_history_height = panel_height - 6
     last_messages = connection.message_history.get_last_messages(message_history_height)
-    screen.bottom_panel.addstr(4, 1, "Last messages:")
+    # Frequent packets are only counted, say how many there were
+    collapsed = connection.message_history.collapsed_counts()
+    heading = f"Last messages ({collapsed}):" if collapsed else "Last messages:"
+    screen.bottom_panel.addstr(4, 1, heading[:panel_width - 2])
     current_row = 5
     for msg in last_messages:
         # import pdb; pdb.set_trace()
         screen.bottom_panel.addstr(current_row, 1, msg)
         current_row += 1
 
-    screen.bottom_panel.refresh()
+    screen.bottom_panel.noutrefresh()
 
-def draw_bottom_right(screen, output, input_buffer, connection, character, player_positions, actions):
-    screen.bottom_right_panel.clear()
+def draw_bottom_right(screen, output, input_buffer, connection, character, world, actions):
+    if not screen.needs_redraw(screen.bottom_right_panel, ('actions', id(actions))):
+        return
+    screen.bottom_right_panel.erase()
     screen.bottom_right_panel.box()
     screen.bottom_right_panel.addstr(0, 1, "Actions", curses.A_BOLD)
     current_row = 2
@@ -167,5 +288,5 @@ def draw_bottom_right(screen, output, input_buffer, connection, character, playe
         # import pdb; pdb.set_trace()
         screen.bottom_right_panel.addstr(current_row, 1, f"{key}: {desc[0]}")
         current_row += 1
-    screen.bottom_right_panel.refresh()
+    screen.bottom_right_panel.noutrefresh()
     return
\ No newline at end of file
@@ -1,18 +1,121 @@
 import logging
+import threading
+import weakref
+
+log = logging.getLogger('events')
 
 
 class EventManager:
-    def __init__(self):
-        self.listeners = {}
+    """Calls the listeners subscribed to an event type when it is published.
+
+    Each event type's listeners are kept in a tuple that subscribe and
+    unsubscribe replace rather than change, so publish never takes a lock
+    or copies anything, even while another thread subscribes.
+
+    By default listeners run on the publishing thread. Passing dispatch, a
+    function called as dispatch(fn, *args) such as ThreadPoolExecutor.submit
+    or loop.call_soon_threadsafe, hands them to a worker pool or event loop
+    instead, so publishing never waits for a listener.
+    """
+    def __init__(self, dispatch=None):
+        self.listeners = {}  # event type -> tuple of listeners, or weak references to them
+        # Only held by subscribe and unsubscribe. Reentrant because collecting a weak
+        # listener, which can happen at any allocation, calls remove_dead
+        self.lock = threading.RLock()
+        self.dispatch = dispatch
+
+    def subscribe(self, event_type, listener, weak=False):
+        """Call listener for every event_type published.
 
-    def subscribe(self, event_type, listener):
-        logging.info(f"Subscribing to event: {event_type} with listener: {listener}")
-        if event_type not in self.listeners:
-            self.listeners[event_type] = []
-        self.listeners[event_type].append(listener)
+        With weak=True the subscription doesn't keep listener (or the object
+        of a bound method) alive, it is dropped once the listener is collected.
+        """
+        log.info("Subscribing to event: %s with listener: %s", event_type, listener)
+        if weak:
+            if hasattr(listener, '__self__'):
+                entry = weakref.WeakMethod(listener, lambda _: self.remove_dead(event_type))
+            else:
+                entry = weakref.ref(listener, lambda _: self.remove_dead(event_type))
+        else:
+            entry = listener
+        with self.lock:
+            self.listeners[event_type] = self.listeners.get(event_type, ()) + (entry,)
+        return listener
+
+    def unsubscribe(self, event_type, listener):
+        """Stop calling listener for event_type, returns False if it wasn't subscribed."""
+        with self.lock:
+            entries = self.listeners.get(event_type, ())
+            remaining = tuple(entry for entry in entries if resolve(entry) != listener)
+            if len(remaining) == len(entries):
+                return False
+            self.set_listeners(event_type, remaining)
+        return True
+
+    def remove_dead(self, event_type):
+        """Drop the weak subscriptions to event_type whose listener has been collected."""
+        with self.lock:
+            entries = self.listeners.get(event_type, ())
+            self.set_listeners(event_type, tuple(entry for entry in entries if resolve(entry) is not None))
+
+    def set_listeners(self, event_type, entries):
+        if entries:
+            self.listeners[event_type] = entries
+        else:
+            self.listeners.pop(event_type, None)
 
     def publish(self, event_type, *args, **kwargs):
-        logging.info(f"Publishing event: {event_type} with data: {args} {kwargs}")
-        if event_type in self.listeners:
-            for listener in self.listeners[event_type]:
-                listener(*args, **kwargs)
\ No newline at end of file
+        # Formatted only if the message is logged
+        log.debug("Publishing event: %s with data: %s %s", event_type, args, kwargs)
+        entries = self.listeners.get(event_type)
+        if not entries:
+            return
+        if self.dispatch:
+            self.dispatch(self.call_listeners_safely, event_type, entries, args, kwargs)
+        else:
+            self.call_listeners(entries, args, kwargs)
+
+    def call_listeners(self, entries, args, kwargs):
+        for entry in entries:
+            listener = resolve(entry)
+            if listener is not None:
+                listener(*args, **kwargs)
+
+    def call_listeners_safely(self, event_type, entries, args, kwargs):
+        """call_listeners for dispatched events, nobody is waiting to see the exception."""
+        try:
+            self.call_listeners(entries, args, kwargs)
+        except Exception:
+            log.exception(f"Listener for {event_type} failed")
+
+
+def resolve(entry):
+    """The listener of a subscription, None if it was weak and has been collected."""
+    if isinstance(entry, weakref.ref):
+        return entry()
+    return entry
+
+
+if __name__ == "__main__":
+    # Cost of publishing an event per listener, with the events logger at its default level
+    import timeit
+    from concurrent.futures import ThreadPoolExecutor
+
+    class Listener:
+        def on_event(self, position=None, is_success=None):
+            pass
+
+    logging.getLogger('events').setLevel(logging.INFO)
+    executor = ThreadPoolExecutor(1)
+    for name, dispatch in (('sync', None), ('executor', executor.submit)):
+        for count in (0, 1, 10, 100):
+            event_manager = EventManager(dispatch)
+            listeners = [Listener() for _ in range(count)]
+            for listener in listeners:
+                event_manager.subscribe('tile_worked', listener.on_event)
+            number = 20000
+            seconds = timeit.timeit(lambda: event_manager.publish('tile_worked', position=(1, 1), is_success=True),
+                                    number=number) / number
+            per_listener = f"{seconds / count * 1e6:6.3f} us per listener" if count else ""
+            print(f"{name:<9} {count:>3} listeners {seconds * 1e6:7.3f} us per publish {per_listener}")
+    executor.shutdown()
@@ -1,7 +1,11 @@
+import heapq
+import itertools
 import logging
+import math
+import threading
+import time
 from enum import Enum
 from position import Position2D
-import threading
 
 # i am envisioning a rock paper scissors like battle system, but we will call it slash stab parry, 
 # stab beats slash, parry beats stab, slash beats parry
@@ -17,6 +21,9 @@ class FightResolution(Enum):
     LEFTWINS = 2
     DRAW = 3
 
+ROUND_TIME = 5  # Seconds players have to pick their action each round
+
+
 class FightManager:
     def __init__(self, initiating_player_id, position, players, world):
         self.aggressor = initiating_player_id
@@ -24,27 +31,28 @@ class FightManager:
         self.position = position
         self.world = world
         self.fight_radius = 3
+        self.round_time = ROUND_TIME
         self.aggressor_action = FightAction.NONE
         self.defender_action = FightAction.NONE
-        self.action_round_thread = None
         self.exit_flag = False
         nearest_opponent = self.find_other_near_player(self.aggressor, self.position, players, world.game_map)
         if (nearest_opponent):
             self.defender = nearest_opponent
-            self.start_next_round()
         else:
             logging.warning("failed to find close player")
 
     def find_other_near_player(self, aggressor, position, players, map):
-        nearest_opponent, nearest_opponent_position = map.find_closest_player_to_player(aggressor, self.position, players)
-        if not nearest_opponent or not nearest_opponent_position:
+        # Only walk far enough to reach anyone within fight_radius, plus a step to get around an obstacle
+        max_distance = math.ceil(self.fight_radius * math.sqrt(2))
+        nearby = map.find_players_near(self.position, players, max_distance, exclude=aggressor)
+        if not nearby:
             logging.warning("no closest player")
             return None
-        if map.calculate_distance(Position2D.from_list(position), nearest_opponent_position) < self.fight_radius:
-            return nearest_opponent
-        else:
-            logging.warning("closest player too far away")
-            return None
+        for nearest_opponent, nearest_opponent_position, _ in nearby:
+            if map.calculate_distance(Position2D.from_list(position), nearest_opponent_position) < self.fight_radius:
+                return nearest_opponent
+        logging.warning("closest player too far away")
+        return None
         
     def action_round(self):
         logging.info("round ended")
@@ -56,7 +64,6 @@ class FightManager:
         if (resolution == FightResolution.LEFTWINS):
             # self.message_player(self.aggressor, "dealt damage")
             self.world.event_manager.publish('damage_received', player_id=self.defender, position=self.position, success=True)
-        self.start_next_round()
         return resolution
 
     def resolve_action(self, action_left, action_right):
@@ -79,6 +86,87 @@ class FightManager:
 
         
     def start_next_round(self):
+        """Clear the actions, FightRegistry.resolve_due ends the round after round_time."""
         self.aggressor_action = self.defender_action = FightAction.NONE
-        if not self.exit_flag:
-            self.action_round_thread = threading.Timer(5, self.action_round).start()
\ No newline at end of file
+
+    def set_action(self, player_id, action):
+        if player_id == self.aggressor:
+            self.aggressor_action = action
+        if player_id == self.defender:
+            self.defender_action = action
+
+    def stop(self):
+        """End the fight, no more rounds are resolved."""
+        self.exit_flag = True
+
+
+class FightRegistry:
+    """The fights going on, looked up by either player, with their rounds
+    resolved together from one heap of round deadlines.
+    """
+    def __init__(self):
+        self.by_player = {}  # player_id -> FightManager
+        self.rounds = []  # Heap of (deadline, sequence, fight)
+        self.sequence = itertools.count()  # Keeps equal deadlines in the order they were set
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(set(self.by_player.values()))
+
+    def __contains__(self, player_id):
+        return player_id in self.by_player
+
+    def get(self, player_id):
+        return self.by_player.get(player_id)
+
+    def add(self, fight, now=None):
+        """Start fight's first round, returns False if either player is already fighting."""
+        with self.lock:
+            if fight.aggressor in self.by_player or fight.defender in self.by_player:
+                return False
+            self.by_player[fight.aggressor] = self.by_player[fight.defender] = fight
+            self.schedule_round(fight, now)
+        return True
+
+    def schedule_round(self, fight, now=None):
+        fight.start_next_round()
+        deadline = (now or time.monotonic()) + fight.round_time
+        heapq.heappush(self.rounds, (deadline, next(self.sequence), fight))
+
+    def set_action(self, player_id, action):
+        """Record player_id's action in the fight it is in, returns False if it isn't fighting."""
+        fight = self.by_player.get(player_id)
+        if fight is None:
+            return False
+        fight.set_action(player_id, action)
+        return True
+
+    def end(self, player_id):
+        """Stop and forget the fight player_id is in, returns it or None."""
+        with self.lock:
+            fight = self.by_player.get(player_id)
+            if fight is None:
+                return None
+            fight.stop()
+            for fighter in (fight.aggressor, fight.defender):
+                if self.by_player.get(fighter) is fight:
+                    del self.by_player[fighter]
+        return fight
+
+    def resolve_due(self, now=None):
+        """End every round that is due and start the next one, returns [(fight, resolution)]."""
+        now = now or time.monotonic()
+        due = []
+        with self.lock:
+            while self.rounds and self.rounds[0][0] <= now:
+                _, _, fight = heapq.heappop(self.rounds)
+                if not fight.exit_flag:
+                    due.append(fight)
+        results = []
+        for fight in due:
+            results.append((fight, fight.action_round()))
+        with self.lock:
+            for fight in due:
+                if not fight.exit_flag:
+                    self.schedule_round(fight, now)
+        return results
@@ -0,0 +1,101 @@
+import gzip
+import json
+import struct
+
+# Every message on the wire is a fixed header followed by the payload.
+# The header holds the payload length and a flags byte describing the payload.
+HEADER = struct.Struct('!IB')
+
+FLAG_COMPRESSED = 0x01  # Payload is gzip compressed
+FLAG_STRUCT = 0x02      # Payload is opcode prefixed, see codec.StructCodec
+
+# Largest payload a peer may send, with plenty of room for the compressed map. Anything
+# bigger is a broken or hostile peer and we'd rather drop it than buffer gigabytes.
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class FrameTooLarge(ValueError):
+    """A frame header announced a payload over the decoder's max_frame_size."""
+
+
+def encode_frame(payload, flags=0):
+    """Prefix payload with the frame header."""
+    return HEADER.pack(len(payload), flags) + payload
+
+
+def encode_json(packet, compress=False, cls=None):
+    """Serialize a packet to JSON and frame it, optionally gzip compressed."""
+    data = json.dumps(packet, cls=cls).encode('utf-8')
+    if compress:
+        return encode_frame(gzip.compress(data), FLAG_COMPRESSED)
+    return encode_frame(data)
+
+
+def decode_json(flags, payload):
+    """Decode the payload of a frame produced by encode_json."""
+    if flags & FLAG_COMPRESSED:
+        payload = gzip.decompress(payload)
+    return json.loads(bytes(payload))
+
+
+class FrameDecoder:
+    """Incremental frame decoder reading into a single reusable bytearray.
+
+    Data is received straight into the buffer and complete frames are handed out
+    as memoryviews over it, so no intermediate strings or slices are built.
+    """
+    def __init__(self, size=4096, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray(size)
+        self.max_frame_size = max_frame_size
+        self.start = 0  # Offset of the first unconsumed byte
+        self.end = 0    # Offset one past the last received byte
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, size):
+        """Make sure at least size bytes can be written after the buffered data."""
+        if len(self.buffer) - self.end >= size:
+            return
+        # Move the unconsumed bytes to the front before growing the buffer
+        pending = self.end - self.start
+        if self.start:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        if len(self.buffer) - self.end < size:
+            self.buffer.extend(bytes(size - (len(self.buffer) - self.end)))
+
+    def recv_into(self, sock, size=4096):
+        """Receive up to size bytes from a blocking socket, returns 0 once it is closed."""
+        self.reserve(size)
+        with memoryview(self.buffer) as view, view[self.end:] as free:
+            received = sock.recv_into(free)
+        self.end += received
+        return received
+
+    def feed(self, data):
+        """Append bytes that were received elsewhere, e.g. from an asyncio stream."""
+        self.reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        """Yield (flags, payload) for every complete frame in the buffer.
+
+        payload is only valid until the next frame is requested. Raises
+        FrameTooLarge, before buffering any of it, for a frame over max_frame_size.
+        """
+        while len(self) >= HEADER.size:
+            length, flags = HEADER.unpack_from(self.buffer, self.start)
+            if length > self.max_frame_size:
+                raise FrameTooLarge(f"Frame of {length} bytes, at most {self.max_frame_size} allowed")
+            frame_end = self.start + HEADER.size + length
+            if frame_end > self.end:
+                # Grow now so the rest of a large frame (e.g. the map) lands in one piece
+                self.reserve(frame_end - self.end)
+                break
+            with memoryview(self.buffer) as view, view[self.start + HEADER.size:frame_end] as payload:
+                self.start = frame_end
+                yield flags, payload
+        if self.start == self.end:
+            self.start = self.end = 0
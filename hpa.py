@@ -0,0 +1,271 @@
+import heapq
+from collections import deque
+from position import Position2D
+
+
+class HierarchicalPathfinder:
+    """HPA* over a GameMap, for maps too big to search tile by tile.
+
+    The map is split into square clusters. Where two clusters share a walkable
+    stretch of border there is an entrance, a pair of tiles one either side.
+    A search runs over the entrances first and only the cluster crossings on
+    the chosen route are then refined into tiles. Paths are near shortest,
+    not always shortest.
+
+    Distances between the entrances of a cluster are worked out the first
+    time a search goes through it, and when a tile changes only its cluster's
+    borders and the clusters around it are redone.
+    """
+    def __init__(self, game_map, cluster_size=16):
+        self.game_map = game_map
+        self.cluster_size = cluster_size
+        self.build()
+
+    def build(self):
+        game_map = self.game_map
+        self.clusters_x = -(-game_map.width // self.cluster_size)
+        self.clusters_y = -(-game_map.height // self.cluster_size)
+        self.borders = {}  # (cluster, neighbour cluster to the right or below) -> entrance tile pairs
+        self.links = {}    # entrance tile -> entrance tiles across a border
+        self.intra = {}    # cluster -> {entrance tile: {entrance tile: steps}}, filled in on demand
+        for cluster_y in range(self.clusters_y):
+            for cluster_x in range(self.clusters_x):
+                if cluster_x + 1 < self.clusters_x:
+                    self.build_border(((cluster_x, cluster_y), (cluster_x + 1, cluster_y)))
+                if cluster_y + 1 < self.clusters_y:
+                    self.build_border(((cluster_x, cluster_y), (cluster_x, cluster_y + 1)))
+
+    def cluster_of(self, index):
+        width = self.game_map.width
+        return (index % width // self.cluster_size, index // width // self.cluster_size)
+
+    def bounds(self, cluster):
+        """(min x, min y, max x, max y) of the tiles in cluster, inclusive."""
+        size = self.cluster_size
+        return (cluster[0] * size, cluster[1] * size,
+                min((cluster[0] + 1) * size, self.game_map.width) - 1,
+                min((cluster[1] + 1) * size, self.game_map.height) - 1)
+
+    def neighbouring_clusters(self, cluster):
+        cluster_x, cluster_y = cluster
+        for neighbour in ((cluster_x - 1, cluster_y), (cluster_x + 1, cluster_y),
+                          (cluster_x, cluster_y - 1), (cluster_x, cluster_y + 1)):
+            if 0 <= neighbour[0] < self.clusters_x and 0 <= neighbour[1] < self.clusters_y:
+                yield neighbour
+
+    def border_key(self, cluster, neighbour):
+        return (cluster, neighbour) if cluster < neighbour else (neighbour, cluster)
+
+    def build_border(self, border):
+        """(Re)place the entrances on the border between two neighbouring clusters."""
+        for tile, other in self.borders.pop(border, ()):
+            self.unlink(tile, other)
+            self.unlink(other, tile)
+
+        width = self.game_map.width
+        walkable = self.game_map.get_walkable()
+        cluster, neighbour = border
+        min_x, min_y, max_x, max_y = self.bounds(cluster)
+        if neighbour[0] != cluster[0]:
+            # Vertical border, pairs of tiles side by side
+            step = width
+            first = min_y * width + max_x
+            count = max_y - min_y + 1
+            across = 1
+        else:
+            # Horizontal border, pairs of tiles one above the other
+            step = 1
+            first = max_y * width + min_x
+            count = max_x - min_x + 1
+            across = width
+
+        # One entrance in the middle of every walkable stretch of the border
+        pairs = []
+        run = []
+        for position in range(count + 1):
+            tile = first + position * step
+            if position < count and walkable[tile] and walkable[tile + across]:
+                run.append(tile)
+            elif run:
+                tile = run[len(run) // 2]
+                pairs.append((tile, tile + across))
+                run = []
+        for tile, other in pairs:
+            self.links.setdefault(tile, set()).add(other)
+            self.links.setdefault(other, set()).add(tile)
+        self.borders[border] = pairs
+
+    def unlink(self, tile, other):
+        links = self.links[tile]
+        links.discard(other)
+        if not links:
+            del self.links[tile]
+
+    def entrances(self, cluster):
+        """Entrance tiles inside cluster."""
+        tiles = set()
+        for neighbour in self.neighbouring_clusters(cluster):
+            for pair in self.borders.get(self.border_key(cluster, neighbour), ()):
+                tiles.update(tile for tile in pair if self.cluster_of(tile) == cluster)
+        return tiles
+
+    def cluster_edges(self, cluster):
+        """Steps between every pair of entrances of cluster, without leaving it."""
+        edges = self.intra.get(cluster)
+        if edges is None:
+            entrances = self.entrances(cluster)
+            edges = {}
+            for tile in entrances:
+                distances, _ = self.search_cluster(tile, cluster, entrances)
+                edges[tile] = {other: steps for other, steps in distances.items() if other != tile}
+            self.intra[cluster] = edges
+        return edges
+
+    def search_cluster(self, start, cluster, targets, stop_at=None):
+        """Breadth first search from start that stays inside cluster.
+
+        Returns ({target: steps} for the targets reached, parents).
+        """
+        width = self.game_map.width
+        walkable = self.game_map.get_walkable()
+        min_x, min_y, max_x, max_y = self.bounds(cluster)
+        parents = {start: None}
+        steps = {start: 0}
+        found = {start: 0} if start in targets else {}
+        queue = deque([start])
+        while queue and len(found) < len(targets):
+            index = queue.popleft()
+            if index == stop_at:
+                break
+            x = index % width
+            y = index // width
+            for neighbour, inside in ((index - width, y > min_y), (index + width, y < max_y),
+                                      (index - 1, x > min_x), (index + 1, x < max_x)):
+                if inside and walkable[neighbour] and neighbour not in parents:
+                    parents[neighbour] = index
+                    steps[neighbour] = steps[index] + 1
+                    if neighbour in targets:
+                        found[neighbour] = steps[neighbour]
+                    queue.append(neighbour)
+        return found, parents
+
+    def local_path(self, start, end, cluster):
+        """Shortest tile path from start to end inside cluster, None if there isn't one."""
+        _, parents = self.search_cluster(start, cluster, (end,), stop_at=end)
+        if end not in parents:
+            return None
+        path = []
+        index = end
+        while index is not None:
+            path.append(index)
+            index = parents[index]
+        path.reverse()
+        return path
+
+    def tile_changed(self, index):
+        """Update the entrances around a tile whose walkability changed."""
+        cluster = self.cluster_of(index)
+        for neighbour in self.neighbouring_clusters(cluster):
+            self.build_border(self.border_key(cluster, neighbour))
+            self.intra.pop(neighbour, None)
+        self.intra.pop(cluster, None)
+
+    def find_path(self, start, end):
+        """Walkable path from start to end as a list of positions, empty if there is none."""
+        width = self.game_map.width
+        walkable = self.game_map.get_walkable()
+        start_index = start.y * width + start.x
+        end_index = end.y * width + end.x
+        if not (walkable[start_index] and walkable[end_index]):
+            return []
+        start_cluster = self.cluster_of(start_index)
+        end_cluster = self.cluster_of(end_index)
+        if start_cluster == end_cluster:
+            path = self.local_path(start_index, end_index, start_cluster)
+            if path:
+                return self.to_positions(path)
+
+        abstract_path = self.search_entrances(start_index, end_index, start_cluster, end_cluster)
+        if abstract_path is None:
+            return []
+        path = [start_index]
+        for tile, next_tile in zip(abstract_path, abstract_path[1:]):
+            if next_tile in self.links.get(tile, ()):
+                path.append(next_tile)  # Crossing a border
+            else:
+                path += self.local_path(tile, next_tile, self.cluster_of(tile))[1:]
+        return self.to_positions(path)
+
+    def search_entrances(self, start_index, end_index, start_cluster, end_cluster):
+        """A* from start to end over the entrances, returns the tiles to go through."""
+        width = self.game_map.width
+        end_x, end_y = end_index % width, end_index // width
+        start_edges, _ = self.search_cluster(start_index, start_cluster, self.entrances(start_cluster))
+        end_edges, _ = self.search_cluster(end_index, end_cluster, self.entrances(end_cluster))
+
+        def heuristic(index):
+            return abs(index % width - end_x) + abs(index // width - end_y)
+
+        steps = {start_index: 0}
+        parents = {start_index: None}
+        heap = [(heuristic(start_index), 0, start_index)]
+        while heap:
+            _, tile_steps, tile = heapq.heappop(heap)
+            if tile == end_index:
+                path = []
+                while tile is not None:
+                    path.append(tile)
+                    tile = parents[tile]
+                path.reverse()
+                return path
+            if tile_steps > steps[tile]:
+                continue  # Already reached more cheaply
+            if tile == start_index:
+                neighbours = [(other, cost) for other, cost in start_edges.items() if other != tile]
+            else:
+                neighbours = list(self.cluster_edges(self.cluster_of(tile)).get(tile, {}).items())
+            neighbours += [(other, 1) for other in self.links.get(tile, ())]
+            if tile in end_edges:
+                neighbours.append((end_index, end_edges[tile]))
+            for neighbour, cost in neighbours:
+                neighbour_steps = tile_steps + cost
+                if neighbour_steps < steps.get(neighbour, neighbour_steps + 1):
+                    steps[neighbour] = neighbour_steps
+                    parents[neighbour] = tile
+                    heapq.heappush(heap, (neighbour_steps + heuristic(neighbour), neighbour_steps, neighbour))
+        return None
+
+    def to_positions(self, path):
+        width = self.game_map.width
+        return [Position2D(index % width, index // width) for index in path]
+
+
+if __name__ == "__main__":
+    # Compare against the flat A* search on a large generated map
+    import random
+    import time
+    from event_manager import EventManager
+    from map import GameMap, MapGenerator
+
+    size = 256
+    random.seed(1)
+    placeholder = GameMap(EventManager(), size, size, "x" * (size * size))
+    generator = MapGenerator(placeholder)
+    map_string = generator.generate_map_string()
+    flat_map = GameMap(EventManager(), size, size, map_string)
+    hierarchical_map = GameMap(EventManager(), size, size, map_string)
+    started = time.perf_counter()
+    hierarchical_map.use_hierarchical_pathfinding()
+    print(f"build {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+    pairs = []
+    while len(pairs) < 20:
+        start = Position2D(random.randrange(size), random.randrange(size))
+        end = Position2D(random.randrange(size), random.randrange(size))
+        if flat_map.is_path_walkable(start, end):
+            pairs.append((start, end))
+    for name, game_map in (('a*', flat_map), ('hpa*', hierarchical_map)):
+        started = time.perf_counter()
+        steps = sum(game_map.path_distance(start, end) for start, end in pairs)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<5} {elapsed / len(pairs) * 1000:8.1f} ms per path, {steps} steps in total")
@@ -1,24 +1,114 @@
+import atexit
+import itertools
+import json
 import logging
+import logging.handlers
+import queue
 import sys
 
-def setup_logging(log_name):
-    # Configure logging
-    logger = logging.getLogger('my_logger')
-    logger.setLevel(logging.DEBUG)  # Set the logging level
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(filename)s - %(funcName)s - %(message)s'
 
-    # Create a file handler
-    file_handler = logging.FileHandler(log_name)
-    file_handler.setLevel(logging.DEBUG)  # Set the level for the file handler
+# Loggers for each part of the game, set with setup_logging(levels=...) or -loglevel
+DEFAULT_LEVELS = {
+    '': logging.INFO,         # Everything without its own logger
+    'packets': logging.INFO,  # Every packet sent and received, DEBUG to see them
+    'events': logging.INFO,   # Every EventManager publish, DEBUG to see them
+}
 
-    # Create a console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.DEBUG)  # Set the level for the console handler
+# Attributes every LogRecord has, anything else was passed with extra= and goes in structured output
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
 
-    # Create a formatter and set it for both handlers
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
 
-    # Add the handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
\ No newline at end of file
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue as they are, so formatting happens on the listener thread.
+
+    The logging call only costs an enqueue. The arguments are formatted later,
+    so they mustn't be changed after they have been logged.
+    """
+    def prepare(self, record):
+        return record
+
+
+class LogListener(logging.handlers.QueueListener):
+    """QueueListener that can be stopped more than once, at exit and by whoever started it."""
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through the first and then every rate-th record logged from each line.
+
+    Kept records get a sample_rate attribute so totals can be estimated.
+    """
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.counters = {}  # (pathname, lineno) -> itertools.count
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters.setdefault(key, itertools.count())
+        if next(counter) % self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line, with any extra= fields as keys of their own."""
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'function': record.funcName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def parse_levels(text):
+    """Turn 'packets=DEBUG,events=DEBUG' (as given to -loglevel) into a levels dict."""
+    levels = {}
+    for item in filter(None, text.split(',')):
+        name, _, level = item.rpartition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(log_name, levels=None, structured=False, console=False, sample_packets=100):
+    """Log to log_name from a background thread, returns the QueueListener doing the writing.
+
+    levels maps logger names to levels on top of DEFAULT_LEVELS, '' being the root
+    logger. Only one in sample_packets records from each packet logging line is kept.
+    """
+    log_queue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(log_name, mode='w')
+    handlers = [file_handler]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    formatter = StructuredFormatter() if structured else logging.Formatter(TEXT_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    listener = LogListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Write out whatever is still queued
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    for name, level in {**DEFAULT_LEVELS, **(levels or {})}.items():
+        logging.getLogger(name).setLevel(level)
+    if sample_packets > 1:
+        logging.getLogger('packets').addFilter(SamplingFilter(sample_packets))
+    return listener
@@ -7,9 +7,11 @@ import map
 from character import Character
 from position import Position2D
 from draw import draw, ScreenMeasurements
-from client import positions_lock, player_positions, Connection, global_exit_flag
+from client import Connection, global_exit_flag
 from views import View, Views
 import socket 
+import selectors
+import time
 class GameState:
     def __init__(self, event_manager):
         self.current_view = View.WORLD
@@ -29,14 +31,7 @@ class GameState:
 
 import logging
 import sys
-
-# Configure the logger
-logging.basicConfig(
-    filename='client.log',  # Specify the log file name
-    filemode='w',        # Append mode; use 'w' to overwrite the file
-    format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s',
-    level=logging.DEBUG   # Set the logging level
-)
+from logging_config import setup_logging, parse_levels
 
 def log_exception(exc_type, exc_value, exc_traceback):
     """Log uncaught exceptions."""
@@ -47,9 +42,11 @@ def log_exception(exc_type, exc_value, exc_traceback):
 # Set the exception hook to log uncaught exceptions
 sys.excepthook = log_exception
 
+IDLE_REDRAW_INTERVAL = 1  # Seconds between redraws when nothing seems to be happening
+
 def try_move_player(connection, character, x, y):
-    if character.moveTo(x, y, connection.map):
-        connection.send_position_update(character)
+    # Moves show straight away, the main loop sends them on at most once a network tick
+    connection.moves.move(character, connection.read_snapshot().game_map, x, y)
 
 
 def handle_input(key, input_buffer, output, character, connection, game_state):
@@ -79,7 +76,28 @@ def init_game(connection, username):
     character = Character(connection, username)  # Start in the middle of the map
     return character
 
-def main(stdscr, host, username):
+def wait_for_changes(stdscr, selector, wakeup, timeout):
+    """Block until there is input, a network update or timeout seconds pass.
+
+    Returns (keys pressed, whether the network changed anything).
+    """
+    if selector is None:
+        # select can't wait on the console on Windows, let getch wait instead
+        stdscr.timeout(max(1, int(timeout * 1000)))
+        key = stdscr.getch()
+        stdscr.nodelay(True)
+        keys = [key] if key != -1 else []
+        woken = wakeup.clear()
+    else:
+        events = selector.select(timeout)
+        keys = []
+        woken = wakeup.clear() if any(key.fileobj is wakeup for key, _ in events) else False
+    # curses may have buffered more than one key
+    while (key := stdscr.getch()) != -1:
+        keys.append(key)
+    return keys, woken
+
+def main(stdscr, host, username, codecs=('struct', 'json'), fps=30):
 
     global global_exit_flag
 
@@ -92,15 +110,26 @@ def main(stdscr, host, username):
     add_upnp_port_mapping()
 
     output = input_buffer = ""  # Initialize the input buffer
-    stdscr.nodelay(True)  # Make getch non-blocking
+    stdscr.nodelay(True)  # Make getch non-blocking, we wait for input in wait_for_changes
 
     # Create connection to the server with host and username
-    connection = Connection(host, username=username)
+    connection = Connection(host, username=username, codecs=codecs)
     character = init_game(connection, username)
     connection.send_position_update(character)
 
     game_state = GameState(connection.map.event_manager)
 
+    # Sleep until a key is pressed or the receive thread wakes us, instead of polling
+    if sys.platform == 'win32':
+        selector = None
+    else:
+        selector = selectors.DefaultSelector()
+        selector.register(sys.stdin, selectors.EVENT_READ)
+        selector.register(connection.wakeup, selectors.EVENT_READ)
+    frame_time = 1 / fps
+    last_draw = 0
+    changed = True
+
     while not global_exit_flag and connection.network_thread.is_alive():
         if global_exit_flag:
             # close connection
@@ -109,11 +138,35 @@ def main(stdscr, host, username):
             # close game
             break
 
-        with positions_lock:
-            Views[game_state.current_view].draw(screen, output, input_buffer, connection, character, player_positions)
-        key = stdscr.getch()  # Get user input
-
-        input_buffer, output = handle_input(key, input_buffer, output, character, connection, game_state)
+        # Redraw when something changed, but no more than fps times a second
+        now = time.monotonic()
+        if changed and now - last_draw >= frame_time:
+            # Published whole by the receive thread, so drawing needs no lock and never holds it up
+            world = connection.read_snapshot()
+            Views[game_state.current_view].draw(screen, output, input_buffer, connection, character, world)
+            curses.doupdate()  # The panels only marked what changed, write it all out at once
+            last_draw = now
+            changed = False
+        if changed:
+            timeout = last_draw + frame_time - now
+        else:
+            timeout = IDLE_REDRAW_INTERVAL
+        move_due = connection.moves.time_to_send(now)
+        if move_due is not None:
+            timeout = min(timeout, move_due)
+
+        if selector is None:
+            timeout = min(timeout, frame_time)  # Network updates are only noticed when getch returns
+        keys, woken = wait_for_changes(stdscr, selector, connection.wakeup, timeout)
+        if curses.KEY_RESIZE in keys:
+            screen.repaint()
+        for key in keys:
+            input_buffer, output = handle_input(key, input_buffer, output, character, connection, game_state)
+        # Put right any move the server didn't agree with, then send the latest position if it's time
+        reconciled = connection.moves.reconcile(character, connection.read_snapshot().game_map)
+        connection.moves.flush(connection, character, time.monotonic())
+        # Timers like stamina restore change things without a packet, so redraw now and then anyway
+        changed = changed or woken or bool(keys) or reconciled or time.monotonic() - last_draw >= IDLE_REDRAW_INTERVAL
 
     sys.exit(0)
 
@@ -131,11 +184,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Game Client")
     parser.add_argument("-host", type=str, help="Host IP address of the server", default=defaultIP)
     parser.add_argument("-username", type=str, help="Username for the game", default="Player1")
+    parser.add_argument("-codec", choices=['struct', 'json'], help="Wire codec, json is easier to debug", default='struct')
+    parser.add_argument("-fps", type=int, help="Most times a second the screen is redrawn", default=30)
+    parser.add_argument("-loglevel", type=parse_levels, help="Log levels per logger, e.g. packets=DEBUG,events=DEBUG", default={})
+    parser.add_argument("-structuredlogs", action="store_true", help="Write the log as one JSON object per line")
     args = parser.parse_args()
 
+    setup_logging('client.log', args.loglevel, args.structuredlogs)
+
     if socket.gethostname() == 'DESKTOP-H8FAUH8':
         args.host = "127.0.0.1"
 
     # Initialize the curses application
-    curses.wrapper(lambda stdscr: main(stdscr, args.host, args.username))
+    curses.wrapper(lambda stdscr: main(stdscr, args.host, args.username, (args.codec, 'json'), args.fps))
 
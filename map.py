@@ -10,16 +10,90 @@ import random
 #     def __repr__(self):
 #         return f"Tile(type={self.tile_type}, data={self.additional_data})"
     
-import threading
 import uuid
+import copy
+import time
+import heapq
 import json
+import hashlib
+from array import array
 from position import Position2D
+from hpa import HierarchicalPathfinder
 import logging
 import math
+import threading
+from collections import OrderedDict
 
 from pathfinding.core.grid import Grid
 from pathfinding.finder.a_star import AStarFinder
 
+tile_mapping = {
+    'x': 'plain',
+    'o': 'dungeon',
+    'w': 'woods',
+    'r': 'river',
+    'm': 'mountain',
+    'f': 'farmland',
+    'c': 'castle',
+    'g': 'grassland',
+    's': 'swamp',
+    'd': 'desert',
+    't': 'town',
+    'l': 'lake',
+    'p': 'path',
+    'h': 'hill',
+    'b': 'bridge',
+}
+TILE_TYPES = tuple(tile_mapping.values())  # GameMap.tile_types holds indexes into this
+TILE_CHARS = tuple(tile_mapping.keys())   # Map string character of each TILE_TYPES entry
+TILE_TYPE_INDEX = {tile_type: index for index, tile_type in enumerate(TILE_TYPES)}
+NOT_WALKABLE = ('unknown', 'mountain', 'river')  # Add more non-walkable types as needed
+# bytes.translate table turning tile type indexes into 1 for walkable and 0 for blocked tiles
+WALKABLE_TABLE = bytes(int(index < len(TILE_TYPES) and TILE_TYPES[index] not in NOT_WALKABLE) for index in range(256))
+# bytes.translate table turning a map string into tile type indexes, 255 marks unknown characters
+MAP_STRING_TABLE = bytes(TILE_CHARS.index(chr(char)) if chr(char) in TILE_CHARS else 255 for char in range(256))
+
+# Tile states. Tiles only store the state they were put in and when, WORKING
+# turns into FINISHED after work_time and COOLING_DOWN into READY after cooldown_time.
+READY = 0
+WORKING = 1
+FINISHED = 2
+COOLING_DOWN = 3
+# Event published when a state runs out, see GameMap.sweep
+DEADLINE_EVENTS = {WORKING: 'tile_worked', COOLING_DOWN: 'tile_ready'}
+
+# Mutable state of a tile nobody has touched
+DEFAULT_WORK_TIME = 5
+DEFAULT_COOLDOWN_TIME = 5
+
+PATH_CACHE_SIZE = 256  # Recent find_walkable_path results kept per map
+
+
+def current_state(phase, phase_started, work_time, cooldown_time, now=None):
+    """The state of a tile that was put in phase at phase_started."""
+    if phase == WORKING:
+        duration = work_time
+    elif phase == COOLING_DOWN:
+        duration = cooldown_time
+    else:
+        return phase
+    if (now or time.time()) < phase_started + duration:
+        return phase
+    return FINISHED if phase == WORKING else READY
+
+
+def state_property(state):
+    def get(self):
+        return self.state() == state
+
+    def set(self, value):
+        if value:
+            self.set_state(state)
+        elif self.state() == state:
+            self.set_state(WORKING if state == READY else READY)
+    return property(get, set)
+
+
 class Tile:
     def __init__(self, event_manager, tile_type, position, additional_data=None):
         self.event_manager = event_manager
@@ -27,9 +101,8 @@ class Tile:
         self.position = position 
         self.work_time = 5  # Time before the tile can be activated
         self.cooldown_time = 5      # Time before the tile can be activated again
-        self.is_ready_to_work = True        # Indicates if the tile can be worked
-        self.is_finished_work = False        # Indicates if the tile has finished work
-        self.is_cooling_down = False
+        self.phase = READY  # What the tile was last set to, see state
+        self.phase_started = 0.0  # time.time() when phase was set
         self.additional_data = additional_data or {}
         self.id = str(uuid.uuid4())  # Generate a unique ID
 
@@ -41,46 +114,50 @@ class Tile:
                 f"is_cooling_down={self.is_cooling_down!r}, "
                 f"additional_data={self.additional_data!r}, id={self.id!r})")
 
+    def state(self, now=None):
+        """READY, WORKING, FINISHED or COOLING_DOWN, worked out from the clock when asked."""
+        return current_state(self.phase, self.phase_started, self.work_time, self.cooldown_time, now)
+
+    def set_state(self, state):
+        self.phase = state
+        self.phase_started = time.time()
+
+    is_ready_to_work = state_property(READY)    # Indicates if the tile can be worked
+    is_finished_work = state_property(FINISHED)  # Indicates if the tile has finished work
+    is_cooling_down = state_property(COOLING_DOWN)
+
     def work_complete(self):
-        """Called when the activation timer completes."""
+        """Finish the work now, rather than when work_time is up."""
         logging.info(f"Tile {self.id} is ready to activate.")
-        self.is_ready_to_work = False
-        self.is_finished_work = True
+        self.set_state(FINISHED)
         # Notify players that the tile can be activated
         self.event_manager.publish('tile_worked', position=self.position, is_success=True)
 
     def work(self, player_id):
-        """Player works the tile, starting the work timer."""
+        """Player works the tile, it finishes after work_time."""
         logging.info(self.position)
         if self.is_ready_to_work:
             logging.info(f"Player works tile {self.id}.")
-            self.is_ready_to_work = False
-            self.is_finished_work = False
-            # Start the activation timer
-            threading.Timer(self.work_time, self.work_complete).start()
+            self.set_state(WORKING)
             self.event_manager.publish('tile_working', player_id=player_id, position=self.position, is_success=True)
         else:
             logging.info(f"Tile {self.id} is not ready to work.")
             self.event_manager.publish('tile_working', player_id=player_id, position=self.position, is_success=False)
 
     def cooldown(self, player_id):
-        """Player activates the tile, starting the cooldown timer."""
+        """Player activates the tile, it can be worked again after cooldown_time."""
         if self.is_finished_work:
             logging.info(f"Player activates tile {self.id}.")
-            self.is_finished_work = False
-            self.is_cooling_down = True
-            # Start the cooldown timer
-            threading.Timer(self.cooldown_time, self.cooldown_complete).start()
+            self.set_state(COOLING_DOWN)
             self.event_manager.publish('tile_activated', player_id=player_id, position=self.position, is_success=True)
         else:
             logging.info(f"Tile {self.id} is not finished working.")
             self.event_manager.publish('tile_activated', player_id=player_id, position=self.position, is_success=False)
 
     def cooldown_complete(self):
-        """Called when the cooldown timer completes."""
+        """End the cooldown now, rather than when cooldown_time is up."""
         logging.info(f"Tile {self.id} is ready to be worked again.")
-        self.is_ready_to_work = True
-        self.is_cooling_down = False
+        self.set_state(READY)
         # Notify players that the tile can be worked again
         self.event_manager.publish('tile_ready', position=self.position, is_success=True)
 
@@ -103,55 +180,331 @@ class Tile:
         }
 
 
+def array_property(name):
+    def get(self):
+        return getattr(self.game_map, name)[self.index]
+
+    def set(self, value):
+        getattr(self.game_map, name)[self.index] = value
+        self.game_map.mark_changed(self.index)
+    return property(get, set)
+
+
+class TileView(Tile):
+    """A Tile whose state lives in the arrays of a GameMap.
+
+    Views are created on demand by GameMap.get_tile and can be thrown away
+    after use, the map keeps the state.
+    """
+    def __init__(self, game_map, index):
+        self.game_map = game_map
+        self.index = index
+        self.id = index
+
+    event_manager = property(lambda self: self.game_map.event_manager)
+    position = property(lambda self: Position2D(self.index % self.game_map.width, self.index // self.game_map.width))
+    work_time = array_property('work_times')
+    cooldown_time = array_property('cooldown_times')
+    phase = array_property('tile_phases')
+    phase_started = array_property('phase_starts')
+
+    def set_state(self, state):
+        self.game_map.set_tile_state(self.index, state)
+
+    @property
+    def tile_type(self):
+        return TILE_TYPES[self.game_map.tile_types[self.index]]
+
+    @tile_type.setter
+    def tile_type(self, tile_type):
+        tile_types = self.game_map.tile_types
+        old_type = tile_types[self.index]
+        tile_types[self.index] = TILE_TYPE_INDEX[tile_type]
+        self.game_map.terrain_changed(WALKABLE_TABLE[old_type] != WALKABLE_TABLE[tile_types[self.index]], self.index)
+
+    @property
+    def additional_data(self):
+        return self.game_map.tile_data.get(self.index, {})
+
+    @additional_data.setter
+    def additional_data(self, data):
+        if data:
+            self.game_map.tile_data[self.index] = data
+        else:
+            self.game_map.tile_data.pop(self.index, None)
+        self.game_map.mark_changed(self.index)
+
+
 class GameMap:
+    """The world grid, stored as one typed array per tile attribute indexed by y * width + x."""
     def __init__(self, event_manager, width, height, map_string):
         self.event_manager = event_manager
         self.width = width
         self.height = height
-        self.map = []
         self.grid = None # Pathfinding
         self.additional_data = {}
+        # Every tile state change bumps version, so clients can ask for what changed since theirs.
+        # epoch tells versions from different server runs apart.
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.changed_at = {}  # index -> version of the tile's last change
+        self.synced_version = None  # Client side, the server version we last applied
+        self.terrain_hash = None  # Cached, see get_terrain_hash
+        self.walkable = None  # Cached, see get_walkable
+        self.components = None  # Cached, see get_components
+        self.path_cache = OrderedDict()  # (start index, end index) -> path, least recently used first
+        self.path_cache_size = PATH_CACHE_SIZE
+        self.path_lock = threading.Lock()  # The pathfinding grid and path cache are shared between threads
+        self.pathfinder = None  # See use_hierarchical_pathfinding
+        self.deadlines = []  # Heap of (deadline, index, phase_started) of tiles working or cooling down
+        # Only worth it where sweep is called. Clients hear about deadlines from the server instead
+        self.track_deadlines = True
+        self.deadline_lock = threading.Lock()
         self.create_map(event_manager, map_string)
 
     def create_map(self, event_manager, map_string):
-        tile_mapping = {
-            'x': 'plain',
-            'o': 'dungeon',
-            'w': 'woods',
-            'r': 'river',
-            'm': 'mountain',
-            'f': 'farmland',
-            'c': 'castle',
-            'g': 'grassland',
-            's': 'swamp',
-            'd': 'desert',
-            't': 'town',
-            'l': 'lake',
-            'p': 'path',
-            'h': 'hill',
-            'b': 'bridge',
+        size = self.width * self.height
+        try:
+            self.tile_types = array('B', map_string[:size].encode('ascii').translate(MAP_STRING_TABLE))
+        except UnicodeEncodeError:
+            raise Exception(f"Unknown tile in map string")
+        if 255 in self.tile_types:
+            raise Exception(f"Unknown tile in map string")
+        if len(self.tile_types) != size:
+            raise Exception(f"Map string is shorter than {self.width}x{self.height}")
+        self.reset_tile_state()
+
+    def reset_tile_state(self):
+        size = len(self.tile_types)
+        self.tile_phases = array('B', [READY]) * size   # State each tile was last put in
+        self.phase_starts = array('d', [0.0]) * size    # time.time() it was put in that state
+        self.work_times = array('f', [DEFAULT_WORK_TIME]) * size          # Time before the tile can be activated
+        self.cooldown_times = array('f', [DEFAULT_COOLDOWN_TIME]) * size  # Time before the tile can be activated again
+        self.tile_data = {}  # index -> additional_data, most tiles have none
+
+    def mark_changed(self, index):
+        self.version += 1
+        self.changed_at[index] = self.version
+
+    def terrain_changed(self, walkability_changed=True, index=None):
+        """Called after the terrain of the tile at index, or of any tiles if index is None, changed."""
+        self.version += 1
+        self.terrain_hash = None
+        if walkability_changed:
+            # Only walkability matters to pathfinding, other terrain changes keep the caches
+            with self.path_lock:
+                self.walkable = None
+                self.components = None
+                self.grid = None
+                self.path_cache.clear()
+                if self.pathfinder and index is not None:
+                    self.pathfinder.tile_changed(index)
+                elif self.pathfinder:
+                    self.pathfinder.build()
+
+    def use_hierarchical_pathfinding(self, cluster_size=16):
+        """Have find_walkable_path use HPA*, worth it on maps hundreds of tiles across."""
+        with self.path_lock:
+            self.pathfinder = HierarchicalPathfinder(self, cluster_size)
+            self.path_cache.clear()
+
+    def get_walkable(self):
+        """One byte per tile, 1 where the tile can be walked on."""
+        if self.walkable is None:
+            self.walkable = self.tile_types.tobytes().translate(WALKABLE_TABLE)
+        return self.walkable
+
+    def get_components(self):
+        """Connected area label of every tile, 0 for blocked tiles.
+
+        Two tiles are reachable from each other exactly when they share a label,
+        using the same four way movement as find_walkable_path.
+        """
+        if self.components is None:
+            walkable = self.get_walkable()
+            width = self.width
+            size = len(walkable)
+            components = array('I', bytes(4 * size))
+            label = 0
+            for start in range(size):
+                if not walkable[start] or components[start]:
+                    continue
+                label += 1
+                components[start] = label
+                frontier = [start]
+                while frontier:
+                    index = frontier.pop()
+                    x = index % width
+                    for neighbour in (index - width, index + width,
+                                      index - 1 if x > 0 else -1, index + 1 if x < width - 1 else -1):
+                        if 0 <= neighbour < size and walkable[neighbour] and not components[neighbour]:
+                            components[neighbour] = label
+                            frontier.append(neighbour)
+            self.components = components
+        return self.components
+
+    def terrain_string(self):
+        """The map string this map's terrain would be built from."""
+        return ''.join([TILE_CHARS[tile_type] for tile_type in self.tile_types])
+
+    def get_terrain_hash(self):
+        if self.terrain_hash is None:
+            terrain = f"{self.width}x{self.height}:{self.terrain_string()}"
+            self.terrain_hash = hashlib.sha256(terrain.encode('utf-8')).hexdigest()
+        return self.terrain_hash
+
+    def tile_state(self, index):
+        return [index, self.tile_phases[index], self.phase_starts[index], self.work_times[index],
+                self.cooldown_times[index], self.tile_data.get(index, {})]
+
+    def is_default_state(self, index):
+        state = current_state(self.tile_phases[index], self.phase_starts[index],
+                              self.work_times[index], self.cooldown_times[index])
+        return (state == READY and self.work_times[index] == DEFAULT_WORK_TIME
+                and self.cooldown_times[index] == DEFAULT_COOLDOWN_TIME and index not in self.tile_data)
+
+    def set_tile_state(self, index, state):
+        self.tile_phases[index] = state
+        self.phase_starts[index] = started = time.time()
+        self.mark_changed(index)
+        if state in DEADLINE_EVENTS and self.track_deadlines:
+            self.add_deadline(index, started)
+
+    def add_deadline(self, index, phase_started):
+        duration = self.work_times[index] if self.tile_phases[index] == WORKING else self.cooldown_times[index]
+        with self.deadline_lock:
+            heapq.heappush(self.deadlines, (phase_started + duration, index, phase_started))
+
+    def sweep(self, now=None):
+        """Publish tile_worked and tile_ready for the tiles whose work or cooldown ran out.
+
+        Tile state doesn't need this to change, it is worked out from the clock
+        when read, this only tells everyone about it. Returns how many ran out.
+        """
+        now = now or time.time()
+        expired = []
+        with self.deadline_lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                expired.append(heapq.heappop(self.deadlines))
+        events = 0
+        for _, index, phase_started in expired:
+            phase = self.tile_phases[index]
+            if self.phase_starts[index] != phase_started or phase not in DEADLINE_EVENTS:
+                continue  # The tile has been put in another state since
+            if current_state(phase, phase_started, self.work_times[index], self.cooldown_times[index], now) == phase:
+                self.add_deadline(index, phase_started)  # Its work or cooldown time was made longer
+                continue
+            self.event_manager.publish(DEADLINE_EVENTS[phase], position=TileView(self, index).position, is_success=True)
+            events += 1
+        return events
+
+    def snapshot(self, since=None, epoch=None, terrain_hash=None):
+        """Describe the map for a client.
+
+        The terrain grid is left out if the client already has terrain with the same hash.
+        If it also has this map's state up to version since, only the tiles changed after
+        that are included, otherwise every tile that isn't in its default state.
+        """
+        current_hash = self.get_terrain_hash()
+        same_terrain = terrain_hash == current_hash
+        is_delta = same_terrain and since is not None and epoch == self.epoch and since <= self.version
+        if is_delta:
+            indexes = [index for index, version in self.changed_at.items() if version > since]
+        else:
+            indexes = [index for index in range(len(self.tile_types)) if not self.is_default_state(index)]
+        snapshot = {
+            'epoch': self.epoch,
+            'version': self.version,
+            'width': self.width,
+            'height': self.height,
+            'terrain_hash': current_hash,
+            'delta': is_delta,
+            'tiles': [self.tile_state(index) for index in indexes],
+            'now': time.time(),  # The tiles' phase starts are on our clock, see apply_snapshot
         }
+        if not same_terrain:
+            snapshot['terrain'] = self.terrain_string()
+        return snapshot
+
+    def apply_snapshot(self, snapshot):
+        """Bring this map up to date with a snapshot made with our terrain hash."""
+        if not snapshot['delta']:
+            # Everything not listed is in its default state
+            self.reset_tile_state()
+        # Move the phase starts onto our clock, which needn't agree with the server's
+        clock_offset = time.time() - snapshot['now'] if 'now' in snapshot else 0.0
+        for index, phase, phase_started, work_time, cooldown_time, data in snapshot['tiles']:
+            self.tile_phases[index] = phase
+            self.phase_starts[index] = phase_started + clock_offset
+            self.work_times[index] = work_time
+            self.cooldown_times[index] = cooldown_time
+            if data:
+                self.tile_data[index] = data
+            else:
+                self.tile_data.pop(index, None)
+        self.epoch = snapshot['epoch']
+        self.version = self.synced_version = snapshot['version']
 
-        for y in range(self.height):
-            map_row = []
-            for x in range(self.width):
-                index = y * self.width + x  # Calculate the index in the string
-                char = map_string[index]
-                tile_type = tile_mapping.get(char, 'unknown')  # Default to 'unknown' if not found
-                if tile_type != 'unknown':
-                    map_row.append(Tile(event_manager, tile_type, Position2D(x,y)))
-                else:
-                    raise Exception()
-            self.map.append(map_row)
+    @staticmethod
+    def from_snapshot(event_manager, snapshot):
+        game_map = GameMap(event_manager, snapshot['width'], snapshot['height'], snapshot['terrain'])
+        game_map.apply_snapshot(snapshot)
+        return game_map
+
+    def copy(self):
+        """A copy with its own tiles, to read from another thread while this map keeps changing.
+
+        walkable and components are shared, terrain_changed replaces them rather
+        than changing them. The pathfinding grid, path cache and HPA* pathfinder
+        are changed in place, so the copy starts without them.
+        """
+        game_map = copy.copy(self)
+        game_map.tile_types = self.tile_types[:]
+        game_map.tile_phases = self.tile_phases[:]
+        game_map.phase_starts = self.phase_starts[:]
+        game_map.work_times = self.work_times[:]
+        game_map.cooldown_times = self.cooldown_times[:]
+        game_map.tile_data = dict(self.tile_data)
+        game_map.changed_at = dict(self.changed_at)
+        game_map.grid = None
+        game_map.path_cache = OrderedDict()
+        game_map.path_lock = threading.Lock()
+        game_map.pathfinder = None
+        game_map.deadlines = []
+        game_map.deadline_lock = threading.Lock()
+        return game_map
+
+    def copy_tiles_from(self, other, indexes):
+        """Bring the state of the tiles at indexes up to date with other, a map with the same terrain."""
+        for index in indexes:
+            self.tile_phases[index] = other.tile_phases[index]
+            self.phase_starts[index] = other.phase_starts[index]
+            self.work_times[index] = other.work_times[index]
+            self.cooldown_times[index] = other.cooldown_times[index]
+            if index in other.tile_data:
+                self.tile_data[index] = other.tile_data[index]
+            else:
+                self.tile_data.pop(index, None)
+            if index in other.changed_at:
+                self.changed_at[index] = other.changed_at[index]
+        self.epoch = other.epoch
+        self.version = other.version
+        self.synced_version = other.synced_version
+
+    @property
+    def map(self):
+        """Rows of tiles, built on demand."""
+        return [[TileView(self, y * self.width + x) for x in range(self.width)] for y in range(self.height)]
 
     def display_map(self):
-        for row in self.map:
-            line = ''.join(tile.tile_type[0] for tile in row)  # Display first letter of tile type
+        for y in range(self.height):
+            row = self.tile_types[y * self.width:(y + 1) * self.width]
+            line = ''.join(TILE_TYPES[tile_type][0] for tile_type in row)  # Display first letter of tile type
             logging.info(line)
 
     def set_additional_data(self, x, y, data):
         self.additional_data[(y, x)] = data
-        self.map[y][x].additional_data = data
+        self.get_tile(x, y).additional_data = data
 
     def get_cell_data(self, x, y):
         return self.additional_data.get((y, x), None)
@@ -159,13 +512,14 @@ class GameMap:
     def get_tile(self, x, y):
         """Retrieve the tile at the specified coordinates."""
         if 0 <= x < self.width and 0 <= y < self.height:
-            return self.map[y][x]
+            return TileView(self, y * self.width + x)
         return None  # Return None if the coordinates are out of bounds
     
     def is_walkable(self, x, y):
         """Check if the tile at (x, y) is walkable."""
-        tile = self.get_tile(x, y)
-        return tile and tile.tile_type not in ['unknown', 'mountain', 'river']  # Add more non-walkable types as needed
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return bool(self.get_walkable()[y * self.width + x])
+        return False
 
     def to_dict(self):
         return {
@@ -175,35 +529,59 @@ class GameMap:
             'additional_data': self.additional_data
         }
 
-    def find_closest_player_to_player(self, player_id, player_pos, player_positions):
+    def find_closest_player_to_player(self, player_id, player_pos, player_positions, max_distance=None):
         """Find the closest player to the given player_id."""
-        # if player_id not in player_positions:
-        #     logging.warning("Couldn't find initiating player in player_positions")
-        #     return None, None  # Player not found
         if not player_positions:
             return None, None
-        player_position = Position2D.from_list(player_pos)
-        closest_player_id = closest_position = None
-        closest_distance = float('inf')
+        nearby = self.find_players_near(player_pos, player_positions, max_distance, exclude=player_id)
+        if not nearby:
+            return None, None
+        closest_player_id, closest_position, _ = nearby[0]
+        return closest_player_id, closest_position
 
+    def find_players_near(self, position, player_positions, max_distance=None, exclude=None):
+        """Players that can be walked to from position as (player_id, position, steps), nearest first.
+
+        One breadth first expansion finds every player instead of a path search per player,
+        and it stops as soon as everyone is found or max_distance steps have been covered.
+        """
+        width = self.width
+        targets = {}  # tile index -> players standing on it
         for other_player_id, other_data in player_positions.items():
+            if other_player_id == exclude:
+                continue
             other_position = Position2D.from_list(other_data['position'])
-            logging.info(f"other_player_id {other_player_id} other_position {other_position}")
-            if other_player_id == player_id:
-                continue  # Skip the same player
-
-            # Calculate the distance
-            # distance = self.calculate_distance(player_position, other_position)
-
-            # Check if the path is walkable
-            path = self.find_walkable_path(player_position, other_position)
-            if (path):
-                if len(path) < closest_distance:
-                    closest_distance = len(path)
-                    closest_position = other_position
-                    closest_player_id = other_player_id
-
-        return closest_player_id, closest_position
+            if 0 <= other_position.x < width and 0 <= other_position.y < self.height:
+                targets.setdefault(other_position.y * width + other_position.x, []).append((other_player_id, other_position))
+        start = Position2D.from_list(position)
+        if not targets or not (0 <= start.x < width and 0 <= start.y < self.height):
+            return []
+
+        walkable = self.get_walkable()
+        size = len(walkable)
+        visited = bytearray(size)
+        start_index = start.y * width + start.x
+        visited[start_index] = 1
+        frontier = [start_index]
+        found = []
+        steps = 0
+        while frontier:
+            for index in frontier:
+                if index in targets:
+                    found += [(other_player_id, other_position, steps) for other_player_id, other_position in targets.pop(index)]
+            if not targets or steps == max_distance:
+                break
+            next_frontier = []
+            for index in frontier:
+                x = index % width
+                for neighbour in (index - width, index + width,
+                                  index - 1 if x > 0 else -1, index + 1 if x < width - 1 else -1):
+                    if 0 <= neighbour < size and walkable[neighbour] and not visited[neighbour]:
+                        visited[neighbour] = 1
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+            steps += 1
+        return found
 
     def calculate_distance(self, pos1, pos2):
         """Calculate the Euclidean distance between two positions."""
@@ -250,10 +628,37 @@ class GameMap:
     
 
     def find_walkable_path(self, start, end):
+        """Shortest walkable path from start to end as a list of positions, empty if there is none.
+
+        Results are kept in a small LRU cache until walkability changes.
+        """
+        if not self.is_path_walkable(start, end):
+            return []  # Skip the search, it would have to explore the whole area to give up
+        key = (start.y * self.width + start.x, end.y * self.width + end.x)
+        with self.path_lock:
+            path = self.path_cache.get(key)
+            if path is not None:
+                self.path_cache.move_to_end(key)
+                return list(path)
+
+            if self.pathfinder:
+                path = tuple(self.pathfinder.find_path(start, end))
+            else:
+                path = self.find_grid_path(start, end)
+            self.path_cache[key] = path
+            if len(self.path_cache) > self.path_cache_size:
+                self.path_cache.popitem(last=False)
+        return list(path)
+
+    def find_grid_path(self, start, end):
+        """A* over every tile, the caller holds path_lock."""
         # Create a grid representation for pathfinding
         if not self.grid:
-            grid_data = [[1 if self.is_walkable(x, y) else 0 for x in range(self.width)] for y in range(self.height)]
-            self.grid = grid = Grid(matrix=grid_data)
+            walkable = self.get_walkable()
+            grid_data = [walkable[y * self.width:(y + 1) * self.width] for y in range(self.height)]
+            self.grid = Grid(matrix=grid_data)
+        else:
+            self.grid.cleanup()  # Reset the node state left over from the last search
 
         # Define start and end nodes
         start_node = self.grid.node(start.x, start.y)
@@ -263,13 +668,22 @@ class GameMap:
         finder = AStarFinder()
 
         # Find the path
-        path, _ = finder.find_path(start_node, end_node, self.grid)
-        return path
+        nodes, _ = finder.find_path(start_node, end_node, self.grid)
+        return tuple(Position2D(node.x, node.y) for node in nodes)
 
-    def is_path_walkable(self, start, end):
-        """Check if the path between start and end positions is walkable using A*."""
+    def path_distance(self, start, end):
+        """Number of steps along the shortest walkable path, None if end can't be reached."""
         path = self.find_walkable_path(start, end)
-        return path is not None  # Return True if a path exists, False otherwise
+        return len(path) - 1 if path else None
+
+    def is_path_walkable(self, start, end):
+        """Check if end can be walked to from start, without searching for the path."""
+        if not (0 <= start.x < self.width and 0 <= start.y < self.height
+                and 0 <= end.x < self.width and 0 <= end.y < self.height):
+            return False
+        components = self.get_components()
+        label = components[start.y * self.width + start.x]
+        return label != 0 and label == components[end.y * self.width + end.x]
 
 test_map_string = \
 "xxxxxxxxxx"\
@@ -378,27 +792,19 @@ class GameMapEncoderDecoder(json.JSONEncoder):
     def from_dict(data):
         width = data['width']
         height = data['height']
-        map_string = ''.join([''.join([tile['tile_type'][0] for tile in row]) for row in data['map']])
+        map_string = ''.join([''.join([TILE_CHARS[TILE_TYPE_INDEX[tile['tile_type']]] for tile in row]) for row in data['map']])
         game_map = GameMap(EventManager(), width, height, map_string)
         map = data['map']
         for tiles in map:
             for tile in tiles:
-                new_tile = Tile(
-                    game_map.event_manager,
-                    tile_type=tile['tile_type'],
-                    position=Position2D(tile['position'][0], tile['position'][1])
-                )
-                # import pdb; pdb.set_trace()
+                x, y = tile['position']
+                new_tile = game_map.get_tile(x, y)
                 new_tile.work_time = tile['work_time']
                 new_tile.cooldown_time = tile['cooldown_time']
                 new_tile.is_ready_to_work = tile['is_ready_to_work']
                 new_tile.is_finished_work = tile['is_finished_work']
                 new_tile.is_cooling_down = tile['is_cooling_down']
                 new_tile.additional_data = tile['additional_data']
-                new_tile.id = 0
-                
-                x, y = tile['position']
-                game_map.map[y][x] = new_tile  # Place the tile in the correct position
         return game_map
 
 # Example usage
@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import deque
+from enum import Enum
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"  # Drop the oldest droppable frame (position updates) to make room
+    DISCONNECT = "disconnect"    # Give up on the client
+
+
+class OutboundQueue:
+    """Bounded queue of encoded frames waiting to be written to one client.
+
+    Producers never touch the socket, they only append already encoded frames,
+    so a slow client can't stall whoever triggered the message. A single writer
+    (thread or coroutine) drains the queue.
+    """
+    def __init__(self, max_size=256, policy=OverflowPolicy.DROP_OLDEST, on_ready=None, on_overflow=None):
+        self.max_size = max_size
+        self.policy = policy
+        self.on_ready = on_ready  # Called when the writer has something new to do
+        # Called once when the queue gives up on the client. The writer may be stuck
+        # writing to it, so this should close the connection rather than wait for the writer
+        self.on_overflow = on_overflow
+        self.frames = deque()  # (frame, droppable)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame, droppable=False):
+        """Queue a frame, returns False if the client is, or just got, disconnected."""
+        overflowed = False
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.frames) >= self.max_size and not self.make_room():
+                logging.warning(f"Outbound queue overflow, disconnecting client ({self.policy.value})")
+                self.frames.clear()
+                self.closed = True
+                was_empty = overflowed = True
+            else:
+                was_empty = not self.frames
+                self.frames.append((frame, droppable))
+            self.condition.notify()
+        if overflowed and self.on_overflow:
+            self.on_overflow()
+        if was_empty and self.on_ready:
+            self.on_ready()
+        return not overflowed
+
+    def make_room(self):
+        if self.policy is OverflowPolicy.DROP_OLDEST:
+            for index, (_, droppable) in enumerate(self.frames):
+                if droppable:
+                    del self.frames[index]
+                    self.dropped += 1
+                    return True
+        # Nothing we are allowed to drop
+        return False
+
+    def close(self):
+        """Stop accepting frames, the writer flushes what is queued and then closes the socket."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.on_ready:
+            self.on_ready()
+
+    def drain(self):
+        """Take every queued frame without blocking, returns (frames, closed)."""
+        with self.condition:
+            frames = [frame for frame, _ in self.frames]
+            self.frames.clear()
+            return frames, self.closed
+
+    def get(self, timeout=None):
+        """Block until there are frames or the queue is closed, returns (frames, closed)."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.closed, timeout)
+        return self.drain()
@@ -0,0 +1,52 @@
+import itertools
+import threading
+from collections.abc import Mapping
+
+
+class PlayerRegistry(Mapping):
+    """The connected players, player_id -> player data dict.
+
+    Ids come from a counter and are never reused, even after a disconnect.
+    Adding or removing a player swaps in a new dict instead of changing the
+    current one, so iterating (for a broadcast, say) works on a snapshot that
+    no other thread can change; only writers take the lock, and only for the copy.
+    """
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.players = {}
+        self.version = 0  # Bumped by every add and remove
+        self.lock = threading.Lock()
+
+    def __getitem__(self, player_id):
+        return self.players[player_id]
+
+    def __iter__(self):
+        return iter(self.players)
+
+    def __len__(self):
+        return len(self.players)
+
+    def snapshot(self):
+        """The players right now, the dict must not be modified."""
+        return self.players
+
+    def add(self, player):
+        """Register player under a new id and return the id."""
+        with self.lock:
+            player_id = next(self.ids)
+            players = dict(self.players)
+            players[player_id] = player
+            self.players = players
+            self.version += 1
+        return player_id
+
+    def remove(self, player_id):
+        """Unregister player_id, returns its data or None if it wasn't registered."""
+        with self.lock:
+            if player_id not in self.players:
+                return None
+            players = dict(self.players)
+            player = players.pop(player_id)
+            self.players = players
+            self.version += 1
+        return player
@@ -0,0 +1,80 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class TimerHandle:
+    """Returned by call_later, cancel() stops the callback from running."""
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """Runs every delayed callback from one thread, ordered by a heap of deadlines.
+
+    Replaces a threading.Timer (and so an OS thread) per pending timer; the
+    number of threads stays the same however many timers are pending.
+    Callbacks run on the scheduler thread and should be short.
+    """
+    def __init__(self):
+        self.heap = []  # (deadline, sequence, handle)
+        self.sequence = itertools.count()  # Keeps equal deadlines in scheduling order
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="scheduler", daemon=True)
+                self.thread.start()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds."""
+        handle = TimerHandle(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (handle.deadline, next(self.sequence), handle))
+            # Only wake the thread if this is now the earliest deadline
+            if self.heap[0][2] is handle:
+                self.condition.notify()
+        return handle
+
+    def pop_due(self):
+        """Wait for the next callback that is due and not cancelled."""
+        with self.condition:
+            while True:
+                while self.heap and self.heap[0][2].cancelled:
+                    heapq.heappop(self.heap)
+                now = time.monotonic()
+                if self.heap and self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)[2]
+                self.condition.wait(self.heap[0][0] - now if self.heap else None)
+
+    def run(self):
+        while True:
+            handle = self.pop_due()
+            try:
+                handle.callback(*handle.args)
+            except Exception:
+                logging.exception(f"Scheduled callback {handle.callback} failed")
+
+
+scheduler = Scheduler()
+
+
+def call_later(delay, callback, *args):
+    """Schedule callback(*args) on the shared scheduler, starting it on first use."""
+    scheduler.start()
+    return scheduler.call_later(delay, callback, *args)
@@ -1,19 +1,12 @@
 import map
 from position import Position2D
 import miniupnpc 
-import gzip
 import logging
 import sys
-from fight import FightAction, FightManager
+from fight import FightAction, FightManager, FightRegistry
+from logging_config import setup_logging, parse_levels
 
-
-# Configure the logger
-logging.basicConfig(
-    filename='server.log',  # Specify the log file name
-    filemode='w',        # Append mode; use 'w' to overwrite the file
-    format='%(asctime)s - %(levelname)s - %(filename)s - %(funcName)s - %(message)s',
-    level=logging.DEBUG   # Set the logging level
-)
+packet_log = logging.getLogger('packets')  # High frequency, sampled and off unless at DEBUG
 
 
 class GameWorld:
@@ -23,6 +16,14 @@ class GameWorld:
         self.game_map = map.GameMap(event_manager, 50, 11, map.default_map_string)  # Example map size
 
 
+def shutdown_socket(sock):
+    """Shut a socket down both ways, waking any thread blocked reading or writing it."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Already closed
+
+
 def add_upnp_port_mapping():
     try:
         upnp = miniupnpc.UPnP()
@@ -44,31 +45,58 @@ def add_upnp_port_mapping():
 
 import socket
 import threading
+import asyncio
+import queue
+import time
+import argparse
 import json
 from collections import namedtuple
-from map import GameMapEncoderDecoder, Tile
-import struct
-from struct import pack
 from event_manager import EventManager
+from framing import FrameDecoder, FrameTooLarge, encode_json
+from codec import DEFAULT_CODEC, decode_packet, negotiate
+from outbound import OutboundQueue, OverflowPolicy
+from spatial import SpatialHash
+from players import PlayerRegistry
+from collections import defaultdict
 import random 
 
 class GameServer:
-    def __init__(self, host='0.0.0.0', port=43210):
+    def __init__(self, host='0.0.0.0', port=43210, outbox_size=256, overflow_policy=OverflowPolicy.DROP_OLDEST, tick_rate=20, view_radius=40):
         self.host = host
         self.port = port# + random.randrange(0,100)
+        self.outbox_size = outbox_size  # Frames a client may fall behind before overflow_policy applies
+        self.overflow_policy = overflow_policy
+        self.tick_rate = tick_rate  # Batched updates sent per second
+        self.tick_count = 0
+        self.tick_lock = threading.Lock()  # Guards the pending updates below
+        self.dirty_positions = {}  # player_id -> (latest position, cell at the previous tick)
+        self.pending_tile_events = []
+        self.departed = {}  # player_id -> cell of players that disconnected since the last tick
+        # Players only hear about things in the cells around their own, a cell spans a view radius
+        self.view_radius = view_radius
+        self.player_index = SpatialHash(cell_size=view_radius)
+        self.tick_stats = {'ticks': 0, 'batches': 0, 'errors': 0, 'last_fan_out': 0.0, 'max_fan_out': 0.0, 'total_fan_out': 0.0}
+        # Commands that change the world, applied one at a time by the simulation thread
+        self.world_commands = queue.Queue()
+        self.command_stats = {'commands': 0, 'errors': 0, 'total_seconds': 0.0, 'max_backlog': 0}
         self.event_manager = EventManager()
         self.world = GameWorld(self.event_manager)
-        self.players = {}  # Dictionary to hold player data
+        self.players = PlayerRegistry()  # player_id -> player data
         self.client_threads = {}
-        self.fights = []
+        self.fights = FightRegistry()
+        self.ready = threading.Event()  # Set once the server is accepting connections
         self.register_subscriptions()
 
     def start(self):
         """Start the server and listen for incoming connections."""
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
+            # Allow restarting straight away while old connections are in TIME_WAIT
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             server_socket.bind((self.host, self.port))
             server_socket.listen()
             logging.info(f"Server listening on {self.host}:{self.port}")
+            self.start_ticking()
+            self.ready.set()
 
             while True:
                 client_socket, addr = server_socket.accept()
@@ -76,126 +104,283 @@ class GameServer:
                 self.client_threads[f"{addr}"] = threading.Thread(target=self.handle_client, args=(client_socket,))
                 self.client_threads[f"{addr}"].start()
 
-    
-    def send_data_in_chunks(self, sock, json_data, chunk_size=1024):
-        logging.info(json_data)
-        total_length = len(json_data)
-        
-        # Send the total length first
-        sock.sendall(struct.pack('!I', total_length))
-        
-        # Send data in chunks
-        for i in range(0, total_length, chunk_size):
-            chunk = json_data[i:i + chunk_size]
-            sock.sendall(chunk)
 
     def handle_client(self, client_socket):
         """Handle communication with a connected client."""
-        player_id = len(self.players) + 1  # Simple player ID assignment
-        self.players[player_id] = {
+        # Shutting the socket down gets the writer out of a sendall to a client that stopped reading
+        outbox = OutboundQueue(self.outbox_size, self.overflow_policy,
+                               on_overflow=lambda: shutdown_socket(client_socket))
+        player_id = self.players.add({
             'position': Position2D(0, 0),  # Start at position (0, 0)
-            'socket': client_socket
-        }
+            'outbox': outbox,
+            'codec': DEFAULT_CODEC,  # Until the client's hello says otherwise
+        })
+        with self.tick_lock:
+            self.player_index.update(player_id, self.players[player_id]['position'])
+        writer_thread = threading.Thread(target=self.write_client, args=(client_socket, outbox), daemon=True)
+        writer_thread.start()
         # Send initial game state to the player
         # initial_state = {
         #     'player_id': player_id,
         #     'position': self.players[player_id]['position']
         # }
         # client_socket.sendall(json.dumps(initial_state).encode('utf-8'))
-        buffer = ""
+        decoder = FrameDecoder()
         try:
             while True:
                 try:
-                    data = client_socket.recv(1024).decode('utf-8')
+                    received = decoder.recv_into(client_socket)
                 except ConnectionResetError:
                     return
                 except Exception as ex:
                     logging.error(f"Lost connection {client_socket}")
                     logging.error(ex)
-                if not data:
+                    break
+                if not received:
                     break  # Client disconnected
 
-                buffer += data
-        
-                # Attempt to decode the JSON
-                try:
-                    # If the buffer contains multiple JSON objects, split them
-                    while True:
-                        # Find the end of the JSON object
-                        end_index = buffer.find('}')  # Assuming JSON objects end with '}'
-                        if end_index == -1:
-                            break  # No complete JSON object found yet
-                        
-                        # Extract the complete JSON object
-                        json_str = buffer[:end_index + 1]
-                        buffer = buffer[end_index + 1:]  # Remove the processed JSON from the buffer
-                        
-                        # Decode the JSON
-                        # json_data = json.loads(json_str)
-                        # logging.info("Received JSON:", json_data)  # Process the JSON data as needed
-                        command = json.loads(json_str)
-                        self.process_command(player_id, command)
-
-                except json.JSONDecodeError:
-                    # If decoding fails, continue to receive more data
-                    continue
-
-
+                if not self.process_frames(player_id, decoder):
+                    break
 
         finally:
+            outbox.close()
+            writer_thread.join(1)
             client_socket.close()
-            del self.players[player_id]  # Remove player from the list
+            self.players.remove(player_id)  # Remove player from the list
+            self.world_commands.put((player_id, {'action': 'disconnected'}))
             logging.info(f"Player {player_id} disconnected.")
             self.broadcast_message(f"Player {player_id} disconnected")
 
-    def send_map(self, sock, map_data):
-        logging.info("sending map")
-        # use struct to make sure we have a consistent endianness on the length
-        logging.info(f"Length of map_data: {len(map_data)}")
-        length = pack('>Q', len(map_data))
-
-        # sendall to make sure it blocks if there's back-pressure on the socket
-        logging.info(f"Packed length (bytes): {length}")  # Should show 8 bytes
-        sock.sendall(length)
-        sock.sendall(map_data)
+    def start_ticking(self):
+        threading.Thread(target=self.run_ticks, name="simulation", daemon=True).start()
+
+    def run_ticks(self):
+        """The simulation thread, the only thread that changes the world.
+
+        Applies world commands as they are queued and runs tick at a fixed rate,
+        skipping ticks rather than bursting when we fall behind.
+        """
+        interval = 1 / self.tick_rate
+        next_tick = time.monotonic()
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                # Like a failed command, one bad tick mustn't stop the world
+                self.tick_stats['errors'] += 1
+                logging.exception(f"Failed to run tick {self.tick_count}")
+            next_tick += interval
+            if next_tick <= time.monotonic():
+                next_tick = time.monotonic()
+            self.apply_commands(next_tick)
+
+    def apply_commands(self, until):
+        """Apply queued world commands until the monotonic time until."""
+        stats = self.command_stats
+        while True:
+            timeout = until - time.monotonic()
+            if timeout <= 0:
+                return
+            try:
+                player_id, command = self.world_commands.get(timeout=timeout)
+            except queue.Empty:
+                return
+            stats['max_backlog'] = max(stats['max_backlog'], self.world_commands.qsize() + 1)
+            started = time.perf_counter()
+            try:
+                self.apply_command(player_id, command)
+            except Exception:
+                stats['errors'] += 1
+                logging.exception(f"Failed to apply {command} from player {player_id}")
+            stats['commands'] += 1
+            stats['total_seconds'] += time.perf_counter() - started
+
+    def tick(self):
+        """Send every client one batch with the nearby positions and tile changes since the last tick."""
+        # Tiles whose work or cooldown ran out queue their events for this tick
+        self.world.game_map.sweep()
+        # Every fight round that is due ends together
+        self.fights.resolve_due()
+        with self.tick_lock:
+            positions, self.dirty_positions = self.dirty_positions, {}
+            tiles, self.pending_tile_events = self.pending_tile_events, []
+            departed, self.departed = self.departed, {}
+            self.tick_count += 1
+            if not positions and not tiles and not departed:
+                return
+
+            started = time.perf_counter()
+            index = self.player_index
+            # Collect the changes each occupied cell can see. Viewers that could see a player
+            # before it changed cell or disconnected, but can't any more, are told it left.
+            deltas = defaultdict(lambda: ([], [], []))
+            movers = set()
+            for player_id, (position, from_cell) in positions.items():
+                cell = index.cell_of(position)
+                visible_from = set(index.cells_around(cell))
+                if from_cell != cell:
+                    movers.add(player_id)
+                    if from_cell is not None:
+                        for viewer_cell in set(index.cells_around(from_cell)) - visible_from:
+                            deltas[viewer_cell][1].append(player_id)
+                for viewer_cell in visible_from:
+                    deltas[viewer_cell][0].append([player_id, position[0], position[1]])
+            for player_id, cell in departed.items():
+                for viewer_cell in index.cells_around(cell):
+                    deltas[viewer_cell][1].append(player_id)
+            for tile in tiles:
+                for viewer_cell in index.cells_around(index.cell_of(tile['tile_pos'])):
+                    deltas[viewer_cell][2].append(tile)
+
+            # Everyone in a cell gets the same batch, so it's encoded once per cell
+            sent = 0
+            for viewer_cell, (cell_positions, cell_left, cell_tiles) in deltas.items():
+                viewers = index.cells[viewer_cell] - movers
+                batch = {
+                    'tick': self.tick_count,
+                    'positions': cell_positions,
+                    'left': cell_left,
+                    'tiles': cell_tiles,
+                    'snapshot': False,
+                }
+                # A batch of positions only is superseded by the next one, the rest must arrive
+                self.broadcast(batch, droppable=not (cell_left or cell_tiles), recipients=viewers)
+                sent += len(viewers)
+
+            # Players that moved into a new cell get everyone they can now see. Tile changes
+            # they missed while away aren't repeated here, the client asks for a map delta.
+            players = self.players.snapshot()
+            for player_id in movers:
+                cell = index.item_cells[player_id]
+                visible = [[other_id, *players[other_id]['position']]
+                           for other_cell in index.cells_around(cell)
+                           for other_id in index.cells[other_cell] if other_id in players]
+                snapshot = {
+                    'tick': self.tick_count,
+                    'positions': visible,
+                    'left': [],
+                    'tiles': deltas[cell][2] if cell in deltas else [],
+                    'snapshot': True,
+                }
+                self.broadcast(snapshot, recipients=(player_id,))
+                sent += 1
+            fan_out = time.perf_counter() - started
+
+        stats = self.tick_stats
+        stats['ticks'] += 1
+        stats['batches'] += sent
+        stats['last_fan_out'] = fan_out
+        stats['max_fan_out'] = max(stats['max_fan_out'], fan_out)
+        stats['total_fan_out'] += fan_out
+        if stats['ticks'] % (self.tick_rate * 10) == 0:
+            logging.info(f"Tick fan out: last {fan_out * 1000:.3f}ms, "
+                         f"mean {stats['total_fan_out'] / stats['ticks'] * 1000:.3f}ms, "
+                         f"max {stats['max_fan_out'] * 1000:.3f}ms over {stats['ticks']} ticks")
+            commands = self.command_stats
+            logging.info(f"World commands: {commands['commands']} applied, {commands['errors']} failed, "
+                         f"mean {commands['total_seconds'] / max(commands['commands'], 1) * 1000:.3f}ms, "
+                         f"max backlog {commands['max_backlog']}")
+
+    def write_client(self, client_socket, outbox):
+        """Write everything queued for a client until its outbound queue is closed."""
+        try:
+            while True:
+                frames, closed = outbox.get()
+                if frames:
+                    client_socket.sendall(b''.join(frames))
+                if closed:
+                    break
+        except OSError as ex:
+            logging.error(f"Failed to write to {client_socket}: {ex}")
+        finally:
+            outbox.close()
+            # Wake the reader so the player gets cleaned up
+            shutdown_socket(client_socket)
 
-        ack = sock.recv(1)
+    def process_frames(self, player_id, decoder):
+        """Process every complete command buffered in decoder, returns False if the player must be dropped."""
+        try:
+            for flags, payload in decoder.frames():
+                try:
+                    command = decode_packet(flags, payload)
+                except json.JSONDecodeError:
+                    logging.error(f"Received invalid JSON from player {player_id}")
+                    continue
+                self.process_command(player_id, command)
+        except FrameTooLarge as ex:
+            logging.warning(f"Disconnecting player {player_id}: {ex}")
+            return False
+        return True
 
     def process_command(self, player_id, command):
         """Process movement commands from the player."""
-        logging.info(command)
+        packet_log.debug("Received %s", command, extra={'player_id': player_id})
+        if command.get("request") and command['request'] == 'hello':
+            # Agree on a codec, the reply itself is always sent as JSON
+            codec = negotiate(command.get('codecs'))
+            data_packet = {
+                'request': 'hello',
+                'codec': codec.name,
+                # Lets the client use its cached terrain and only download tile state
+                'terrain_hash': self.world.game_map.get_terrain_hash(),
+                # Sending moves more often than we tick only queues them up
+                'tick_rate': self.tick_rate,
+            }
+            self.players[player_id]['outbox'].put(encode_json(data_packet))
+            self.players[player_id]['codec'] = codec
         if command.get("request") and command['request'] == 'id':
             data_packet = {
                 'request': 'id',
                 'id': player_id
             }
-            self.players[player_id]['socket'].sendall(json.dumps(data_packet).encode('utf-8'))
+            self.send_to_player(player_id, data_packet)
         if command.get("request") and command['request'] == 'players':
-            for pid, player in self.players.items():
-                if pid != player_id:
+            # Only the players in view, the client never hears how the rest move or leave
+            with self.tick_lock:
+                nearby = self.player_index.near(self.players[player_id]['position']) if player_id in self.player_index else set()
+            players = self.players.snapshot()
+            for pid in nearby:
+                if pid != player_id and pid in players:
                     data_packet = {
                         'player_id': pid,
-                        'new_position': player['position']
+                        'new_position': players[pid]['position']
                     }
-                    self.players[player_id]['socket'].sendall(json.dumps(data_packet).encode('utf-8'))
+                    self.send_to_player(player_id, data_packet)
+        if command.get('action') and command['action'] == 'client_disconnecting':
+            self.message_player(player_id, "quit")
+            # The writer flushes the quit message before closing the socket
+            self.players[player_id]['outbox'].close()
+            return
+        if command.get("request") == 'map' or command.get('action'):
+            # Anything that reads or changes the world is left to the simulation thread
+            self.world_commands.put((player_id, command))
+
+    def apply_command(self, player_id, command):
+        """Apply a command that reads or changes the world, on the simulation thread."""
+        if player_id not in self.players and command.get('action') != 'disconnected':
+            logging.info(f"Ignoring {command} from player {player_id}, they have disconnected")
+            return
         if command.get("request") and command['request'] == 'map':
+            snapshot = self.world.game_map.snapshot(command.get('since'), command.get('epoch'), command.get('terrain_hash'))
             data_packet = {
                 'request': 'map',
-                'map': self.world.game_map
+                'snapshot': snapshot
             }
-            data = json.dumps(data_packet, cls=GameMapEncoderDecoder).encode('utf-8')
-            compressed_data = gzip.compress(data)
-
-            self.send_map(self.players[player_id]['socket'], compressed_data)
-
-        if command.get('action') and command['action'] == 'client_disconnecting':
-            self.message_player(player_id, "quit")
-            # self.players[player_id]['socket'].shutdown(socket.SHUT_RDWR)
-            self.players[player_id]['socket'].close()
-            return
+            map_frame = encode_json(data_packet, compress=True)
+            logging.info(f"Sending map, {len(map_frame)} bytes")
+            self.players[player_id]['outbox'].put(map_frame)
+
+        if command.get('action') and command['action'] == 'disconnected':
+            # Here rather than in handle_client, so a move already being applied can't put them back
+            with self.tick_lock:
+                if player_id in self.player_index:
+                    self.departed[player_id] = self.player_index.item_cells[player_id]
+                self.player_index.remove(player_id)
+                self.dirty_positions.pop(player_id, None)
+            self.end_fight(player_id)
         elif command.get('action') and command['action'] == 'move':
             position = command['position']
-            self.move_player(player_id, position)
+            self.move_requested(player_id, position, command.get('seq'))
         elif command.get('action') and command['action'] == 'work':
             position = command['position']
             player_name = command['player_id']
@@ -216,11 +401,7 @@ class GameServer:
             position = command['position']
             player_id = command['player_id']
             # Set fight action in fight
-            for fight in self.fights:
-                if fight.aggressor == player_id:
-                    fight.aggressor_action = FightAction(command['fight_action'])
-                if fight.defender == player_id:
-                    fight.defender_action = FightAction(command['fight_action'])
+            self.fights.set_action(player_id, FightAction(command['fight_action']))
 
     def work_tile(self, player_id, position):
         tile = self.world.game_map.get_tile(position[0], position[1])
@@ -248,14 +429,39 @@ class GameServer:
             'message': "fight requested"
         }
         self.broadcast(message)
-        new_fight = FightManager(player_id, position, self.players, self.world)
+        if player_id in self.fights:
+            self.message_player(player_id, "Already fighting")
+            return
+        new_fight = FightManager(player_id, position, self.players.snapshot(), self.world)
         if new_fight.defender == None:
             self.message_player(player_id, "No defender found")
+        elif not self.fights.add(new_fight):
+            self.message_player(player_id, "Defender is already fighting")
         else:
             self.message_player(new_fight.defender, "fight_initiated")
             self.message_player(new_fight.aggressor, "fight_initiated")
-            self.fights.append(new_fight)
-            
+
+    def end_fight(self, player_id):
+        """Conclude the fight player_id is in, if any, telling both players that are still here."""
+        fight = self.fights.end(player_id)
+        if fight:
+            for fighter in (fight.aggressor, fight.defender):
+                if fighter in self.players:
+                    self.message_player(fighter, "fight_concluded")
+
+    def move_requested(self, player_id, position, seq=None):
+        """Move a player that asked to, if it can stand there.
+
+        A move with a sequence number is acknowledged with where the player
+        ended up, so the client can correct the moves it predicted.
+        """
+        if self.world.game_map.is_walkable(position[0], position[1]):
+            self.move_player(player_id, position)
+        else:
+            logging.info(f"Player {player_id} can't move to {position}")
+        if seq is not None:
+            x, y = self.players[player_id]['position']
+            self.send_to_player(player_id, {'player_id': player_id, 'position': Position2D(x, y), 'move_ack': seq})
 
     def move_player(self, player_id, position):
         """Move the player based on the direction provided."""
@@ -266,8 +472,12 @@ class GameServer:
         # Update the player's position
         self.players[player_id]['position'] = new_position
 
-        # Notify all players of the new position (optional)
-        self.notify_players(player_id, new_position)
+        # Nearby players get the latest position with the next tick
+        with self.tick_lock:
+            previous_cell = self.player_index.update(player_id, new_position)
+            if player_id in self.dirty_positions:
+                previous_cell = self.dirty_positions[player_id][1]
+            self.dirty_positions[player_id] = (new_position, previous_cell)
 
     def message_player(self, player_id, message):
         message_packet = {
@@ -276,27 +486,32 @@ class GameServer:
         }
         self.send_to_player(player_id, message_packet)
 
-    def send_to_player(self, player_id, packet):
-        self.players[player_id]['socket'].sendall(json.dumps(packet).encode('utf-8'))
-
-    def broadcast(self, data_packet):
-        for _, player in self.players.items():
-            logging.info(f"Broadcasting {data_packet}")
-            player['socket'].sendall(json.dumps(data_packet).encode('utf-8'))
+    def send_to_player(self, player_id, packet, droppable=False):
+        player = self.players.get(player_id)
+        if player is None:
+            logging.info(f"Not sending to player {player_id}, they have disconnected")
+            return
+        player['outbox'].put(player['codec'].encode(packet), droppable)
+
+    def broadcast(self, data_packet, exclude=None, droppable=False, recipients=None):
+        """Queue data_packet for every player (or just recipients), encoding it once per codec in use."""
+        packet_log.debug("Broadcasting %s", data_packet)
+        frames = {}
+        players = self.players.snapshot()
+        if recipients is None:
+            recipients = players
+        for pid in recipients:
+            player = players.get(pid)
+            if pid == exclude or player is None:
+                continue
+            codec = player['codec']
+            frame = frames.get(codec.name)
+            if frame is None:
+                frame = frames[codec.name] = codec.encode(data_packet)
+            player['outbox'].put(frame, droppable)
 
     def broadcast_message(self, message):
-        for pid, player in self.players.items():
-            self.message_player(pid, message)
-
-    def notify_players(self, player_id, new_position):
-        """Notify all players of the updated position."""
-        message = {
-            'player_id': player_id,
-            'new_position': new_position
-        }
-        for pid, player in self.players.items():
-            if pid != player_id:  # Don't send to the player who moved
-                player['socket'].sendall(json.dumps(message).encode('utf-8'))
+        self.broadcast({'message': message})
 
     def register_subscriptions(self):
         self.event_manager.subscribe('tile_working', self.notify_tile_working)
@@ -308,7 +523,7 @@ class GameServer:
 
 
     def notify_tile_working(self, *args, **kwargs):
-        logging.info(kwargs)
+        packet_log.debug("Tile event %s", kwargs)
         data_packet = {
             'origin': 'tile',
             'action': 'working',
@@ -316,20 +531,20 @@ class GameServer:
             'is_success': kwargs.get('is_success'),
             'player_id': kwargs.get('player_id'),
         }
-        self.broadcast(data_packet)
+        self.queue_tile_event(data_packet)
 
     def notify_tile_worked(self, *args, **kwargs):
-        logging.info(kwargs)
+        packet_log.debug("Tile event %s", kwargs)
         data_packet = {
             'origin': 'tile',
             'action': 'worked',
             'tile_pos': kwargs.get('position'),
             'is_success': kwargs.get('is_success'),
         }
-        self.broadcast(data_packet)
+        self.queue_tile_event(data_packet)
 
     def notify_tile_activated(self, *args, **kwargs):
-        logging.info(kwargs)
+        packet_log.debug("Tile event %s", kwargs)
         data_packet = {
             'origin': 'tile',
             'action': 'activated',
@@ -337,17 +552,22 @@ class GameServer:
             'is_success': kwargs.get('is_success'),
             'player_id': kwargs.get('player_id'),
         }
-        self.broadcast(data_packet)
+        self.queue_tile_event(data_packet)
 
     def notify_tile_ready(self, *args, **kwargs):
-        logging.info(kwargs)
+        packet_log.debug("Tile event %s", kwargs)
         data_packet = {
             'origin': 'tile',
             'action': 'ready',
             'tile_pos': kwargs.get('position'),
             'is_success': kwargs.get('is_success'),
         }
-        self.broadcast(data_packet)
+        self.queue_tile_event(data_packet)
+
+    def queue_tile_event(self, data_packet):
+        """Tile changes go out with the next tick."""
+        with self.tick_lock:
+            self.pending_tile_events.append(data_packet)
 
     def notify_damage_received(self,  *args, **kwargs):
         self.message_player(kwargs.get('player_id'), "damage_received")
@@ -355,11 +575,108 @@ class GameServer:
     def notify_player_died(self,  *args, **kwargs):
         self.message_player(kwargs.get('player_id'), "player_died")
         # Check for fights ending
-        for fight in self.fights:
-            if fight.aggressor == kwargs.get('player_id') or fight.defender == kwargs.get('player_id'):
-                self.message_player(fight.aggressor, "fight_concluded")
-                self.message_player(fight.defender, "fight_concluded")
+        self.end_fight(kwargs.get('player_id'))
+
+
+class AsyncGameServer(GameServer):
+    """GameServer variant that runs every client as a coroutine on a single event loop.
+
+    process_command and the EventManager subscriptions are shared with GameServer,
+    only the accept loop and the per client reader differ.
+    """
+    def __init__(self, host='0.0.0.0', port=43210, outbox_size=256, overflow_policy=OverflowPolicy.DROP_OLDEST, tick_rate=20, view_radius=40, backlog=1024):
+        super().__init__(host, port, outbox_size, overflow_policy, tick_rate, view_radius)
+        self.backlog = backlog
+        self.loop = None
+
+    def start(self):
+        """Start the server and run the event loop until it is stopped."""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, backlog=self.backlog)
+        logging.info(f"Async server listening on {self.host}:{self.port}")
+        self.start_ticking()
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        """Handle communication with a connected client."""
+        logging.info(f"Player connected from {writer.get_extra_info('peername')}")
+        # Frames may be queued from timer threads, so wake the writer through the loop
+        outbox_ready = asyncio.Event()
+        outbox = OutboundQueue(self.outbox_size, self.overflow_policy,
+                               on_ready=lambda: self.loop.call_soon_threadsafe(outbox_ready.set),
+                               # Aborting gets the writer out of a drain to a client that stopped reading
+                               on_overflow=lambda: self.loop.call_soon_threadsafe(writer.transport.abort))
+        player_id = self.players.add({
+            'position': Position2D(0, 0),  # Start at position (0, 0)
+            'outbox': outbox,
+            'codec': DEFAULT_CODEC,  # Until the client's hello says otherwise
+        })
+        with self.tick_lock:
+            self.player_index.update(player_id, self.players[player_id]['position'])
+        writer_task = asyncio.create_task(self.write_client(writer, outbox, outbox_ready))
+        decoder = FrameDecoder()
+        try:
+            while True:
+                try:
+                    data = await reader.read(65536)
+                except ConnectionError:
+                    break
+                if not data:
+                    break  # Client disconnected
+
+                decoder.feed(data)
+                if not self.process_frames(player_id, decoder):
+                    break
+        finally:
+            outbox.close()
+            await writer_task
+            self.players.remove(player_id)  # Remove player from the list
+            self.world_commands.put((player_id, {'action': 'disconnected'}))
+            logging.info(f"Player {player_id} disconnected.")
+            self.broadcast_message(f"Player {player_id} disconnected")
+
+    async def write_client(self, writer, outbox, outbox_ready):
+        """Write everything queued for a client until its outbound queue is closed."""
+        try:
+            while True:
+                await outbox_ready.wait()
+                outbox_ready.clear()
+                frames, closed = outbox.drain()
+                if frames:
+                    writer.writelines(frames)
+                    await writer.drain()
+                if closed:
+                    break
+        except ConnectionError as ex:
+            logging.error(f"Failed to write to player: {ex}")
+        finally:
+            outbox.close()
+            writer.close()
+
+
+SERVER_MODES = {
+    'thread': GameServer,
+    'asyncio': AsyncGameServer,
+}
 
 if __name__ == "__main__":
-    server = GameServer()
+    parser = argparse.ArgumentParser(description="Game Server")
+    parser.add_argument("-host", type=str, help="Address to listen on", default='0.0.0.0')
+    parser.add_argument("-port", type=int, help="Port to listen on", default=43210)
+    parser.add_argument("-mode", choices=SERVER_MODES.keys(), help="Thread per client or a single asyncio event loop", default='thread')
+    parser.add_argument("-outbox", type=int, help="Frames queued per client before the overflow policy applies", default=256)
+    parser.add_argument("-overflow", choices=[policy.value for policy in OverflowPolicy], help="What to do with clients that fall behind", default=OverflowPolicy.DROP_OLDEST.value)
+    parser.add_argument("-tickrate", type=int, help="Batched world updates sent per second", default=20)
+    parser.add_argument("-viewradius", type=int, help="Distance in tiles within which players receive updates", default=40)
+    parser.add_argument("-loglevel", type=parse_levels, help="Log levels per logger, e.g. packets=DEBUG,events=DEBUG", default={})
+    parser.add_argument("-structuredlogs", action="store_true", help="Write the log as one JSON object per line")
+    args = parser.parse_args()
+
+    setup_logging('server.log', args.loglevel, args.structuredlogs)
+    server = SERVER_MODES[args.mode](args.host, args.port, args.outbox, OverflowPolicy(args.overflow), args.tickrate, args.viewradius)
     server.start()
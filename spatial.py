@@ -0,0 +1,54 @@
+class SpatialHash:
+    """Buckets ids into square cells so that ids near a position can be found
+    without looking at every id.
+    """
+    def __init__(self, cell_size=16):
+        self.cell_size = cell_size
+        self.cells = {}      # (cell_x, cell_y) -> set of ids
+        self.item_cells = {}  # id -> (cell_x, cell_y)
+
+    def __len__(self):
+        return len(self.item_cells)
+
+    def __contains__(self, item):
+        return item in self.item_cells
+
+    def cell_of(self, position):
+        return (position[0] // self.cell_size, position[1] // self.cell_size)
+
+    def update(self, item, position):
+        """Insert or move item, returns the cell it was in before (None if it is new)."""
+        new_cell = self.cell_of(position)
+        old_cell = self.item_cells.get(item)
+        if old_cell != new_cell:
+            if old_cell is not None:
+                self.discard_from_cell(item, old_cell)
+            self.cells.setdefault(new_cell, set()).add(item)
+            self.item_cells[item] = new_cell
+        return old_cell
+
+    def remove(self, item):
+        cell = self.item_cells.pop(item, None)
+        if cell is not None:
+            self.discard_from_cell(item, cell)
+
+    def discard_from_cell(self, item, cell):
+        bucket = self.cells[cell]
+        bucket.discard(item)
+        if not bucket:
+            del self.cells[cell]
+
+    def cells_around(self, cell, radius=1):
+        """Occupied cells within radius cells of cell, including cell itself."""
+        cell_x, cell_y = cell
+        for y in range(cell_y - radius, cell_y + radius + 1):
+            for x in range(cell_x - radius, cell_x + radius + 1):
+                if (x, y) in self.cells:
+                    yield (x, y)
+
+    def near(self, position, radius=1):
+        """Ids in the cells within radius cells of position."""
+        items = set()
+        for cell in self.cells_around(self.cell_of(position), radius):
+            items |= self.cells[cell]
+        return items
@@ -0,0 +1,26 @@
+import unittest
+from character import Stats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_setting_a_stat_changes_the_version(self):
+        stats = Stats()
+        version, levels_version = stats.version, stats.levels.version
+        stats.xp += 1
+        self.assertGreater(stats.version, version)
+        self.assertEqual(stats.levels.version, levels_version)
+        stats.levels.strength += 1
+        self.assertGreater(stats.levels.version, levels_version)
+
+    def test_items_in_declared_order(self):
+        stats = Stats()
+        self.assertEqual([name for name, _ in stats.levels.items()],
+                         ['max_health', 'max_stamina', 'max_mana', 'strength', 'defence', 'speed'])
+        self.assertEqual(dict(stats.items())['health'], stats.levels.max_health)
+        with self.assertRaises(AttributeError):
+            stats.typo = 1  # __slots__ catches misspelt stats
+
+
+if __name__ == '__main__':
+    unittest.main()
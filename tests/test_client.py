@@ -2,24 +2,301 @@ import unittest
 from unittest.mock import patch, MagicMock
 import time
 import threading
-from map import GameMap, Tile, default_map_string
+from map import GameMap, Tile, default_map_string, WORKING
 import json
+import os
+import tempfile
+import select
 import client
-from server import GameServer
+from character import Character
+from position import Position2D
+from server import GameServer, AsyncGameServer
 from unittest.mock import patch, MagicMock
 
 class TestClient(unittest.TestCase):
 
+    def setUp(self):
+        # Keep the terrain cache out of the real ~/.cache
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(cache.cleanup)
+        self.cache_dir = cache.name
+
     def test_connection(self):
         # Will hang forever due to start() loop
         server = GameServer()
         # server.handle_client = MagicMock()
         server_thread = threading.Thread(target=server.start, args=(), daemon=True)
         server_thread.start()
-        connection = client.Connection()
+        server.ready.wait(5)
+        connection = client.Connection(cache_dir=self.cache_dir)
+        self.assertIsNotNone(connection.map)
+        return True
+
+    def test_connection_asyncio(self):
+        server = AsyncGameServer(port=43211)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        connection = client.Connection(port=43211, cache_dir=self.cache_dir)
         self.assertIsNotNone(connection.map)
+        self.assertEqual(connection.player_id, 1)
+        self.assertEqual(connection.codec.name, 'struct')
+        return True
+
+    def test_connection_json_codec(self):
+        server = AsyncGameServer(port=43213)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        connection = client.Connection(port=43213, codecs=('json',), cache_dir=self.cache_dir)
+        self.assertEqual(connection.codec.name, 'json')
+        self.assertIsNotNone(connection.map)
+        return True
+
+    def test_moves_are_sent_once_a_server_tick(self):
+        server = GameServer(port=43219, tick_rate=10)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        connection = client.Connection(port=43219, cache_dir=self.cache_dir)
+        self.assertEqual(connection.server_tick_rate, 10)
+        self.assertAlmostEqual(connection.moves.interval, 0.1)
+
+    def test_wakeup_on_network_update(self):
+        server = GameServer(port=43215)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        first = client.Connection(port=43215, cache_dir=self.cache_dir)
+        self.assertTrue(select.select([first.wakeup], [], [], 2)[0])
+        first.wakeup.clear()
+        self.assertFalse(first.wakeup.clear())
+
+        # Another player moving reaches first as a tick batch, which wakes its main loop
+        second = client.Connection(port=43215, cache_dir=self.cache_dir)
+        second.client_socket.sendall(second.codec.encode(
+            {'player_id': second.player_id, 'position': [1, 0], 'action': 'move'}))
+        self.assertTrue(select.select([first.wakeup], [], [], 2)[0])
+        self.assertTrue(first.wakeup.clear())
+
+    def test_snapshot_published_per_batch(self):
+        server = GameServer(port=43216)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        first = client.Connection(port=43216, cache_dir=self.cache_dir)
+        self.assertTrue(select.select([first.wakeup], [], [], 2)[0])
+        first.wakeup.clear()
+        before = first.snapshot
+
+        second = client.Connection(port=43216, cache_dir=self.cache_dir)
+        second.client_socket.sendall(second.codec.encode(
+            {'player_id': second.player_id, 'position': [1, 0], 'action': 'move'}))
+        deadline = time.time() + 2
+        while second.player_id not in first.snapshot.player_positions and time.time() < deadline:
+            select.select([first.wakeup], [], [], 0.1)
+            first.wakeup.clear()
+        after = first.snapshot
+        self.assertEqual(tuple(after.player_positions[second.player_id]), (1, 0))
+        self.assertGreater(after.version, before.version)
+        # Snapshots already handed out don't change, and the map is only copied when it changed
+        self.assertNotIn(second.player_id, before.player_positions)
+        self.assertIs(after.game_map, before.game_map)
+        with self.assertRaises(TypeError):
+            after.player_positions[99] = (0, 0)
+
+    def test_entering_an_area_brings_its_tiles_up_to_date(self):
+        server = GameServer(port=43217, view_radius=5)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        connection = client.Connection(port=43217, cache_dir=self.cache_dir)
+        # Worked on far from us, so the event isn't sent to us
+        server.world.game_map.get_tile(40, 2).work(99)
+        time.sleep(0.1)
+        index = 2 * connection.map.width + 40
+        self.assertNotEqual(connection.map.tile_phases[index], WORKING)
+        connection.client_socket.sendall(connection.codec.encode(
+            {'player_id': connection.player_id, 'position': [38, 2], 'action': 'move'}))
+        deadline = time.time() + 2
+        while connection.map.tile_phases[index] != WORKING and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(connection.map.tile_phases[index], WORKING)
+
+    def test_joining_only_hears_of_players_in_view(self):
+        server = GameServer(port=43225, view_radius=5)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        far = client.Connection(port=43225, cache_dir=self.cache_dir)
+        near = client.Connection(port=43225, cache_dir=self.cache_dir)
+        far.client_socket.sendall(far.codec.encode(
+            {'player_id': far.player_id, 'position': [38, 2], 'action': 'move'}))
+        deadline = time.time() + 2
+        while server.players[far.player_id]['position'] != Position2D(38, 2) and time.time() < deadline:
+            time.sleep(0.01)
+
+        joining = client.Connection(port=43225, cache_dir=self.cache_dir)
+        deadline = time.time() + 2
+        while near.player_id not in joining.snapshot.player_positions and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIn(near.player_id, joining.snapshot.player_positions)
+        # Out of view, so it would never be told when they move on or leave
+        self.assertNotIn(far.player_id, joining.snapshot.player_positions)
+
+    def test_terrain_cache(self):
+        server = AsyncGameServer(port=43214)
+        server_thread = threading.Thread(target=server.start, args=(), daemon=True)
+        server_thread.start()
+        server.ready.wait(5)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            first = client.Connection(port=43214, cache_dir=cache_dir)
+            terrain_hash = server.world.game_map.get_terrain_hash()
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, f"{terrain_hash}.json")))
+
+            # The second client builds its map from the cache, the server only sends tile state
+            server.world.game_map.get_tile(1, 1).is_cooling_down = True
+            with patch.object(client.GameMap, 'from_snapshot', side_effect=AssertionError("terrain downloaded")):
+                second = client.Connection(port=43214, cache_dir=cache_dir)
+            self.assertEqual(second.map.terrain_string(), first.map.terrain_string())
+            self.assertTrue(second.map.get_tile(1, 1).is_cooling_down)
+            self.assertEqual(list(second.startup_timings), ['connect', 'handshake', 'terrain_cache', 'map', 'id'])
         return True
 
 
+class TestTerrainCache(unittest.TestCase):
+
+    def test_only_hex_digests_name_files(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = client.TerrainCache(cache_dir)
+            for terrain_hash in ('../../x', 'a' * 63 + '/', 'A' * 64, 42):
+                with patch('builtins.open', side_effect=AssertionError("opened")):
+                    self.assertIsNone(cache.load(terrain_hash, None))
+                with self.assertRaises(ValueError):
+                    cache.path(terrain_hash)
+            self.assertEqual(cache.path('0' * 64), os.path.join(cache_dir, '0' * 64 + '.json'))
+
+
+class TestMapBuffers(unittest.TestCase):
+
+    def setUp(self):
+        self.game_map = GameMap(None, 50, 11, default_map_string)
+        self.buffers = client.MapBuffers()
+
+    def test_copies_are_reused_once_the_reader_moved_on(self):
+        first = self.buffers.publish(self.game_map, 1)
+        self.game_map.set_tile_state(1, WORKING)
+        self.buffers.changed([1])
+        # Still being read, so it is copied again
+        second = self.buffers.publish(self.game_map, 2)
+        self.assertIsNot(second, first)
+        self.assertNotEqual(first.tile_phases[1], WORKING)
+
+        self.buffers.reader_version = 2
+        self.game_map.set_tile_state(2, WORKING)
+        self.buffers.changed([2])
+        self.game_map.tile_phases[3] = WORKING  # Not reported, so not copied
+        third = self.buffers.publish(self.game_map, 3)
+        self.assertIs(third, first)
+        self.assertEqual(list(third.tile_phases[1:4]), [WORKING, WORKING, self.game_map.tile_phases[0]])
+        self.assertEqual(third.version, self.game_map.version)
+
+    def test_republished_copy_is_not_reused_while_read(self):
+        first = self.buffers.publish(self.game_map, 1)
+        self.buffers.publish(self.game_map, 2)
+        self.buffers.republish(first, 3)
+        self.buffers.reader_version = 3
+        self.assertIsNot(self.buffers.publish(self.game_map, 4), first)
+
+    def test_copies_are_not_patched_after_everything_changed(self):
+        first = self.buffers.publish(self.game_map, 1)
+        self.buffers.changed()
+        self.buffers.reader_version = 2
+        self.assertIsNot(self.buffers.publish(self.game_map, 2), first)
+        self.assertEqual(len(self.buffers.buffers), 2)
+
+
+class TestMessageHistory(unittest.TestCase):
+
+    def test_keeps_only_the_last_messages(self):
+        history = client.MessageHistory(capacity=3)
+        for number in range(5):
+            history.add_message({'message': number}, 'message')
+        self.assertEqual(history.get_last_messages(10), ["{'message': 2}", "{'message': 3}", "{'message': 4}"])
+        self.assertEqual(history.get_last_messages(1), ["{'message': 4}"])
+        self.assertEqual(history.get_last_messages(0), [])
+
+    def test_collapsed_categories_are_counted(self):
+        history = client.MessageHistory()
+        commands = [{'tick': 1, 'positions': [], 'tiles': []}, {'player_id': 2, 'new_position': [1, 1]},
+                    {'tick': 2, 'positions': [], 'tiles': []}, {'message': 'fight_initiated'}]
+        for command in commands:
+            history.add_message(command, client.message_category(command))
+        self.assertEqual(history.get_last_messages(5), ["{'message': 'fight_initiated'}"])
+        self.assertEqual(history.collapsed_counts(), "1 position, 2 tick")
+
+    def test_formats_only_what_is_shown(self):
+        history = client.MessageHistory()
+        shown = MagicMock()
+        hidden = MagicMock()
+        history.add_message(hidden)
+        history.add_message(shown)
+        history.get_last_messages(1)
+        shown.__str__.assert_called_once()
+        hidden.__str__.assert_not_called()
+
+
+class TestPredictedMoves(unittest.TestCase):
+
+    class Player:
+        moveTo = Character.moveTo
+
+        def __init__(self, x, y):
+            self.position = Position2D(x, y)
+
+    def setUp(self):
+        self.game_map = GameMap(None, 50, 11, default_map_string)  # (26, 0) is river
+        self.connection = MagicMock()
+        self.moves = client.PredictedMoves(interval=0.05)
+
+    def test_moves_are_sent_once_an_interval(self):
+        player = self.Player(1, 0)
+        for x in (2, 3, 4):
+            self.assertTrue(self.moves.move(player, self.game_map, x, 0))
+        self.assertFalse(self.moves.move(player, self.game_map, 4, -1))  # Off the map
+        self.assertEqual(player.position, (4, 0))
+        self.assertTrue(self.moves.flush(self.connection, player, 10.0))
+        self.connection.send_position_update.assert_called_once_with(player, 3)
+
+        self.moves.move(player, self.game_map, 5, 0)
+        self.assertAlmostEqual(self.moves.time_to_send(10.01), 0.04)
+        self.assertFalse(self.moves.flush(self.connection, player, 10.01))
+        self.assertTrue(self.moves.flush(self.connection, player, 10.05))
+        self.assertEqual(self.connection.send_position_update.call_count, 2)
+        self.assertIsNone(self.moves.time_to_send(10.1))
+
+    def test_agreeing_ack_keeps_the_prediction(self):
+        player = self.Player(1, 0)
+        self.moves.move(player, self.game_map, 2, 0)
+        self.moves.move(player, self.game_map, 3, 0)
+        self.moves.acknowledge(1, [2, 0])
+        self.assertFalse(self.moves.reconcile(player, self.game_map))
+        self.assertEqual(player.position, (3, 0))
+        self.assertEqual([move[0] for move in self.moves.pending], [2])
+
+    def test_rejected_move_is_replayed_from_the_server_position(self):
+        player = self.Player(1, 0)
+        self.moves.move(player, self.game_map, 2, 0)
+        self.moves.flush(self.connection, player, 10.0)
+        self.moves.move(player, self.game_map, 2, 1)
+        # The server kept the player at (1, 0), the later move down is made again from there
+        self.moves.acknowledge(1, [1, 0])
+        self.assertTrue(self.moves.reconcile(player, self.game_map))
+        self.assertEqual(player.position, (1, 1))
+        self.assertFalse(self.moves.reconcile(player, self.game_map))
+        self.assertTrue(self.moves.flush(self.connection, player, 10.1))
+        self.connection.send_position_update.assert_called_with(player, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
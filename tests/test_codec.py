@@ -0,0 +1,58 @@
+import unittest
+from codec import CODECS, StructCodec, JsonCodec, decode_packet, negotiate
+from framing import FrameDecoder
+from position import Position2D
+
+
+def round_trip(codec, packet):
+    decoder = FrameDecoder()
+    decoder.feed(codec.encode(packet))
+    return [decode_packet(flags, payload) for flags, payload in decoder.frames()]
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_struct_layouts(self):
+        packets = [
+            {'player_id': 3, 'position': Position2D(4, 5), 'action': 'move'},
+            {'player_id': 3, 'new_position': Position2D(4, 5)},
+            {'player_id': 3, 'position': Position2D(4, 5), 'action': 'move', 'seq': 70000},
+            {'player_id': 3, 'position': Position2D(4, 5), 'move_ack': 70000},
+            {'origin': 'tile', 'action': 'worked', 'tile_pos': Position2D(1, 2), 'is_success': True},
+            {'origin': 'tile', 'action': 'working', 'tile_pos': Position2D(1, 2), 'is_success': False, 'player_id': 7},
+        ]
+        codec = StructCodec()
+        for packet in packets:
+            self.assertIsNotNone(codec.pack(packet))
+            self.assertEqual(round_trip(codec, packet), [packet])
+
+    def test_struct_batch(self):
+        packet = {'tick': 9, 'positions': [(1, 2, 3), (4, 5, 6)], 'left': [7, 8],
+                  'tiles': [{'origin': 'tile', 'action': 'ready', 'tile_pos': Position2D(1, 2), 'is_success': True}],
+                  'snapshot': False}
+        codec = StructCodec()
+        self.assertIsNotNone(codec.pack(packet))
+        self.assertEqual(round_trip(codec, packet), [packet])
+
+    def test_struct_falls_back_to_json(self):
+        codec = StructCodec()
+        packets = [
+            {'player_id': 3, 'message': 'fight_initiated'},
+            {'player_id': 'Player1', 'position': [0, 0], 'action': 'move'},  # id doesn't fit the layout
+            {'player_id': 3, 'new_position': [100000, 0]},  # coordinate doesn't fit the layout
+        ]
+        for packet in packets:
+            self.assertEqual(round_trip(codec, packet), [packet])
+
+    def test_json_codec(self):
+        packet = {'player_id': 3, 'new_position': [4, 5]}
+        self.assertEqual(round_trip(JsonCodec(), packet), [packet])
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate(['msgpack', 'struct', 'json']).name, 'struct')
+        self.assertEqual(negotiate(['json', 'struct']).name, 'json')
+        self.assertEqual(negotiate(None).name, 'json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import subprocess
+import sys
+import textwrap
+import time
+import unittest
+from types import SimpleNamespace
+from draw import MapRenderer, changed_span
+from map import GameMap, COOLING_DOWN, WORKING, FINISHED
+from event_manager import EventManager
+from position import Position2D
+
+
+class FakeWindow:
+    """Just enough of a curses window to see what was written where."""
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.cells = [[' '] * width for _ in range(height)]
+        self.writes = []
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def erase(self):
+        self.cells = [[' '] * self.width for _ in range(self.height)]
+
+    def box(self):
+        for x in range(self.width):
+            self.cells[0][x] = self.cells[-1][x] = '-'
+        for y in range(self.height):
+            self.cells[y][0] = self.cells[y][-1] = '|'
+
+    def addstr(self, y, x, text, attributes=0):
+        self.writes.append((y, x, text))
+        for offset, char in enumerate(text):
+            self.cells[y][x + offset] = char
+
+    def noutrefresh(self):
+        pass
+
+    def inside(self):
+        return [''.join(row[1:-1]) for row in self.cells[1:-1]]
+
+
+class TestMapRenderer(unittest.TestCase):
+
+    def setUp(self):
+        rows = ['xwxwxwxwxw', 'wxwxwxwxwx'] * 5
+        self.game_map = GameMap(EventManager(), 10, 10, ''.join(rows))
+        self.character = SimpleNamespace(position=Position2D(3, 4))
+
+    def expected_lines(self, window, player_positions):
+        """What drawing the map one cell at a time shows."""
+        height, width = window.getmaxyx()
+        start_x = max(1, self.character.position.x - width // 2) - 2
+        start_y = max(1, self.character.position.y - height // 2) - 2
+        lines = []
+        for y in range(1, height - 1):
+            line = ''
+            for x in range(1, width - 1):
+                map_x, map_y = start_x + x, start_y + y
+                tile = self.game_map.get_tile(map_x, map_y)
+                char = ' '
+                if tile:
+                    char = tile.tile_type[0]
+                    if tile.is_finished_work:
+                        char = char.upper()
+                    elif tile.is_cooling_down:
+                        char = '_'
+                if (map_x, map_y) in [(position[0], position[1]) for position in player_positions.values()]:
+                    char = '%'
+                if (map_x, map_y) == self.character.position:
+                    char = '@'
+                line += char
+            lines.append(line)
+        return lines
+
+    def test_frame_matches_drawing_each_cell(self):
+        self.game_map.set_tile_state(2 * 10 + 2, COOLING_DOWN)
+        self.game_map.set_tile_state(5 * 10 + 4, WORKING)
+        self.game_map.set_tile_state(3 * 10 + 1, FINISHED)
+        player_positions = {7: Position2D(5, 5), 8: Position2D(3, 4), 9: Position2D(40, 40)}
+        window = FakeWindow(9, 14)
+        MapRenderer(window).draw(self.game_map, self.character, player_positions)
+        self.assertEqual(window.inside(), self.expected_lines(window, player_positions))
+
+    def test_only_changed_cells_are_written(self):
+        window = FakeWindow(9, 14)
+        renderer = MapRenderer(window)
+        player_positions = {7: Position2D(5, 5)}
+        renderer.draw(self.game_map, self.character, player_positions)
+        window.writes.clear()
+        player_positions[7] = Position2D(6, 5)
+        renderer.draw(self.game_map, self.character, player_positions)
+        # Only the line the other player moved along
+        self.assertEqual(len(window.writes), 1)
+        self.assertEqual(window.inside(), self.expected_lines(window, player_positions))
+
+        window.writes.clear()
+        renderer.draw(self.game_map, self.character, player_positions)
+        self.assertEqual(window.writes, [])
+
+    def test_changed_span(self):
+        self.assertIsNone(changed_span('abcd', 'abcd'))
+        self.assertEqual(changed_span('abcd', 'aXcd'), (1, 2))
+        self.assertEqual(changed_span('abcd', 'XbcY'), (0, 4))
+
+
+# Draws a frame with the real draw(), waits for a key like the main loop and draws again
+DRAW_GETCH_DRAW = textwrap.dedent('''
+    import curses, os, sys
+    from types import SimpleNamespace
+    sys.path.insert(0, os.getcwd())
+    from client import MessageHistory, WorldSnapshot
+    from draw import ScreenMeasurements, draw, draw_bottom_right
+    from character import Stats
+    from map import GameMap, default_map_string
+    from position import Position2D
+
+    def run(stdscr):
+        screen = ScreenMeasurements(stdscr)
+        stdscr.nodelay(True)
+        connection = SimpleNamespace(message_history=MessageHistory())
+        character = SimpleNamespace(position=Position2D(8, 8), stats=Stats())
+        world = WorldSnapshot(1, GameMap(None, 50, 11, default_map_string), {})
+        for frame in range(3):
+            if frame == 2:
+                screen.repaint()  # As after a resize
+            draw(screen, '', '', connection, character, world)
+            draw_bottom_right(screen, '', '', connection, character, world, {'q': ('Quit the game', None)})
+            curses.doupdate()
+            os.write(sys.stdout.fileno(), b'<frame done>')
+            stdscr.getch()
+
+    curses.wrapper(run)
+''')
+
+
+@unittest.skipUnless(sys.platform != 'win32', "needs a pseudo terminal")
+class TestDrawInTerminal(unittest.TestCase):
+
+    def run_in_terminal(self, script):
+        import fcntl, pty, struct, termios
+        master, slave = pty.openpty()
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack('HHHH', 40, 120, 0, 0))
+        process = subprocess.Popen([sys.executable, '-c', script], stdin=slave, stdout=slave, stderr=slave,
+                                   env={**os.environ, 'TERM': 'xterm'}, cwd=os.path.dirname(os.path.dirname(__file__)) or '.')
+        os.close(slave)
+        output = b''
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                break  # The child has exited and closed the terminal
+            if not data:
+                break
+            output += data
+        process.wait(5)
+        os.close(master)
+        return output
+
+    def test_getch_does_not_clear_the_screen(self):
+        output = self.run_in_terminal(DRAW_GETCH_DRAW)
+        frames = output.split(b'<frame done>')
+        self.assertEqual(len(frames), 4, output[-500:])
+        self.assertIn(b'Map 8, 8', frames[0])
+        self.assertIn(b'Character Sheet', frames[0])
+        # Nothing changed, so nothing was cleared or redrawn by the second frame
+        self.assertNotIn(b'\x1b[2J', frames[1])
+        self.assertNotIn(b'Character Sheet', frames[1])
+        # After a repaint every panel is drawn again, not just the map
+        for text in (b'\x1b[2J', b'Map 8, 8', b'Character Sheet', b'Quit the game'):
+            self.assertIn(text, frames[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import gc
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from event_manager import EventManager
+
+
+class Listener:
+    def __init__(self):
+        self.calls = []
+
+    def on_event(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+
+class TestEventManager(unittest.TestCase):
+
+    def test_publish_and_unsubscribe(self):
+        event_manager = EventManager()
+        listener = Listener()
+        event_manager.subscribe('tile_worked', listener.on_event)
+        event_manager.publish('tile_worked', position=(1, 1))
+        self.assertTrue(event_manager.unsubscribe('tile_worked', listener.on_event))
+        self.assertFalse(event_manager.unsubscribe('tile_worked', listener.on_event))
+        event_manager.publish('tile_worked', position=(2, 2))
+        self.assertEqual(listener.calls, [((), {'position': (1, 1)})])
+        self.assertNotIn('tile_worked', event_manager.listeners)
+
+    def test_subscribing_while_publishing(self):
+        event_manager = EventManager()
+        late = Listener()
+        # Listeners added during a publish only hear the next one
+        event_manager.subscribe('tile_ready', lambda: event_manager.subscribe('tile_ready', late.on_event))
+        event_manager.publish('tile_ready')
+        self.assertEqual(late.calls, [])
+        event_manager.publish('tile_ready')
+        self.assertEqual(len(late.calls), 1)
+
+    def test_weak_listeners_are_dropped(self):
+        event_manager = EventManager()
+        kept = Listener()
+        dropped = Listener()
+        event_manager.subscribe('tile_ready', kept.on_event, weak=True)
+        event_manager.subscribe('tile_ready', dropped.on_event, weak=True)
+        del dropped
+        gc.collect()
+        self.assertEqual(len(event_manager.listeners['tile_ready']), 1)
+        event_manager.publish('tile_ready')
+        self.assertEqual(len(kept.calls), 1)
+
+    def test_dispatch_to_an_executor(self):
+        with ThreadPoolExecutor(1) as executor:
+            event_manager = EventManager(dispatch=executor.submit)
+            listener = Listener()
+            event_manager.subscribe('tile_ready', listener.on_event)
+            event_manager.subscribe('tile_ready', lambda: 1 / 0)
+            for number in range(3):
+                event_manager.publish('tile_ready', number)
+        # Run in order, and a failing listener doesn't stop the worker
+        self.assertEqual(listener.calls, [((0,), {}), ((1,), {}), ((2,), {})])
+
+
+if __name__ == '__main__':
+    unittest.main()
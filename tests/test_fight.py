@@ -5,21 +5,27 @@ import threading
 from character import Character
 from map import GameMap, Tile, default_map_string
 import json
+import tempfile
 import client
 from server import GameServer
 from unittest.mock import patch, MagicMock
 from position import Position2D
-from fight import FightManager
+from fight import FightManager, FightRegistry, FightAction, FightResolution
+from event_manager import EventManager
+from server import GameWorld
 
 class TestFight(unittest.TestCase):
 
     def test_fight(self):
         # Will hang forever due to start() loop
-        server = GameServer()
+        server = GameServer(port=43212)
         # server.handle_client = MagicMock()
         server_thread = threading.Thread(target=server.start, args=(), daemon=True)
         server_thread.start()
-        connection = client.Connection()
+        server.ready.wait(5)
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(cache.cleanup)
+        connection = client.Connection(port=43212, cache_dir=cache.name)
         self.assertIsNotNone(connection.map)
 
         player_id=1
@@ -49,5 +55,49 @@ class TestFight(unittest.TestCase):
         return True
 
 
+class TestFightRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.world = GameWorld(EventManager())
+        self.world.event_manager.publish = MagicMock()
+        self.players = {
+            2: {"position": Position2D(1, 2)},
+            3: {"position": Position2D(20, 2)},
+            4: {"position": Position2D(21, 2)},
+        }
+        self.registry = FightRegistry()
+
+    def test_rounds_resolve_together(self):
+        first = FightManager(1, [0, 0], self.players, self.world)
+        second = FightManager(3, [20, 2], self.players, self.world)
+        self.assertTrue(self.registry.add(first, now=100))
+        self.assertTrue(self.registry.add(second, now=101))
+        self.assertIs(self.registry.get(2), first)
+
+        self.assertTrue(self.registry.set_action(1, FightAction.STAB))
+        self.assertTrue(self.registry.set_action(2, FightAction.SLASH))
+        self.assertTrue(self.registry.set_action(4, FightAction.PARRY))
+        self.assertFalse(self.registry.set_action(5, FightAction.PARRY))
+        self.assertEqual(self.registry.resolve_due(now=104), [])
+        self.assertEqual(self.registry.resolve_due(now=106),
+                         [(first, FightResolution.RIGHTWINS), (second, FightResolution.RIGHTWINS)])
+        # The next round starts with no actions
+        self.assertEqual(first.aggressor_action, FightAction.NONE)
+        self.assertEqual(self.registry.resolve_due(now=110), [])
+        self.assertEqual(len(self.registry.resolve_due(now=111)), 2)
+
+    def test_ended_fights_are_removed(self):
+        fight = FightManager(1, [0, 0], self.players, self.world)
+        self.registry.add(fight, now=100)
+        # A player can only be in one fight at a time
+        self.assertFalse(self.registry.add(FightManager(1, [0, 0], self.players, self.world)))
+        self.assertIs(self.registry.end(2), fight)
+        self.assertTrue(fight.exit_flag)
+        self.assertNotIn(1, self.registry)
+        self.assertEqual(len(self.registry), 0)
+        self.assertIsNone(self.registry.end(2))
+        self.assertEqual(self.registry.resolve_due(now=200), [])
+
+
 if __name__ == '__main__':
     unittest.main()
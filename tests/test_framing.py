@@ -0,0 +1,58 @@
+import unittest
+import socket
+from framing import FrameDecoder, FrameTooLarge, HEADER, encode_frame, encode_json, decode_json, FLAG_COMPRESSED
+
+
+class TestFrameDecoder(unittest.TestCase):
+
+    def test_nested_packets(self):
+        # Nested objects used to be split at the first '}'
+        packet = {'request': 'map', 'map': {'width': 2, 'tiles': [{'a': 1}, {'b': 2}]}}
+        decoder = FrameDecoder()
+        decoder.feed(encode_json(packet) + encode_json({'action': 'move'}))
+        decoded = [decode_json(flags, payload) for flags, payload in decoder.frames()]
+        self.assertEqual(decoded, [packet, {'action': 'move'}])
+        self.assertEqual(len(decoder), 0)
+
+    def test_oversized_frame_is_refused_before_buffering(self):
+        decoder = FrameDecoder(max_frame_size=1000)
+        decoder.feed(encode_frame(b'x' * 1000) + HEADER.pack(200_000_000, 0))
+        frames = decoder.frames()
+        self.assertEqual(bytes(next(frames)[1]), b'x' * 1000)
+        with self.assertRaises(FrameTooLarge):
+            next(frames)
+        self.assertLess(len(decoder.buffer), 10000)
+
+    def test_partial_frames(self):
+        data = encode_json({'player_id': 1, 'new_position': [3, 4]}) * 3
+        decoder = FrameDecoder(size=8)
+        decoded = []
+        for i in range(len(data)):
+            decoder.feed(data[i:i + 1])
+            decoded += [decode_json(flags, payload) for flags, payload in decoder.frames()]
+        self.assertEqual(decoded, [{'player_id': 1, 'new_position': [3, 4]}] * 3)
+
+    def test_compressed_frame_larger_than_buffer(self):
+        packet = {'request': 'map', 'map': 'x' * 100000}
+        frame = encode_json(packet, compress=True)
+        left, right = socket.socketpair()
+        try:
+            left.sendall(frame)
+            left.close()
+            decoder = FrameDecoder(size=16)
+            decoded = []
+            while decoder.recv_into(right):
+                decoded += [(flags, decode_json(flags, payload)) for flags, payload in decoder.frames()]
+            self.assertEqual(decoded, [(FLAG_COMPRESSED, packet)])
+        finally:
+            right.close()
+
+    def test_raw_frame(self):
+        decoder = FrameDecoder()
+        decoder.feed(encode_frame(b'\x01\x02', flags=0))
+        frames = [(flags, bytes(payload)) for flags, payload in decoder.frames()]
+        self.assertEqual(frames, [(0, b'\x01\x02')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from event_manager import EventManager
+from map import GameMap
+from position import Position2D
+
+
+# 20x12 with a wall down x = 9 that has a gap at y = 10
+WALLED_MAP = ''.join("x" * 9 + ("x" if y == 10 else "m") + "x" * 10 for y in range(12))
+
+
+class TestHierarchicalPathfinder(unittest.TestCase):
+
+    def setUp(self):
+        self.game_map = GameMap(EventManager(), 20, 12, WALLED_MAP)
+        self.game_map.use_hierarchical_pathfinding(cluster_size=5)
+
+    def assert_walkable_path(self, path, start, end):
+        self.assertEqual(path[0], start)
+        self.assertEqual(path[-1], end)
+        for tile, next_tile in zip(path, path[1:]):
+            self.assertEqual(abs(tile.x - next_tile.x) + abs(tile.y - next_tile.y), 1)
+            self.assertTrue(self.game_map.is_walkable(next_tile.x, next_tile.y))
+
+    def test_path_through_gap(self):
+        start, end = Position2D(0, 0), Position2D(19, 0)
+        path = self.game_map.find_walkable_path(start, end)
+        self.assert_walkable_path(path, start, end)
+        self.assertIn(Position2D(9, 10), path)
+        # Matches the flat search on this map
+        flat_map = GameMap(EventManager(), 20, 12, WALLED_MAP)
+        self.assertEqual(len(path), len(flat_map.find_walkable_path(start, end)))
+
+    def test_path_inside_one_cluster(self):
+        start, end = Position2D(1, 1), Position2D(3, 4)
+        path = self.game_map.find_walkable_path(start, end)
+        self.assert_walkable_path(path, start, end)
+        self.assertEqual(len(path), 6)
+
+    def test_updates_when_tiles_change(self):
+        start, end = Position2D(0, 0), Position2D(19, 0)
+        self.game_map.get_tile(9, 10).tile_type = 'mountain'
+        self.assertEqual(self.game_map.find_walkable_path(start, end), [])
+        self.game_map.get_tile(9, 2).tile_type = 'bridge'
+        path = self.game_map.find_walkable_path(start, end)
+        self.assert_walkable_path(path, start, end)
+        self.assertIn(Position2D(9, 2), path)
+        self.assertEqual(len(path), 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import logging
+import os
+import tempfile
+import unittest
+from logging_config import SamplingFilter, StructuredFormatter, parse_levels, setup_logging
+
+
+class TestLoggingConfig(unittest.TestCase):
+
+    def test_sampling_keeps_one_in_rate_per_line(self):
+        sampling = SamplingFilter(10)
+        records = [logging.LogRecord('packets', logging.DEBUG, 'server.py', line, 'Received %s', (number,), None)
+                   for number in range(25) for line in (1, 2)]
+        kept = [record for record in records if sampling.filter(record)]
+        self.assertEqual([(record.lineno, record.args) for record in kept],
+                         [(1, (0,)), (2, (0,)), (1, (10,)), (2, (10,)), (1, (20,)), (2, (20,))])
+        self.assertEqual(kept[0].sample_rate, 10)
+
+    def test_structured_records(self):
+        record = logging.LogRecord('packets', logging.DEBUG, 'server.py', 1, 'Received %s', ({'action': 'move'},), None)
+        record.player_id = 3
+        entry = json.loads(StructuredFormatter().format(record))
+        self.assertEqual(entry['message'], "Received {'action': 'move'}")
+        self.assertEqual(entry['logger'], 'packets')
+        self.assertEqual(entry['player_id'], 3)
+
+    def test_parse_levels(self):
+        self.assertEqual(parse_levels("packets=DEBUG, map=warning,=error"),
+                         {'packets': 'DEBUG', 'map': 'WARNING', '': 'ERROR'})
+
+    def test_logs_are_written_by_the_listener(self):
+        root = logging.getLogger()
+        saved = (root.handlers[:], root.level, logging.getLogger('packets').filters[:])
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_name = os.path.join(log_dir, 'test.log')
+            listener = setup_logging(log_name, {'packets': 'DEBUG'}, structured=True, sample_packets=2)
+            try:
+                for number in range(4):
+                    logging.getLogger('packets').debug("Received %s", number, extra={'player_id': 1})
+                logging.getLogger('map').debug("Not logged")
+            finally:
+                listener.stop()
+                root.handlers[:], _, logging.getLogger('packets').filters[:] = saved
+                root.setLevel(saved[1])
+                logging.getLogger('packets').setLevel(logging.NOTSET)
+                for handler in listener.handlers:
+                    handler.close()
+            with open(log_name) as log_file:
+                entries = [json.loads(line) for line in log_file]
+        self.assertEqual([entry['message'] for entry in entries], ["Received 0", "Received 2"])
+        self.assertEqual(entries[0]['player_id'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
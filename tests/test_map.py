@@ -2,7 +2,7 @@ import unittest
 from unittest.mock import patch, MagicMock
 import time
 from client import Connection
-from map import GameMap, Tile, default_map_string, GameMapEncoderDecoder, test_map_string
+from map import GameMap, Tile, default_map_string, GameMapEncoderDecoder, test_map_string, WORKING
 import json
 from event_manager import EventManager
 from position import Position2D
@@ -69,6 +69,58 @@ class TestTile(unittest.TestCase):
         # Check if notify_players was called
         self.assertTrue(evman.publish.called)
 
+    @patch('map.time.time')
+    def test_state_follows_the_clock(self, mock_time):
+        tile = Tile(EventManager(), 'farm', Position2D(1,1))
+        mock_time.return_value = 100.0
+        tile.work(1)
+        mock_time.return_value = 104.9
+        self.assertFalse(tile.is_finished_work)
+        mock_time.return_value = 105.0
+        self.assertTrue(tile.is_finished_work)
+        tile.cooldown(1)
+        self.assertTrue(tile.is_cooling_down)
+        mock_time.return_value = 110.0
+        self.assertTrue(tile.is_ready_to_work)
+        self.assertFalse(tile.is_cooling_down)
+
+    @patch('map.time.time')
+    def test_sweep_publishes_expired_deadlines(self, mock_time):
+        event_manager = EventManager()
+        event_manager.publish = MagicMock()
+        game_map = GameMap(event_manager, 10, 10, test_map_string)
+        mock_time.return_value = 100.0
+        game_map.get_tile(1, 1).work(1)
+        game_map.get_tile(2, 2).work(1)
+        game_map.get_tile(2, 2).work_time = 8
+        event_manager.publish.reset_mock()
+
+        self.assertEqual(game_map.sweep(104.0), 0)
+        self.assertEqual(game_map.sweep(105.0), 1)
+        event_manager.publish.assert_called_once_with('tile_worked', position=Position2D(1, 1), is_success=True)
+        # Its work time was made longer, so it runs out later
+        self.assertEqual(game_map.sweep(107.0), 0)
+        self.assertEqual(game_map.sweep(108.0), 1)
+        self.assertEqual(game_map.sweep(200.0), 0)
+
+        # Activating a finished tile starts the cooldown deadline
+        mock_time.return_value = 200.0
+        game_map.get_tile(1, 1).cooldown(1)
+        event_manager.publish.reset_mock()
+        self.assertEqual(game_map.sweep(205.0), 1)
+        event_manager.publish.assert_called_once_with('tile_ready', position=Position2D(1, 1), is_success=True)
+
+    @patch('map.time.time')
+    def test_untracked_map_keeps_no_deadlines(self, mock_time):
+        # Client maps never sweep, so their heap would only grow
+        game_map = GameMap(EventManager(), 10, 10, test_map_string)
+        game_map.track_deadlines = False
+        mock_time.return_value = 100.0
+        for x in range(1, 4):
+            game_map.get_tile(x, x).work(1)
+        self.assertEqual(game_map.deadlines, [])
+        self.assertEqual(game_map.get_tile(2, 2).state(), WORKING)
+
 class TestMap(unittest.TestCase):
     def test_map_json(self):
         evman = EventManager
@@ -117,6 +169,59 @@ class TestMap(unittest.TestCase):
     #     connection = Connection()
     #     self.assertTrue(connection.map.get_tile(3,5).is_finished_work)
 
+class TestMapSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.server_map = GameMap(EventManager(), 50, 11, default_map_string)
+        self.server_map.get_tile(1, 1).is_cooling_down = True
+        self.server_map.get_tile(2, 1).work_time = 10
+
+    def test_full_snapshot_only_has_changed_tiles(self):
+        snapshot = self.server_map.snapshot()
+        self.assertFalse(snapshot['delta'])
+        self.assertEqual(snapshot['terrain'], default_map_string)
+        self.assertEqual([tile[0] for tile in snapshot['tiles']], [51, 52])
+
+        client_map = GameMap.from_snapshot(EventManager(), json.loads(json.dumps(snapshot)))
+        for (tiles1, tiles2) in zip(self.server_map.map, client_map.map):
+            for (tile1, tile2) in zip(tiles1, tiles2):
+                self.assertEqual(str(tile1), str(tile2))
+
+    def test_delta_since_version(self):
+        client_map = GameMap.from_snapshot(EventManager(), self.server_map.snapshot())
+        self.server_map.get_tile(3, 3).is_finished_work = True
+        self.server_map.get_tile(1, 1).is_cooling_down = False
+
+        snapshot = self.server_map.snapshot(client_map.synced_version, client_map.epoch, client_map.get_terrain_hash())
+        self.assertTrue(snapshot['delta'])
+        self.assertNotIn('terrain', snapshot)
+        self.assertEqual(sorted(tile[0] for tile in snapshot['tiles']), [51, 153])
+
+        client_map.apply_snapshot(snapshot)
+        self.assertTrue(client_map.get_tile(3, 3).is_finished_work)
+        self.assertFalse(client_map.get_tile(1, 1).is_cooling_down)
+        self.assertEqual(client_map.get_tile(2, 1).work_time, 10)
+        self.assertEqual(client_map.synced_version, self.server_map.version)
+
+    def test_cached_terrain_from_another_server_run(self):
+        client_map = GameMap.from_snapshot(EventManager(), self.server_map.snapshot())
+        restarted_map = GameMap(EventManager(), 50, 11, default_map_string)
+        snapshot = restarted_map.snapshot(client_map.synced_version, client_map.epoch, client_map.get_terrain_hash())
+        self.assertFalse(snapshot['delta'])
+        self.assertNotIn('terrain', snapshot)
+        client_map.apply_snapshot(snapshot)
+        self.assertFalse(client_map.get_tile(1, 1).is_cooling_down)
+        self.assertEqual(client_map.get_tile(2, 1).work_time, 5)
+
+    def test_phase_starts_are_moved_onto_the_client_clock(self):
+        snapshot = json.loads(json.dumps(self.server_map.snapshot()))
+        # A server whose clock is 1000 seconds behind ours
+        snapshot['now'] -= 1000
+        for tile in snapshot['tiles']:
+            tile[2] -= 1000
+        client_map = GameMap.from_snapshot(EventManager(), snapshot)
+        self.assertTrue(client_map.get_tile(1, 1).is_cooling_down)
+        self.assertAlmostEqual(client_map.phase_starts[51], self.server_map.phase_starts[51], delta=1)
+
 class TestPosition2D(unittest.TestCase):
     def test_position_creation(self):
         pos = Position2D(3, 4)
@@ -165,6 +270,64 @@ class TestGameMap(unittest.TestCase):
         self.assertEqual(closest_player_id, 3)
         return True
 
+    def test_find_players_near(self):
+        nearby = self.game_map.find_players_near([0, 0], self.players)
+        self.assertEqual([(player_id, steps) for player_id, _, steps in nearby], [(1, 3), (2, 7), (3, 11)])
+        nearby = self.game_map.find_players_near([0, 0], self.players, max_distance=7, exclude=1)
+        self.assertEqual([(player_id, steps) for player_id, _, steps in nearby], [(2, 7)])
+
+    def test_find_players_near_walks_around_obstacles(self):
+        # A river across the map with a bridge at x = 9
+        map_string = "x" * 50 + "r" * 9 + "b" + "x" * 40
+        game_map = GameMap(self.event_manager, 10, 10, map_string)
+        players = {1: {"position": Position2D(0, 6)}}
+        nearby = game_map.find_players_near([0, 4], players)
+        self.assertEqual(nearby[0][2], 20)
+        self.assertEqual(game_map.find_players_near([0, 4], players, max_distance=19), [])
+
+        players = {1: {"position": Position2D(0, 6)}}
+        closed_map = GameMap(self.event_manager, 10, 10, "x" * 50 + "r" * 10 + "x" * 40)
+        self.assertEqual(closed_map.find_closest_player_to_player(0, [0, 4], players), (None, None))
+
+    def test_path_reachability(self):
+        # A river across the map with a bridge at x = 9
+        game_map = GameMap(self.event_manager, 10, 10, "x" * 50 + "r" * 9 + "b" + "x" * 40)
+        start, end = Position2D(0, 4), Position2D(0, 6)
+        self.assertTrue(game_map.is_path_walkable(start, end))
+        self.assertFalse(game_map.is_path_walkable(start, Position2D(0, 5)))
+        self.assertFalse(game_map.is_path_walkable(start, Position2D(10, 0)))
+        self.assertEqual(game_map.path_distance(start, end), 20)
+        # The second search comes from the cache, and reuses the grid after resetting it
+        self.assertEqual(game_map.find_walkable_path(start, end), game_map.find_walkable_path(start, end))
+        self.assertEqual(len(game_map.path_cache), 1)
+        self.assertEqual(game_map.path_distance(end, start), 20)
+
+    def test_path_cache_invalidated_by_walkability(self):
+        game_map = GameMap(self.event_manager, 10, 10, "x" * 50 + "r" * 9 + "b" + "x" * 40)
+        start, end = Position2D(0, 4), Position2D(0, 6)
+        game_map.path_distance(start, end)
+        # Still walkable, the cached paths stay
+        game_map.get_tile(0, 0).tile_type = 'woods'
+        self.assertEqual(len(game_map.path_cache), 1)
+        # Taking the bridge away cuts the map in two
+        game_map.get_tile(9, 5).tile_type = 'river'
+        self.assertEqual(len(game_map.path_cache), 0)
+        self.assertFalse(game_map.is_path_walkable(start, end))
+        self.assertIsNone(game_map.path_distance(start, end))
+        game_map.get_tile(0, 5).tile_type = 'bridge'
+        self.assertEqual(game_map.path_distance(start, end), 2)
+
+    def test_copy_keeps_its_own_path_caches(self):
+        game_map = GameMap(self.event_manager, 10, 10, "x" * 50 + "r" * 9 + "b" + "x" * 40)
+        start, end = Position2D(0, 4), Position2D(0, 6)
+        copy = game_map.copy()
+        copy.path_distance(start, end)
+        # Changing the original's terrain leaves what the copy worked out alone
+        game_map.get_tile(9, 5).tile_type = 'river'
+        self.assertEqual(len(copy.path_cache), 1)
+        self.assertEqual(copy.path_distance(start, end), 20)
+        self.assertIsNone(game_map.path_distance(start, end))
+
     def test_find_closest_player_no_players(self):
         closest_player_id, closest_player_pos = self.game_map.find_closest_player_to_player(1, [0,0], [])
         self.assertIsNone(closest_player_id)  # No players should return None
@@ -0,0 +1,48 @@
+import unittest
+from outbound import OutboundQueue, OverflowPolicy
+
+
+class TestOutboundQueue(unittest.TestCase):
+
+    def test_drop_oldest_position_update(self):
+        outbox = OutboundQueue(max_size=3, policy=OverflowPolicy.DROP_OLDEST)
+        outbox.put(b'message')
+        outbox.put(b'position1', droppable=True)
+        outbox.put(b'position2', droppable=True)
+        self.assertTrue(outbox.put(b'position3', droppable=True))
+        frames, closed = outbox.drain()
+        self.assertEqual(frames, [b'message', b'position2', b'position3'])
+        self.assertFalse(closed)
+        self.assertEqual(outbox.dropped, 1)
+
+    def test_overflow_without_droppable_frames_disconnects(self):
+        outbox = OutboundQueue(max_size=2, policy=OverflowPolicy.DROP_OLDEST)
+        outbox.put(b'a')
+        outbox.put(b'b')
+        self.assertFalse(outbox.put(b'c'))
+        self.assertEqual(outbox.drain(), ([], True))
+
+    def test_disconnect_policy(self):
+        overflows = []
+        outbox = OutboundQueue(max_size=1, policy=OverflowPolicy.DISCONNECT, on_overflow=lambda: overflows.append(True))
+        outbox.put(b'position1', droppable=True)
+        self.assertFalse(outbox.put(b'position2', droppable=True))
+        self.assertFalse(outbox.put(b'position3', droppable=True))
+        self.assertEqual(outbox.drain(), ([], True))
+        # The connection is closed once, the writer may be stuck writing to it
+        self.assertEqual(overflows, [True])
+
+    def test_close_keeps_queued_frames(self):
+        woken = []
+        outbox = OutboundQueue(on_ready=lambda: woken.append(True))
+        outbox.put(b'quit')
+        outbox.put(b'queued')
+        outbox.close()
+        self.assertFalse(outbox.put(b'late'))
+        self.assertEqual(outbox.get(timeout=1), ([b'quit', b'queued'], True))
+        # Woken for the first frame and for the close, not for every frame
+        self.assertEqual(len(woken), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from players import PlayerRegistry
+
+
+class TestPlayerRegistry(unittest.TestCase):
+
+    def test_ids_are_not_reused(self):
+        players = PlayerRegistry()
+        first = players.add({'name': 'first'})
+        second = players.add({'name': 'second'})
+        players.remove(first)
+        third = players.add({'name': 'third'})
+        self.assertEqual((first, second, third), (1, 2, 3))
+        self.assertEqual(sorted(players), [2, 3])
+        self.assertEqual(players[3]['name'], 'third')
+        self.assertIsNone(players.remove(first))
+
+    def test_iteration_sees_a_snapshot(self):
+        players = PlayerRegistry()
+        for _ in range(3):
+            players.add({})
+        version = players.version
+        seen = []
+        for player_id in players:
+            # Joining and leaving while iterating doesn't disturb the loop
+            players.remove(player_id)
+            players.add({})
+            seen.append(player_id)
+        self.assertEqual(seen, [1, 2, 3])
+        self.assertEqual(sorted(players), [4, 5, 6])
+        self.assertEqual(players.version, version + 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import threading
+from scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_callbacks_run_in_deadline_order(self):
+        scheduler = Scheduler()
+        scheduler.start()
+        calls = []
+        done = threading.Event()
+        scheduler.call_later(0.03, calls.append, 'third')
+        scheduler.call_later(0.01, calls.append, 'first')
+        scheduler.call_later(0.02, calls.append, 'second')
+        scheduler.call_later(0.04, done.set)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(calls, ['first', 'second', 'third'])
+
+    def test_cancel(self):
+        scheduler = Scheduler()
+        scheduler.start()
+        calls = []
+        done = threading.Event()
+        handle = scheduler.call_later(0.01, calls.append, 'cancelled')
+        scheduler.call_later(0.02, done.set)
+        handle.cancel()
+        self.assertTrue(done.wait(2))
+        self.assertEqual(calls, [])
+
+    def test_thread_count_is_constant(self):
+        scheduler = Scheduler()
+        scheduler.start()
+        threads = threading.active_count()
+        handles = [scheduler.call_later(60, print) for _ in range(1000)]
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(len(scheduler), 1000)
+        for handle in handles:
+            handle.cancel()
+
+    def test_failing_callback_does_not_stop_the_scheduler(self):
+        scheduler = Scheduler()
+        scheduler.start()
+        done = threading.Event()
+        scheduler.call_later(0.01, lambda: 1 / 0)
+        scheduler.call_later(0.02, done.set)
+        self.assertTrue(done.wait(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
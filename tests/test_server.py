@@ -0,0 +1,198 @@
+import unittest
+import socket
+import threading
+import time
+from server import GameServer, AsyncGameServer
+from outbound import OutboundQueue, OverflowPolicy
+from codec import CODECS, decode_packet
+from framing import FrameDecoder, HEADER
+from position import Position2D
+
+
+class TestServerTick(unittest.TestCase):
+
+    def setUp(self):
+        self.server = GameServer(port=43220)
+        for codec in ('struct', 'json', 'struct'):
+            player_id = self.server.players.add({
+                'position': Position2D(0, 0),
+                'outbox': OutboundQueue(),
+                'codec': CODECS[codec],
+            })
+            self.server.player_index.update(player_id, Position2D(0, 0))
+
+    def received(self, player_id):
+        frames, _ = self.server.players[player_id]['outbox'].drain()
+        decoder = FrameDecoder()
+        for frame in frames:
+            decoder.feed(frame)
+        return [decode_packet(flags, payload) for flags, payload in decoder.frames()]
+
+    def test_moves_are_coalesced_into_one_batch(self):
+        for x in range(1, 6):
+            self.server.move_player(1, Position2D(x, 0))
+        self.server.move_player(2, Position2D(0, 3))
+        self.assertEqual(self.received(3), [])
+
+        self.server.tick()
+        for player_id in (1, 2, 3):
+            packets = self.received(player_id)
+            self.assertEqual(len(packets), 1)
+            self.assertEqual(sorted(map(list, packets[0]['positions'])), [[1, 5, 0], [2, 0, 3]])
+
+        # Nothing changed, nothing sent
+        self.server.tick()
+        self.assertEqual(self.received(3), [])
+        self.assertEqual(self.server.tick_stats['ticks'], 1)
+        self.assertEqual(self.server.tick_stats['batches'], 3)
+
+    def test_tile_events_are_batched(self):
+        self.server.world.game_map.get_tile(1, 1).work(1)
+        self.server.move_player(1, Position2D(1, 1))
+        self.server.tick()
+        packets = self.received(2)
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0]['tiles'][0]['action'], 'working')
+        self.assertEqual(list(packets[0]['tiles'][0]['tile_pos']), [1, 1])
+
+
+    def test_world_commands_are_applied_by_the_simulation(self):
+        self.server.process_command(1, {'player_id': 1, 'position': [1, 1], 'action': 'work'})
+        self.server.process_command(1, {'player_id': 1, 'position': [2, 0], 'action': 'move'})
+        self.server.process_command(2, {'request': 'id'})
+        # Only the reply to the request went out straight away, the world is unchanged
+        self.assertEqual(self.received(2)[0]['id'], 2)
+        self.assertTrue(self.server.world.game_map.get_tile(1, 1).is_ready_to_work)
+        self.assertEqual(self.server.world_commands.qsize(), 2)
+
+        self.server.apply_commands(time.monotonic() + 0.05)
+        self.assertFalse(self.server.world.game_map.get_tile(1, 1).is_ready_to_work)
+        self.assertEqual(self.server.players[1]['position'], [2, 0])
+        self.assertEqual(self.server.command_stats['commands'], 2)
+        self.assertEqual(self.server.command_stats['max_backlog'], 2)
+
+    def test_sequenced_moves_are_acknowledged(self):
+        self.server.apply_command(1, {'player_id': 1, 'position': [2, 0], 'action': 'move', 'seq': 7})
+        # (26, 0) is river, the player stays where it was
+        self.server.apply_command(1, {'player_id': 1, 'position': [26, 0], 'action': 'move', 'seq': 8})
+        acks = [(packet['move_ack'], list(packet['position'])) for packet in self.received(1)]
+        self.assertEqual(acks, [(7, [2, 0]), (8, [2, 0])])
+        self.assertEqual(list(self.server.players[1]['position']), [2, 0])
+
+
+class TestServerAreaOfInterest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = GameServer(port=43221, view_radius=10)
+        for position in (Position2D(1, 1), Position2D(5, 5), Position2D(100, 100)):
+            player_id = self.server.players.add({
+                'position': position,
+                'outbox': OutboundQueue(),
+                'codec': CODECS['struct'],
+            })
+            self.server.player_index.update(player_id, position)
+
+    def received(self, player_id):
+        return TestServerTick.received(self, player_id)
+
+    def test_far_players_are_not_notified(self):
+        self.server.move_player(1, Position2D(2, 1))
+        self.server.world.game_map.get_tile(3, 3).work(1)
+        self.server.tick()
+        self.assertEqual(len(self.received(2)), 1)
+        self.assertEqual(self.received(3), [])
+
+    def test_player_entering_a_new_area_gets_a_snapshot(self):
+        self.server.move_player(3, Position2D(12, 5))
+        self.server.move_player(3, Position2D(11, 5))
+        self.server.tick()
+        packets = self.received(3)
+        self.assertEqual(len(packets), 1)
+        self.assertTrue(packets[0]['snapshot'])
+        self.assertEqual(sorted(map(list, packets[0]['positions'])), [[1, 1, 1], [2, 5, 5], [3, 11, 5]])
+        # The players it walked up to see it arrive
+        self.assertEqual([list(position) for position in self.received(1)[0]['positions']], [[3, 11, 5]])
+
+    def test_player_leaving_an_area_is_seen_leaving(self):
+        self.server.move_player(2, Position2D(60, 60))
+        self.server.tick()
+        # Player 1 can't see (60, 60), it is only told to stop showing player 2
+        packets = self.received(1)
+        self.assertEqual((packets[0]['positions'], packets[0]['left']), ([], [2]))
+        self.assertEqual(self.received(3), [])
+
+    def test_disconnected_player_is_seen_leaving(self):
+        self.server.players.remove(2)
+        self.server.apply_command(2, {'action': 'disconnected'})
+        self.assertNotIn(2, self.server.player_index)
+        self.server.tick()
+        self.assertEqual(self.received(1)[0]['left'], [2])
+        self.assertEqual(self.received(3), [])
+
+    def test_move_applied_before_disconnecting_does_not_bring_them_back(self):
+        self.server.move_player(2, Position2D(1, 0))
+        self.server.players.remove(2)
+        self.server.apply_command(2, {'action': 'disconnected'})
+        self.server.tick()
+        packets = self.received(1)
+        self.assertEqual(packets[0]['positions'], [])
+        self.assertEqual(packets[0]['left'], [2])
+        self.assertNotIn(2, self.server.player_index)
+
+    def test_failing_tick_does_not_stop_the_simulation(self):
+        ticks = []
+        def tick():
+            ticks.append(1)
+            if len(ticks) == 1:
+                raise RuntimeError("bad tick")
+        self.server.tick = tick
+        self.server.tick_rate = 100
+        threading.Thread(target=self.server.run_ticks, daemon=True).start()
+        deadline = time.time() + 3
+        while len(ticks) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(len(ticks), 3)
+        self.assertEqual(self.server.tick_stats['errors'], 1)
+
+
+class TestServerSlowClient(unittest.TestCase):
+
+    def assert_disconnected_when_overflowing(self, server):
+        threading.Thread(target=server.start, daemon=True).start()
+        server.ready.wait(5)
+        # A client that connects and then never reads
+        client_socket = socket.create_connection(('127.0.0.1', server.port))
+        self.addCleanup(client_socket.close)
+        deadline = time.time() + 3
+        while 1 not in server.players and time.time() < deadline:
+            time.sleep(0.01)
+        # Enough to fill the socket buffers so the writer blocks, then overflow the queue
+        packet = {'player_id': 1, 'message': 'x' * 1_000_000}
+        while 1 in server.players and time.time() < deadline:
+            server.send_to_player(1, packet)
+            time.sleep(0.001)
+        while 1 in server.players and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn(1, server.players)
+
+    def test_oversized_frame_disconnects(self):
+        server = GameServer(port=43224)
+        threading.Thread(target=server.start, daemon=True).start()
+        server.ready.wait(5)
+        client_socket = socket.create_connection(('127.0.0.1', server.port))
+        self.addCleanup(client_socket.close)
+        client_socket.sendall(HEADER.pack(200_000_000, 0))
+        client_socket.settimeout(3)
+        self.assertEqual(client_socket.recv(1), b'')  # Closed by the server
+
+    def test_disconnect_policy_closes_the_connection(self):
+        self.assert_disconnected_when_overflowing(
+            GameServer(port=43222, outbox_size=4, overflow_policy=OverflowPolicy.DISCONNECT))
+
+    def test_disconnect_policy_closes_the_connection_asyncio(self):
+        self.assert_disconnected_when_overflowing(
+            AsyncGameServer(port=43223, outbox_size=4, overflow_policy=OverflowPolicy.DISCONNECT))
+
+
+if __name__ == '__main__':
+    unittest.main()
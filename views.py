@@ -30,9 +30,9 @@ class WorldView(BaseView):
             "q": ("Quit the game", self.quit_action),
         }
     
-    def draw(self, screen, output, input_buffer, connection, character, player_positions):
-        draw(screen, output, input_buffer, connection, character, player_positions)
-        draw_bottom_right(screen, output, input_buffer, connection, character, player_positions, self.actions)
+    def draw(self, screen, output, input_buffer, connection, character, world):
+        draw(screen, output, input_buffer, connection, character, world)
+        draw_bottom_right(screen, output, input_buffer, connection, character, world, self.actions)
 
     def handle_input(self, command, character, connection):
         """Basic character actions."""
@@ -86,11 +86,11 @@ class LevelUpView(BaseView):
             # You can add more actions here if needed
         }
 
-    def draw(self, screen, output, input_buffer, connection, character, player_positions):
+    def draw(self, screen, output, input_buffer, connection, character, world):
         draw_top_left(screen, character)
-        self.draw_top(screen, output, input_buffer, connection, character, player_positions)
-        self.draw_bottom(screen, output, input_buffer, connection, character, player_positions)
-        draw_bottom_right(screen, output, input_buffer, connection, character, player_positions, self.actions)
+        self.draw_top(screen, output, input_buffer, connection, character, world)
+        self.draw_bottom(screen, output, input_buffer, connection, character, world)
+        draw_bottom_right(screen, output, input_buffer, connection, character, world, self.actions)
 
     def handle_input(self, command, character, connection):
         try:
@@ -107,7 +107,7 @@ class LevelUpView(BaseView):
 
         if character.stats.xp >= character.stats.level_cost:
             input_map = dict()
-            for idx, (stat_name, stat_value) in enumerate(character.stats.levels.__dict__.items(), start=1):
+            for idx, (stat_name, stat_value) in enumerate(character.stats.levels.items(), start=1):
                 input_map[idx] = stat_name
 
             if command not in input_map:
@@ -133,7 +133,7 @@ class LevelUpView(BaseView):
         connection.map.event_manager.publish("switch_view", new_view=View.WORLD)
         return "Switching View"
 
-    def draw_top(self, screen, output, input_buffer, connection, character, player_positions):
+    def draw_top(self, screen, output, input_buffer, connection, character, world):
             # screen.stdscr.clear()
 
         # Create a new window for the level-up menu
@@ -142,8 +142,11 @@ class LevelUpView(BaseView):
             start_y = 0  # Start at the top of the screen
             start_x = 0  # Start at the left of the screen
             self.level_up_win = screen.top_panel2 # HACK Im trying out using an existing panel instead
+        screen.map_renderer.invalidate()
+        if not screen.needs_redraw(self.level_up_win, ('level_up', character.stats.levels.version)):
+            return
 
-        self.level_up_win.clear()
+        self.level_up_win.erase()
         self.level_up_win.box()
 
         # Draw the level-up menu
@@ -151,22 +154,22 @@ class LevelUpView(BaseView):
         self.level_up_win.addstr(1, 1, "Select a stat to increase:")
 
         # List stats dynamically
-        stats_list = vars(character.stats.levels)  # Get all attributes of the Stats class
-        for idx, (stat_name, stat_value) in enumerate(stats_list.items(), start=1):
+        stats_list = character.stats.levels.items()  # Get all attributes of the Stats class
+        for idx, (stat_name, stat_value) in enumerate(stats_list, start=1):
             stat_name = stat_name.replace('max_', '')
             stat_name = stat_name.capitalize()
             self.level_up_win.addstr(idx + 2, 1, f"{idx}. {stat_name} ({stat_value})")
 
         self.level_up_win.addstr(len(stats_list) + 4, 1, "b. Back")
 
-        self.level_up_win.refresh()
+        self.level_up_win.noutrefresh()
 
-    def draw_bottom(self, screen, output, input_buffer, connection, character, player_positions):
+    def draw_bottom(self, screen, output, input_buffer, connection, character, world):
 
         (panel_height, panel_width) = screen.bottom_panel.getmaxyx()
 
         # Create the bottom panel (window)
-        screen.bottom_panel.clear()
+        screen.bottom_panel.erase()
         screen.bottom_panel.box()
         screen.bottom_panel.addstr(0, 1, "Bottom Panel", curses.A_BOLD)
         # Display the output in the bottom panel
@@ -179,14 +182,17 @@ class LevelUpView(BaseView):
 
         message_history_height = panel_height - 6
         last_messages = connection.message_history.get_last_messages(message_history_height)
-        screen.bottom_panel.addstr(4, 1, "Last messages:")
+        # Frequent packets are only counted, say how many there were
+        collapsed = connection.message_history.collapsed_counts()
+        heading = f"Last messages ({collapsed}):" if collapsed else "Last messages:"
+        screen.bottom_panel.addstr(4, 1, heading[:panel_width - 2])
         current_row = 5
         for msg in last_messages:
             # import pdb; pdb.set_trace()
             screen.bottom_panel.addstr(current_row, 1, msg)
             current_row += 1
 
-        screen.bottom_panel.refresh()
+        screen.bottom_panel.noutrefresh()
 
 class BattleView(BaseView):
     def __init__(self):
@@ -197,12 +203,12 @@ class BattleView(BaseView):
             "3": ("Parry", None),
         }
 
-    def draw(self, screen, output, input_buffer, connection, character, player_positions):
+    def draw(self, screen, output, input_buffer, connection, character, world):
         # self.draw_battle_interface(screen, output, input_buffer, player_character, enemy_character)
         self.draw_battle_interface_in_map_area(screen.top_panel2, screen, output, input_buffer, character, character)
         draw_top_left(screen, character)
         draw_bottom(screen, output, input_buffer, connection)
-        draw_bottom_right(screen, output, input_buffer, connection, character, player_positions, self.actions)
+        draw_bottom_right(screen, output, input_buffer, connection, character, world, self.actions)
 
     def handle_input(self, command, character, connection):
         """Handle battle actions based on player input."""
@@ -241,7 +247,9 @@ class BattleView(BaseView):
     
     def draw_battle_interface_in_map_area(self, window, screen, output, input_buffer, player_character, enemy_character):
         """Draw the battle interface in the area where the map is displayed."""
-        window.clear()
+        screen.map_renderer.invalidate()
+        screen.forget(window)
+        window.erase()
         window.box()
 
         (panel_height, panel_width) = screen.top_panel1.getmaxyx()
@@ -256,7 +264,7 @@ class BattleView(BaseView):
         window.addstr(panel_height-2, 1, "3. Parry")
 
 
-        window.refresh()
+        window.noutrefresh()
 
 
 
@@ -268,7 +276,7 @@ class BattleView(BaseView):
             start_x = 0
             self.battle_win = curses.newwin(height, width, start_y, start_x)
 
-        self.battle_win.clear()
+        self.battle_win.erase()
         self.battle_win.box()
 
         # Draw player character on the left
@@ -286,7 +294,7 @@ class BattleView(BaseView):
         self.battle_win.addstr(5, 1, "2. Stab")
         self.battle_win.addstr(6, 1, "3. Parry")
 
-        self.battle_win.refresh()
+        self.battle_win.noutrefresh()
 
 
 
@@ -299,11 +307,11 @@ class DeadView(BaseView):
             # You can add more actions here if needed
         }
 
-    def draw(self, screen, output, input_buffer, connection, character, player_positions):
+    def draw(self, screen, output, input_buffer, connection, character, world):
         draw_top_left(screen, character)
-        self.draw_top(screen, output, input_buffer, connection, character, player_positions)
-        self.draw_bottom(screen, output, input_buffer, connection, character, player_positions)
-        draw_bottom_right(screen, output, input_buffer, connection, character, player_positions, self.actions)
+        self.draw_top(screen, output, input_buffer, connection, character, world)
+        self.draw_bottom(screen, output, input_buffer, connection, character, world)
+        draw_bottom_right(screen, output, input_buffer, connection, character, world, self.actions)
 
     def handle_input(self, command, character, connection):
         try:
@@ -326,22 +334,23 @@ class DeadView(BaseView):
         connection.map.event_manager.publish("switch_view", new_view=View.WORLD)
         return "Switching View"
 
-    def draw_top(self, screen, output, input_buffer, connection, character, player_positions):
+    def draw_top(self, screen, output, input_buffer, connection, character, world):
 
-        screen.top_panel1.clear()
+        screen.forget(screen.top_panel1)
+        screen.top_panel1.erase()
         screen.top_panel1.box()
         screen.bottom_panel.addstr(0, 1, "You died. Please restart the game")
         screen.bottom_panel.addstr(0, 2, "I couldn't be bothered to code restarting the game")
-        screen.top_panel1.refresh()
+        screen.top_panel1.noutrefresh()
 
-    def draw_bottom(self, screen, output, input_buffer, connection, character, player_positions):
+    def draw_bottom(self, screen, output, input_buffer, connection, character, world):
 
         (panel_height, panel_width) = screen.bottom_panel.getmaxyx()
 
         # Create the bottom panel (window)
-        screen.bottom_panel.clear()
+        screen.bottom_panel.erase()
         screen.bottom_panel.box()
-        screen.bottom_panel.refresh()
+        screen.bottom_panel.noutrefresh()
 
 
 